@@ -4,5 +4,5 @@ setup(name='vpyp',
       version='0.1dev',
       author='Victor Chahuneau',
       url='http://github.com/vchahun/vpyp',
-      packages=['vpyp', 'vpyp.ngram', 'vpyp.lda', 'vpyp.align']
+      packages=['vpyp', 'vpyp.ngram', 'vpyp.lda', 'vpyp.align', 'vpyp.bench']
      )
@@ -0,0 +1,27 @@
+from ..corpus import (ParallelCorpus, read_flat_parallel_corpus, read_flat, is_flat,
+        open_corpus)
+
+NULL = '__NULL__'
+
+def read_parallel_corpus(stream, source_vocabulary, target_vocabulary, reverse=False):
+    if reverse:
+        e, f = read_flat_parallel_corpus(stream, target_vocabulary, source_vocabulary)
+    else:
+        f, e = read_flat_parallel_corpus(stream, source_vocabulary, target_vocabulary)
+    return ParallelCorpus(f.prepend(source_vocabulary[NULL]), e)
+
+def load_parallel_sides(path, source_vocabulary, target_vocabulary):
+    """ read a text or binary bitext as (source, target) FlatCorpus, without NULL """
+    if is_flat(path):
+        f, e = read_flat(path)
+        return f.remap(source_vocabulary), e.remap(target_vocabulary)
+    with open_corpus(path) as stream:
+        return read_flat_parallel_corpus(stream, source_vocabulary, target_vocabulary)
+
+def load_parallel_corpus(path, source_vocabulary, target_vocabulary, reverse=False):
+    """ read a text or binary bitext with the ids of the given vocabularies """
+    if reverse:
+        e, f = load_parallel_sides(path, target_vocabulary, source_vocabulary)
+    else:
+        f, e = load_parallel_sides(path, source_vocabulary, target_vocabulary)
+    return ParallelCorpus(f.prepend(source_vocabulary[NULL]), e)
@@ -0,0 +1,64 @@
+import argparse
+import logging
+import multiprocessing
+from itertools import izip
+from .. import container
+from bitext import load_parallel_corpus
+
+_shared = None # (ensemble, corpus, prune) inherited by the forked workers
+
+def align_range(args):
+    start, end = args
+    ensemble, corpus, prune = _shared
+    return [ensemble.align(f, e, prune) for f, e in (corpus[i] for i in xrange(start, end))]
+
+def align_corpus(ensemble, corpus, n_jobs=1, prune=0, chunk_size=1000):
+    """ most probable alignment of each sentence pair under the ensemble """
+    if n_jobs == 1:
+        return [ensemble.align(f, e, prune) for f, e in corpus]
+    global _shared
+    _shared = (ensemble, corpus, prune)
+    chunks = [(start, min(start + chunk_size, len(corpus)))
+            for start in xrange(0, len(corpus), chunk_size)]
+    pool = multiprocessing.Pool(n_jobs)
+    try:
+        return [a for chunk in pool.imap(align_range, chunks) for a in chunk]
+    finally:
+        pool.close()
+        pool.join()
+        _shared = None
+
+def print_alignments(alignments, corpus, reverse=False):
+    fmt = ('{e}-{f}' if reverse else '{f}-{e}')
+    for a, (f, e) in izip(alignments, corpus):
+        print(' '.join(fmt.format(f=j-1, e=i) for i, j in enumerate(a) if j > 0))
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    parser = argparse.ArgumentParser(description='Align a bitext with a trained sample ensemble')
+    parser.add_argument('--model', help='sample ensemble (see train --ensemble)', required=True)
+    parser.add_argument('--input', help='bitext to align (text or binary)', required=True)
+    parser.add_argument('--jobs', help='number of decoding processes', type=int, default=1)
+    parser.add_argument('--prune', help='only consider NULL and the source positions which '
+            'cover 1 - PRUNE of the diagonal prior mass of each target word', type=float,
+            default=0)
+    parser.add_argument('--reverse', help='model was trained in reverse direction',
+            action='store_true')
+
+    args = parser.parse_args()
+
+    logging.info('Loading sample ensemble')
+    ensemble = container.load(args.model)
+    logging.info('Ensemble: %s', ensemble)
+
+    logging.info('Reading parallel data')
+    corpus = load_parallel_corpus(args.input, ensemble.source_vocabulary,
+            ensemble.target_vocabulary, args.reverse)
+
+    logging.info('Aligning %d sentence pairs', len(corpus))
+    alignments = align_corpus(ensemble, corpus, args.jobs, args.prune)
+    print_alignments(alignments, corpus, args.reverse)
+
+if __name__ == '__main__':
+    main()
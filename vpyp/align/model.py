@@ -1,92 +1,334 @@
 import logging
+import random
+from array import array
 from itertools import izip
-from collections import defaultdict
+from collections import OrderedDict, Counter, defaultdict, deque
 try:
     import numpypy
 except ImportError:
     pass
 import numpy, math
-from ..prob import mult_sample, BetaBernouilli
-from ..pyp import PYP
-from ..prior import PYPPrior, GammaPrior, stuple
+from ..prob import BetaBernouilli
+from ..pyp import PYP, merge_tables
+from ..checkpoint import (as_array, seating_state, set_seating, prior_state, set_priors,
+        distribution_state, set_distribution_state)
+from ..prior import PYPPrior, TiedPYPPrior, GammaPrior, stuple
 
 def diagonal_matrix(flen, elen, scale):
-    diag = numpy.array([[math.exp(-scale * abs(j/float(elen)-i/float(flen)))
-                      for j in xrange(elen)]
-                        for i in xrange(flen)])
+    i = numpy.arange(flen).reshape((flen, 1)) / float(flen)
+    j = numpy.arange(elen) / float(elen)
+    diag = numpy.exp(-scale * numpy.abs(j - i))
     return diag / diag.sum(axis=0) # normalize columns
 
+def log_diagonal_matrix(flen, elen, scale):
+    return numpy.log(diagonal_matrix(flen, elen, scale))
+
+def candidate_positions(flen, elen, scale, threshold):
+    """ positions i of the alignment matrix (0: NULL) considered for each target word:
+    NULL and the smallest window of source words which covers 1 - threshold of its
+    diagonal prior mass (at least the best one), whatever the sentence length
+    -> (mask, positions of each target word, diagonal prior mass left out,
+        (positions, target words, diagonal prior) of the candidates by target word,
+        with the bounds of each target word) """
+    diag = diagonal_matrix(flen, elen, scale)
+    order = numpy.argsort(-diag, axis=0, kind='mergesort') # most probable first
+    covered = numpy.cumsum(diag[order, numpy.arange(elen)], axis=0)
+    n_keep = numpy.minimum((covered < 1 - threshold).sum(axis=0) + 1, flen)
+    rank = numpy.empty_like(order)
+    rank[order, numpy.arange(elen)] = numpy.arange(flen).reshape((flen, 1))
+    keep = rank < n_keep
+    mask = numpy.concatenate((numpy.ones((1, elen), dtype=bool), keep))
+    cols, rows = numpy.nonzero(mask.T)
+    bounds = [0] + numpy.cumsum(mask.sum(axis=0)).tolist()
+    positions = [rows[start:end] for start, end in izip(bounds[:-1], bounds[1:])]
+    prior = numpy.where(rows > 0, diag[rows - 1, cols], 0)
+    return mask, positions, (diag * ~keep).sum(axis=0), (rows, cols, prior, bounds)
+
 def alignment_matrix(diag, p_null):
     null_row = p_null * numpy.ones((1, diag.shape[1]))
-    diag *= (1 - p_null)
-    return numpy.concatenate((null_row, diag))
+    return numpy.concatenate((null_row, (1 - p_null) * diag))
+
+class MatrixCache(object):
+    """Bounded LRU cache of matrices keyed by sentence-length pair,
+    built by build(flen, elen, *params) and invalidated when params change.
+    The previous generation is kept so that a rejected MH proposal is free."""
+    def __init__(self, build, size=10000):
+        self.build = build
+        self.size = size
+        self.params, self.matrices = None, OrderedDict()
+        self.previous = (None, OrderedDict())
+
+    def get(self, params, flen, elen):
+        if params != self.params:
+            if params == self.previous[0]:
+                self.previous, (self.params, self.matrices) = ((self.params, self.matrices),
+                        self.previous)
+            else:
+                self.previous = (self.params, self.matrices)
+                self.params, self.matrices = params, OrderedDict()
+        key = (flen, elen)
+        matrix = self.matrices.pop(key, None)
+        if matrix is None:
+            matrix = self.build(flen, elen, *params)
+        self.matrices[key] = matrix # most recently used last
+        if len(self.matrices) > self.size:
+            self.matrices.popitem(last=False)
+        return matrix
 
 class AlignmentDistribution:
     def __init__(self, scale_prior):
         self.scale_prior = scale_prior
         scale_prior.tie(self)
-        self.assignments = defaultdict(list)
+        # {(flen, elen): link counts, (flen+1) x elen with the NULL row first}
+        self.assignments = {}
+        self.cache = MatrixCache(diagonal_matrix)
+        self.log_cache = MatrixCache(log_diagonal_matrix)
+        self.candidate_cache = MatrixCache(candidate_positions)
 
     @property
     def scale(self):
         return self.scale_prior.x
 
     def prob(self, flen, elen):
-        return diagonal_matrix(flen, elen, self.scale)
+        return self.cache.get((self.scale,), flen, elen)
+
+    def candidates(self, flen, elen, threshold):
+        return self.candidate_cache.get((self.scale, threshold), flen, elen)
 
     def increment(self, flen, elen, i, j):
-        self.assignments[flen, elen].append((i, j))
+        counts = self.assignments.get((flen, elen))
+        if counts is None:
+            counts = self.assignments[flen, elen] = numpy.zeros((flen+1, elen), dtype=numpy.int32)
+        counts[i, j] += 1
 
     def decrement(self, flen, elen, i, j):
-        self.assignments[flen, elen].remove((i, j))
+        counts = self.assignments[flen, elen]
+        assert counts[i, j] > 0
+        counts[i, j] -= 1
+
+    def add(self, flen, elen, a, n):
+        """ add n (1 or -1) to the counts of the links of an alignment """
+        counts = self.assignments.get((flen, elen))
+        if counts is None:
+            counts = self.assignments[flen, elen] = numpy.zeros((flen+1, elen), dtype=numpy.int32)
+        counts[a, numpy.arange(elen)] += n
 
     def log_likelihood(self):
         ll = 0
-        for (flen, elen), points in self.assignments.iteritems():
-            a_prob = self.prob(flen, elen)
-            ll += sum(math.log(a_prob[i-1, j]) for i, j in points if i > 0)
-        return ll
+        for (flen, elen), counts in self.assignments.iteritems():
+            log_prob = self.log_cache.get((self.scale,), flen, elen)
+            ll += numpy.tensordot(counts[1:], log_prob) # NULL links excluded
+        return float(ll)
 
     def resample_hyperparemeters(self, n_iter):
         return self.scale_prior.resample(n_iter)
 
+    def get_checkpoint(self):
+        lengths = self.assignments.keys()
+        counts = [self.assignments[length].ravel() for length in lengths]
+        return {'a_table.lengths': as_array(lengths).reshape((len(lengths), 2)),
+                'a_table.counts': (numpy.concatenate(counts) if counts
+                    else numpy.zeros(0, dtype=numpy.int32)),
+                'a_table.scale': prior_state([self.scale_prior])}
+
+    def set_checkpoint(self, state):
+        self.assignments, start = {}, 0
+        counts = state['a_table.counts']
+        for flen, elen in state['a_table.lengths'].tolist():
+            size = (flen + 1) * elen
+            self.assignments[flen, elen] = counts[start:start+size].reshape((flen + 1, elen))
+            start += size
+        set_priors([self.scale_prior], state['a_table.scale'])
+
+    def __getstate__(self):
+        return (self.scale_prior, self.assignments)
+
+    def __setstate__(self, state):
+        if isinstance(state, dict): # pickled by older versions: links of each length pair
+            self.__dict__.update(state)
+            links, self.assignments = self.assignments, {}
+            for (flen, elen), points in links.iteritems():
+                for i, j in points:
+                    self.increment(flen, elen, i, j)
+        else:
+            self.scale_prior, self.assignments = state
+        self.scale_prior.tie(self)
+        self.cache = MatrixCache(diagonal_matrix)
+        self.log_cache = MatrixCache(log_diagonal_matrix)
+        self.candidate_cache = MatrixCache(candidate_positions)
+
     def __repr__(self):
         return 'AlignmentDistribution(scale ~ {self.scale_prior})'.format(self=self)
 
+T_BLOCK = 1000 # source words per section of a chunked model file
+
+def t_table_section(f):
+    """ section of the t-table row of source word f, and position in the section """
+    return 't_table.{0}'.format(f // T_BLOCK), f % T_BLOCK
+
+def frequency_buckets(counts, boundaries):
+    """ bucket of each source word: the number of boundaries <= its count """
+    return numpy.searchsorted(sorted(boundaries), counts, 'right').tolist()
+
+def seat_counts(base, counts):
+    """ seat counts[k] customers of each dish k in a base (removed if negative) """
+    for k, n in counts.iteritems():
+        for _ in xrange(abs(n)):
+            if n > 0:
+                base.increment(k)
+            else:
+                base.decrement(k)
+
 class AlignmentModel(object):
-    def __init__(self, n_source, t_base):
+    def __init__(self, n_source, t_base, prune=0, buckets=None):
         """AlignmentModel(n_source, t_base) -> alignment model
         n_source: size of the source vocabulary
-        t_base: shared base of the t-table PYPs"""
+        t_base: shared base of the t-table PYPs
+        prune: only sample NULL and the source positions which cover 1 - prune of the
+            diagonal prior mass of each target word
+        buckets: bucket of each source word, whose t-table PYPs share their prior
+            (default: one prior per source word)"""
+        self.prune = prune
+        self.dropped_mass = 0. # prior mass left out by pruning
         self.null = BetaBernouilli(1.0, 1.0) # p(NULL) ~ Beta(1, 1)
         self.a_table = AlignmentDistribution(GammaPrior(1.0, 1.0, 4.0))
         self.t_base = t_base
-        self.t_table = [PYP(self.t_base, PYPPrior(1.0, 1.0, 1.0, 1.0, 0.1, 1.0))
-                for _ in xrange(n_source)]
+        if buckets is None:
+            self.t_table = [PYP(self.t_base, PYPPrior(1.0, 1.0, 1.0, 1.0, 0.1, 1.0))
+                    for _ in xrange(n_source)]
+        else:
+            priors = [TiedPYPPrior(1.0, 1.0, 1.0, 1.0, 0.1, 1.0)
+                    for _ in xrange(max(buckets) + 1 if buckets else 0)]
+            self.t_table = [PYP(self.t_base, priors[b]) for b in buckets]
 
     @property
     def p_null(self):
         return self.null.prob(1)
 
     def increment(self, f, e):
-        a_prob = alignment_matrix(self.a_table.prob(len(f)-1, len(e)), self.p_null)
+        f_types, f_index = numpy.unique(f, return_inverse=True)
+        e_types, e_index = numpy.unique(e, return_inverse=True)
+        e_types = e_types.tolist()
+        if self.prune:
+            _, positions, dropped, (rows, cols, diag, bounds) = self.a_table.candidates(
+                    len(f)-1, len(e), self.prune)
+            self.dropped_mass += (1 - self.p_null) * dropped.sum()
+            needed = numpy.zeros((len(f_types), len(e_types)), dtype=bool)
+            needed[f_index[rows], e_index[cols]] = True
+            pairs = izip(*numpy.nonzero(needed))
+            a_prob = numpy.where(rows == 0, self.p_null, (1 - self.p_null) * diag)
+        else:
+            a_prob = alignment_matrix(self.a_table.prob(len(f)-1, len(e)), self.p_null).T.ravel()
+            positions = [numpy.arange(len(f))] * len(e)
+            bounds = range(0, len(f) * (len(e) + 1), len(f))
+            pairs = ((u, v) for u in xrange(len(f_types)) for v in xrange(len(e_types)))
+        # t-table statistics for the (source type, target type) pairs of the sentence
+        t_words = [self.t_table[fi] for fi in f_types]
+        customers = numpy.zeros((len(f_types), len(e_types)))
+        tables = numpy.zeros((len(f_types), len(e_types)))
+        for u, v in pairs:
+            t_word, ej = t_words[u], e_types[v]
+            if ej in t_word.tables:
+                customers[u, v] = t_word.ncustomers[ej]
+                tables[u, v] = len(t_word.tables[ej])
+        d = numpy.array([t_word.d for t_word in t_words])
+        theta = numpy.array([t_word.theta for t_word in t_words])
+        ntables = numpy.array([t_word.ntables for t_word in t_words], dtype=float)
+        total = numpy.array([t_word.total_customers for t_word in t_words], dtype=float)
+        base = numpy.array([self.t_base.prob(ej) for ej in e_types])
         for j, ej in enumerate(e):
-            i = mult_sample((i, self.t_table[fi].prob(ej) * a_prob[i, j])
-                    for i, fi in enumerate(f))
+            v, candidates = e_index[j], positions[j]
+            us = f_index[candidates]
+            t_prob = ((customers[us, v] - d[us] * tables[us, v]
+                + (theta[us] + d[us] * ntables[us]) * base[v]) / (theta[us] + total[us]))
+            cumulative = numpy.cumsum(t_prob * a_prob[bounds[j]:bounds[j+1]])
+            x = random.random() * cumulative[-1]
+            i = int(candidates[min(numpy.searchsorted(cumulative, x, 'right'),
+                len(candidates) - 1)])
             self.null.increment(i==0)
             self.a_table.increment(len(f)-1, len(e), i, j)
-            self.t_table[f[i]].increment(ej)
+            u = f_index[i]
+            t_word = t_words[u]
+            t_word.increment(ej)
+            customers[u, v] = t_word.ncustomers[ej]
+            tables[u, v] = len(t_word.tables[ej])
+            if t_word.ntables > ntables[u]: # new table: the base has changed
+                base = numpy.array([self.t_base.prob(ek) for ek in e_types])
+            ntables[u] = t_word.ntables
+            total[u] = t_word.total_customers
             yield i
 
+    def count_links(self, f, e, a, n):
+        """ add n (1 or -1) to the NULL and alignment counts of an alignment a (e.g.
+        sampled by another process, whose t-table seating is merged separately) """
+        self.null.positive += n * a.count(0)
+        self.null.total += n * len(e)
+        self.a_table.add(len(f)-1, len(e), a, n)
+
+    def t_seating(self, pairs):
+        """ tables of the (f, e) pairs in the t-table, and of their target words
+        in the base if it is a PYP """
+        tables = dict(((fi, ej), list(self.t_table[fi].tables.get(ej, [])))
+                for fi, ej in pairs)
+        if not isinstance(self.t_base, PYP): return tables, {}
+        return tables, dict((ej, list(self.t_base.tables.get(ej, []))) for _, ej in pairs)
+
+    def merge_t_seating(self, seatings):
+        """ merge the t_seating of the pairs changed by each of several processes
+        sampling from the current seating (vpyp.pyp.merge_tables)
+        -> merged t_seating of the changed pairs """
+        tables, base_tables = defaultdict(list), defaultdict(list)
+        for t_tables, t_base_tables in seatings:
+            for pair, sizes in t_tables.iteritems():
+                tables[pair].append(sizes)
+            for ej, sizes in t_base_tables.iteritems():
+                base_tables[ej].append(sizes)
+        merged = ({}, {})
+        opened = Counter() # tables opened in the base
+        unseen = Counter() # by the merge of tables changed by several processes
+        for (fi, ej), finals in tables.iteritems():
+            t_word = self.t_table[fi]
+            start = t_word.tables.get(ej, [])
+            changes = sum(len(final) - len(start) for final in finals)
+            merged[0][fi, ej] = sizes = merge_tables(start, finals)
+            n = t_word._set_tables(ej, sizes)
+            opened[ej] += n
+            unseen[ej] += n - changes
+        if isinstance(self.t_base, PYP):
+            base_opened = {}
+            for ej, finals in base_tables.iteritems():
+                sizes = merge_tables(self.t_base.tables.get(ej, []), finals)
+                base_opened[ej] = self.t_base._set_tables(ej, sizes)
+            seat_counts(self.t_base.base, base_opened)
+            seat_counts(self.t_base, unseen)
+            for ej in base_tables:
+                merged[1][ej] = list(self.t_base.tables.get(ej, []))
+        else:
+            seat_counts(self.t_base, opened)
+        return merged
+
+    def set_t_seating(self, seating):
+        """ replace the tables of the pairs of a t_seating """
+        tables, base_tables = seating
+        for (fi, ej), sizes in tables.iteritems():
+            self.t_table[fi]._set_tables(ej, sizes)
+        for ej, sizes in base_tables.iteritems():
+            self.t_base._set_tables(ej, sizes)
+
     def decrement(self, f, e, a):
         for j, (ej, i) in enumerate(izip(e, a)):
             self.null.decrement(i==0)
             self.a_table.decrement(len(f)-1, len(e), i, j)
             self.t_table[f[i]].decrement(ej)
 
+    def t_priors(self):
+        """ distinct priors of the t-table PYPs """
+        return OrderedDict((id(t_word.prior), t_word.prior)
+                for t_word in self.t_table).values()
+
     def log_likelihood(self):
-        return (sum(t_word.log_likelihood() + t_word.prior.log_likelihood()
-                    for t_word in self.t_table)
+        return (sum(t_word.log_likelihood() for t_word in self.t_table)
+                + sum(prior.log_likelihood() for prior in self.t_priors())
                 + self.t_base.log_likelihood(full=True)
                 + self.null.log_likelihood()
                 + self.a_table.log_likelihood() + self.a_table.scale_prior.log_likelihood())
@@ -96,31 +338,294 @@ class AlignmentModel(object):
         logging.info('Resampling t-table PYP base hyperparameters')
         ar += self.t_base.resample_hyperparemeters(n_iter)
         logging.info('Resampling t-table PYP hyperparameters')
-        for t_word in self.t_table:
-            ar += t_word.resample_hyperparemeters(n_iter)
+        for prior in self.t_priors():
+            ar += prior.resample(n_iter)
         logging.info('Resampling alignment distribution scale parameter')
         ar += self.a_table.resample_hyperparemeters(n_iter)
         return ar
 
+    def resample_base(self): # the customers of the base are the tables of the t-table
+        if isinstance(self.t_base, PYP):
+            self.t_base.resample_seating()
+            self.t_base.resample_base()
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.setdefault('prune', 0) # pickled by older versions
+        self.__dict__.setdefault('dropped_mass', 0.)
+
+    def sections(self):
+        """ sections of a chunked model file (vpyp.container): blocks of t-table rows """
+        sections = [('t_base', [self.t_base])]
+        priors = self.t_priors()
+        if len(priors) < len(self.t_table): # tied across blocks
+            sections.append(('t_priors', priors))
+        for name in ('source_vocabulary', 'target_vocabulary'):
+            if hasattr(self, name):
+                sections.append((name, [getattr(self, name)]))
+        return sections + [(t_table_section(f)[0], self.t_table[f:f+T_BLOCK])
+                for f in xrange(0, len(self.t_table), T_BLOCK)]
+
+    def hyperparameters(self):
+        params = {'p_null': self.p_null, 'scale': self.a_table.scale}
+        if isinstance(self.t_base, PYP):
+            params['d_base'], params['theta_base'] = self.t_base.d, self.t_base.theta
+        return params
+
+    def stats(self):
+        stats = {'restaurants': sum(1 for t_word in self.t_table if t_word.total_customers),
+                'tables': sum(t_word.ntables for t_word in self.t_table),
+                'length_pairs': len(self.a_table.assignments)}
+        if isinstance(self.t_base, PYP):
+            stats['base_tables'] = self.t_base.ntables
+        return stats
+
+    def get_checkpoint(self):
+        state = seating_state(self.t_table, 't_table.')
+        state['t_table.prior'] = prior_state([t_word.prior for t_word in self.t_table])
+        state.update(distribution_state(self.t_base, 't_base.'))
+        state.update(distribution_state(self.null, 'null.'))
+        state.update(self.a_table.get_checkpoint())
+        return state
+
+    def set_checkpoint(self, state):
+        set_seating(self.t_table, state, 't_table.')
+        set_priors([t_word.prior for t_word in self.t_table], state['t_table.prior'])
+        set_distribution_state(self.t_base, state, 't_base.')
+        set_distribution_state(self.null, state, 'null.')
+        self.a_table.set_checkpoint(state)
+
     def map_estimate(self):
         t_table = [dict((w, t_word.prob(w)) for w in t_word.tables) for t_word in self.t_table]
         return (self.p_null, self.a_table.scale, t_table)
 
+    def sparse_estimate(self):
+        """ t-table estimate as sorted (f << 32 | e) keys and probabilities """
+        keys, probs = array('l'), array('d')
+        for f, t_word in enumerate(self.t_table):
+            for e in sorted(t_word.tables):
+                keys.append(f << 32 | e)
+                probs.append(t_word.prob(e))
+        return (numpy.frombuffer(keys, dtype=numpy.int64) if keys
+                    else numpy.zeros(0, dtype=numpy.int64),
+                numpy.frombuffer(probs) if probs else numpy.zeros(0))
+
     @staticmethod
-    def combine(samples):
-        t_tables = [t_table for _, _, t_table in samples]
-        def align(f, e):
-            a_probs = [alignment_matrix(diagonal_matrix(len(f)-1, len(e), scale), p_null)
-                    for p_null, scale, _ in samples]
-            for j, ej in enumerate(e):
-                _, i = max((sum(t_table[fi].get(ej, 0) * a_prob[i, j]
-                                for t_table, a_prob in izip(t_tables, a_probs)), i)
-                        for i, fi in enumerate(f))
-                yield i
-        return align
+    def combine(samples, average=False):
+        """ AlignmentEnsemble of a list of map_estimate() samples """
+        n_source = max(len(t_table) for _, _, t_table in samples) if samples else 0
+        indptr, targets, probs = [0], [], []
+        for f in xrange(n_source):
+            t_words = [t_table[f] if f < len(t_table) else {} for _, _, t_table in samples]
+            f_targets = sorted(set(e for t_word in t_words for e in t_word))
+            targets.extend(f_targets)
+            probs.extend([t_word.get(e, 0) for t_word in t_words] for e in f_targets)
+            indptr.append(len(targets))
+        probs = numpy.array(probs, dtype=numpy.float32).reshape((len(targets), len(samples)))
+        if average:
+            probs = probs.mean(axis=1).reshape((len(targets), 1))
+        return AlignmentEnsemble(numpy.array(indptr, dtype=numpy.int64),
+                numpy.array(targets, dtype=numpy.int32), probs,
+                [(p_null, scale) for p_null, scale, _ in samples])
 
     def __repr__(self):
         return ('AlignmentModel(#source words={n_source} '
                 '| t-table[f] ~ PYP(base={self.t_base})'
                 '| a-table ~ {self.a_table} + p(NULL)={self.p_null} ~ {self.null}'
                 ).format(self=self, n_source=len(self.t_table))
+
+def sample_alignment_matrix(flen, elen, p_null, scale):
+    return alignment_matrix(diagonal_matrix(flen, elen, scale), p_null)
+
+def averaged_alignment_matrix(flen, elen, priors):
+    return numpy.mean([sample_alignment_matrix(flen, elen, p_null, scale)
+        for p_null, scale in priors], axis=0)
+
+def candidate_union(flen, elen, priors, threshold):
+    """ mask of the candidate positions (see candidate_positions) for some sample """
+    return reduce(numpy.logical_or, (candidate_positions(flen, elen, scale, threshold)[0]
+        for _, scale in priors))
+
+class AlignmentEnsemble(object):
+    """Translation tables of several samples stored as sparse arrays:
+    the targets of source word f are targets[indptr[f]:indptr[f+1]] (sorted)
+    and probs has one column per sample (stacked) or a single column (averaged).
+    priors: (p_null, scale) of each sample, whose alignment matrices are averaged
+    (and cached once) if the translation tables are"""
+    def __init__(self, indptr, targets, probs, priors):
+        self.indptr = indptr
+        self.targets = targets
+        self.probs = probs
+        self.priors = priors
+        self.init_caches()
+
+    def init_caches(self):
+        if self.averaged:
+            priors = self.priors
+            self.caches = [MatrixCache(lambda flen, elen: averaged_alignment_matrix(flen, elen,
+                priors))]
+            self.candidate_caches = [MatrixCache(lambda flen, elen, threshold:
+                candidate_union(flen, elen, priors, threshold))]
+        else:
+            self.caches = [MatrixCache(sample_alignment_matrix) for _ in self.priors]
+            self.candidate_caches = [MatrixCache(candidate_positions) for _ in self.priors]
+
+    @property
+    def averaged(self):
+        return self.probs.shape[1] == 1 and len(self.priors) > 1
+
+    @property
+    def n_source(self):
+        return len(self.indptr) - 1
+
+    def t_probs(self, f, e):
+        """ |samples| x |f| x |e| (or 1 x |f| x |e| if averaged) translation probabilities """
+        t_prob = numpy.zeros((self.probs.shape[1], len(f), len(e)))
+        e = numpy.asarray(e)
+        for i, fi in enumerate(f):
+            if fi >= self.n_source: continue
+            start, end = self.indptr[fi], self.indptr[fi+1]
+            if start == end: continue
+            f_targets = self.targets[start:end]
+            pos = numpy.minimum(numpy.searchsorted(f_targets, e), end - start - 1)
+            found = (f_targets[pos] == e)
+            t_prob[:, i, found] = self.probs[start + pos[found]].T
+        return t_prob
+
+    def a_probs(self, flen, elen):
+        if self.averaged:
+            return self.caches[0].get((), flen, elen).reshape((1, flen+1, elen))
+        return numpy.array([cache.get(prior, flen, elen)
+            for cache, prior in izip(self.caches, self.priors)])
+
+    def align(self, f, e, prune=0):
+        """ most probable source position (0: NULL) of each target word
+        prune: only consider positions which are candidates for some sample (see
+        candidate_positions) """
+        if not self.priors:
+            return [len(f) - 1] * len(e)
+        t_prob = self.t_probs(f, e)
+        a_prob = self.a_probs(len(f)-1, len(e))
+        if len(t_prob) == 1: # averaged translation table
+            scores = t_prob[0] * a_prob.mean(axis=0)
+        else:
+            scores = (t_prob * a_prob).sum(axis=0)
+        if prune and self.averaged:
+            scores[~self.candidate_caches[0].get((prune,), len(f)-1, len(e))] = -1
+        elif prune:
+            mask = reduce(numpy.logical_or, (cache.get((scale, prune), len(f)-1, len(e))[0]
+                for cache, (_, scale) in izip(self.candidate_caches, self.priors)))
+            scores[~mask] = -1
+        return (len(f) - 1 - scores[::-1].argmax(axis=0)).tolist() # last best position
+
+    def keys(self):
+        """ (f << 32 | e) keys of the rows of probs """
+        sources = numpy.repeat(numpy.arange(self.n_source, dtype=numpy.int64),
+                numpy.diff(self.indptr))
+        return sources << 32 | self.targets
+
+    def __getstate__(self):
+        return (self.indptr, self.targets, self.probs, self.priors,
+                getattr(self, 'source_vocabulary', None), getattr(self, 'target_vocabulary', None))
+
+    def __setstate__(self, state):
+        (self.indptr, self.targets, self.probs, self.priors,
+                self.source_vocabulary, self.target_vocabulary) = state
+        self.init_caches()
+
+    def __repr__(self):
+        return ('AlignmentEnsemble(#samples={n_samples}, #source words={self.n_source}, '
+                '#entries={n_entries}, averaged={averaged})').format(self=self,
+                        n_samples=len(self.priors), n_entries=len(self.targets),
+                        averaged=self.averaged)
+
+def ensemble_from_keys(keys, probs, priors, n_source):
+    f = keys >> 32
+    return AlignmentEnsemble(numpy.searchsorted(f, numpy.arange(n_source + 1)).astype(numpy.int64),
+            (keys & 0xffffffff).astype(numpy.int32), probs.astype(numpy.float32), priors)
+
+def merge_ensembles(ensembles):
+    """ ensemble of the samples of several ensembles (e.g. of independent chains):
+    stacked if all of them are, averaged (weighted by number of samples) otherwise """
+    keys = reduce(numpy.union1d, (ensemble.keys() for ensemble in ensembles))
+    n_source = max(ensemble.n_source for ensemble in ensembles)
+    priors = [prior for ensemble in ensembles for prior in ensemble.priors]
+    if all(ensemble.probs.shape[1] == len(ensemble.priors) for ensemble in ensembles):
+        probs, column = numpy.zeros((len(keys), len(priors))), 0
+        for ensemble in ensembles:
+            rows = numpy.searchsorted(keys, ensemble.keys())
+            probs[rows, column:column+len(ensemble.priors)] = ensemble.probs
+            column += len(ensemble.priors)
+    else:
+        probs = numpy.zeros((len(keys), 1))
+        for ensemble in ensembles:
+            rows = numpy.searchsorted(keys, ensemble.keys())
+            probs[rows, 0] += ensemble.probs.mean(axis=1) * len(ensemble.priors)
+        probs /= max(len(priors), 1)
+    return ensemble_from_keys(keys, probs, priors, n_source)
+
+class SampleAccumulator(object):
+    """Running sum of the t-table estimates of successive samples in sparse arrays,
+    with the (p_null, scale) of each sample. The estimates of the last max_samples
+    samples can also be retained to build a stacked (instead of averaged) ensemble."""
+    def __init__(self, max_samples=0):
+        self.keys = numpy.zeros(0, dtype=numpy.int64)
+        self.sums = numpy.zeros(0)
+        self.priors = []
+        self.retained = deque(maxlen=max_samples)
+        self.n_source = 0
+
+    def add(self, model):
+        keys, probs = model.sparse_estimate()
+        union = numpy.union1d(self.keys, keys)
+        sums = numpy.zeros(len(union))
+        sums[numpy.searchsorted(union, self.keys)] += self.sums
+        sums[numpy.searchsorted(union, keys)] += probs
+        self.keys, self.sums = union, sums
+        prior = (model.p_null, model.a_table.scale)
+        self.priors.append(prior)
+        if self.retained.maxlen:
+            self.retained.append((keys, probs, prior))
+        self.n_source = len(model.t_table)
+
+    def __len__(self):
+        return len(self.priors)
+
+    def get_checkpoint(self):
+        retained = list(self.retained)
+        return {'samples.keys': self.keys, 'samples.sums': self.sums,
+                'samples.priors': numpy.array(self.priors, dtype=float).reshape((len(self), 2)),
+                'samples.n_source': numpy.array(self.n_source),
+                'samples.retained_sizes': as_array([len(keys) for keys, _, _ in retained]),
+                'samples.retained_keys': (numpy.concatenate([k for k, _, _ in retained])
+                    if retained else numpy.zeros(0, dtype=numpy.int64)),
+                'samples.retained_probs': (numpy.concatenate([p for _, p, _ in retained])
+                    if retained else numpy.zeros(0)),
+                'samples.retained_priors': numpy.array([prior for _, _, prior in retained],
+                    dtype=float).reshape((len(retained), 2))}
+
+    def set_checkpoint(self, state):
+        self.keys, self.sums = state['samples.keys'], state['samples.sums']
+        self.priors = map(tuple, state['samples.priors'].tolist())
+        self.n_source = int(state['samples.n_source'])
+        self.retained.clear()
+        bounds = numpy.cumsum(numpy.concatenate(([0], state['samples.retained_sizes'])))
+        for start, end, prior in izip(bounds[:-1], bounds[1:],
+                state['samples.retained_priors'].tolist()):
+            self.retained.append((state['samples.retained_keys'][start:end],
+                state['samples.retained_probs'][start:end], tuple(prior)))
+
+    def ensemble(self):
+        if not self.retained: # averaged translation table
+            probs = (self.sums / max(len(self), 1)).reshape((len(self.keys), 1))
+            return ensemble_from_keys(self.keys, probs, self.priors, self.n_source)
+        keys = reduce(numpy.union1d, (keys for keys, _, _ in self.retained))
+        probs = numpy.zeros((len(keys), len(self.retained)))
+        for s, (sample_keys, sample_probs, _) in enumerate(self.retained):
+            probs[numpy.searchsorted(keys, sample_keys), s] = sample_probs
+        return ensemble_from_keys(keys, probs, [prior for _, _, prior in self.retained],
+                self.n_source)
+
+    def __repr__(self):
+        return ('SampleAccumulator(#samples={n}, #entries={e}, '
+                '#retained={r})').format(n=len(self), e=len(self.keys), r=len(self.retained))
@@ -1,25 +1,40 @@
 import argparse
 import logging
-import cPickle
 import heapq
+from .. import container
+from model import t_table_section
 
 def main():
     logging.basicConfig(level=logging.INFO, format='%(message)s')
 
     parser = argparse.ArgumentParser(description='Print alignment model')
     parser.add_argument('--model', help='trained model', required=True)
+    parser.add_argument('--words', help='source words to print (default: all)', nargs='+')
 
     args = parser.parse_args()
 
-    with open(args.model) as m:
-        model = cPickle.load(m)
+    model_file = container.open_model(args.model)
+    if args.words and model_file: # load only the printed t-table rows
+        source_vocabulary = model_file.get('source_vocabulary', 0)
+        target_vocabulary = model_file.get('target_vocabulary', 0)
+        source_vocabulary.frozen = True
+        t_table = [(f, model_file.get(*t_table_section(f))) for f in
+                (source_vocabulary[w.decode('utf8')] for w in args.words)]
+    else:
+        model = model_file.model() if model_file else container.load(args.model)
+        source_vocabulary = model.source_vocabulary
+        target_vocabulary = model.target_vocabulary
+        t_table = list(enumerate(model.t_table))
+        if args.words:
+            source_vocabulary.frozen = True
+            t_table = [t_table[source_vocabulary[w.decode('utf8')]] for w in args.words]
 
-    for f, t_word in enumerate(model.t_table):
+    for f, t_word in t_table:
         t_best = heapq.nlargest(10, ((t_word.prob(e), e) for e in  t_word.tables))
         for p, e in t_best:
             if p < 0.1: continue
-            print(u'{0} -> {1} = {2}'.format(model.source_vocabulary[f], 
-                model.target_vocabulary[e], p).encode('utf8'))
+            print(u'{0} -> {1} = {2}'.format(source_vocabulary[f], 
+                target_vocabulary[e], p).encode('utf8'))
 
 if __name__ == '__main__':
     main()
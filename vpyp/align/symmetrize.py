@@ -0,0 +1,53 @@
+NEIGHBORS = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+
+def links(a, reverse=False):
+    """ {(f, e)} links of an alignment a (a[e] = f+1, 0 for NULL) """
+    if reverse:
+        return set((j, i-1) for j, i in enumerate(a) if i > 0)
+    return set((i-1, j) for j, i in enumerate(a) if i > 0)
+
+def intersection(fe, ef):
+    return fe & ef
+
+def union(fe, ef):
+    return fe | ef
+
+def grow_diag(fe, ef, final=False, final_and=False):
+    """ grow-diag(-final(-and)) symmetrization of two sets of (f, e) links """
+    alignment = fe & ef
+    candidates = fe | ef
+    aligned_f = set(f for f, _ in alignment)
+    aligned_e = set(e for _, e in alignment)
+    def add(f, e):
+        alignment.add((f, e))
+        aligned_f.add(f)
+        aligned_e.add(e)
+    added = True
+    while added:
+        added = False
+        for f, e in sorted(alignment):
+            for df, de in NEIGHBORS:
+                point = (f + df, e + de)
+                if point in candidates and point not in alignment and (point[0] not in aligned_f
+                        or point[1] not in aligned_e):
+                    add(*point)
+                    added = True
+    if final or final_and:
+        for direction in (fe, ef):
+            for f, e in sorted(direction):
+                if final_and:
+                    unaligned = f not in aligned_f and e not in aligned_e
+                else:
+                    unaligned = f not in aligned_f or e not in aligned_e
+                if unaligned:
+                    add(f, e)
+    return alignment
+
+def grow_diag_final(fe, ef):
+    return grow_diag(fe, ef, final=True)
+
+def grow_diag_final_and(fe, ef):
+    return grow_diag(fe, ef, final_and=True)
+
+heuristics = {'intersection': intersection, 'union': union, 'grow-diag': grow_diag,
+        'grow-diag-final': grow_diag_final, 'grow-diag-final-and': grow_diag_final_and}
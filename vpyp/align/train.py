@@ -1,110 +1,371 @@
 import argparse
 import logging
-import math
+import random
+import multiprocessing
+from Queue import Empty
 import cPickle
 from itertools import izip
-from ..corpus import Vocabulary
+from collections import Counter
+import numpy
+from ..corpus import Vocabulary, ParallelCorpus
 from ..prob import Uniform
 from ..charlm import CharLM, PoissonUniformCharLM
 from ..prior import PYPPrior
 from ..pyp import PYP
-from model import AlignmentModel
+from .. import checkpoint, container
+from ..metrics import Metrics
+from .. import sampler, chains
+from ..sampler import Sampler
+from model import AlignmentModel, SampleAccumulator, merge_ensembles, frequency_buckets
+from bitext import NULL, read_parallel_corpus, load_parallel_corpus, load_parallel_sides
+from decode import align_corpus, print_alignments
+from symmetrize import heuristics, links
 
-NULL = '__NULL__'
+_snapshot = None # (model, corpus, alignments) inherited by the forked workers
 
-def read_parallel_corpus(stream, source_vocabulary, target_vocabulary, reverse=False):
-    def sentences():
-        for line in stream:
-            f, e = line.decode('utf8').split(' ||| ')
-            if reverse: f, e = e, f
-            yield ([source_vocabulary[w] for w in [NULL]+f.split()], 
-                    [target_vocabulary[w] for w in e.split()])
-    return list(sentences())
+def sample_shard(model, corpus, alignments, start, end, seed):
+    """ sample the alignments of corpus[start:end]
+    -> (alignments, t_seating of the changed pairs, pruned prior mass) """
+    random.seed(seed)
+    model.dropped_mass = 0.
+    shard, pairs = [], set()
+    for i in xrange(start, end):
+        f, e = corpus[i]
+        if alignments[i] is not None:
+            model.decrement(f, e, alignments[i])
+            pairs.update((f[k], ej) for ej, k in izip(e, alignments[i]))
+        a = list(model.increment(f, e))
+        pairs.update((f[k], ej) for ej, k in izip(e, a))
+        shard.append(a)
+    return shard, model.t_seating(pairs), model.dropped_mass
 
-mh_iter = 100 # number of Metropolis-Hastings sampling iterations
+def shard_process(tasks, results):
+    """ worker of a parallel sweep: samples one shard of each block in its copy of the
+    model, first updated with the seating merged after the previous block """
+    model, corpus, alignments = _snapshot
+    for seating, null, start, end, seed in iter(tasks.get, None):
+        model.set_t_seating(seating)
+        model.null.positive, model.null.total = null
+        results.put(sample_shard(model, corpus, alignments, start, end, seed))
 
-def run_sampler(model, corpus, n_iter):
+def shard_result(queue, process):
+    """ result of a worker of a parallel sweep, unless it fails """
+    while True:
+        try:
+            return queue.get(timeout=1)
+        except Empty:
+            if process.exitcode not in (None, 0):
+                raise RuntimeError('A sampling process has failed')
+
+def parallel_sweep(model, corpus, alignments, n_jobs, n_merges):
+    """ sample the corpus in n_merges blocks, each one sharded across n_jobs workers
+    forked for the sweep; after each block, the sampled links are counted and the
+    seatings of the workers are merged in the model, then sent to the workers """
+    global _snapshot
+    _snapshot = (model, corpus, alignments)
+    queues = [(multiprocessing.Queue(), multiprocessing.Queue()) for _ in xrange(n_jobs)]
+    processes = [multiprocessing.Process(target=shard_process, args=queue) for queue in queues]
+    for process in processes:
+        process.start()
+    _snapshot = None
+    merged, done = ({}, {}), False
+    try:
+        for m in xrange(n_merges):
+            start, end = len(corpus) * m // n_merges, len(corpus) * (m+1) // n_merges
+            bounds = [start + (end - start) * k // n_jobs for k in xrange(n_jobs + 1)]
+            shards = zip(bounds[:-1], bounds[1:])
+            null = (model.null.positive, model.null.total)
+            for (tasks, _), (s, t) in zip(queues, shards):
+                tasks.put((merged, null, s, t, random.getrandbits(32)))
+            results = [shard_result(queue, process)
+                    for (_, queue), process in zip(queues, processes)]
+            for (s, t), (shard, _, dropped_mass) in zip(shards, results):
+                model.dropped_mass += dropped_mass
+                for i, a in izip(xrange(s, t), shard):
+                    f, e = corpus[i]
+                    if alignments[i] is not None: model.count_links(f, e, alignments[i], -1)
+                    model.count_links(f, e, a, 1)
+                    alignments[i] = a
+            merged = model.merge_t_seating([t_seating for _, t_seating, _ in results])
+        done = True
+    finally:
+        for (tasks, _), process in zip(queues, processes):
+            if done:
+                tasks.put(None)
+            elif process.is_alive():
+                process.terminate()
+            process.join()
+
+def run_sampler(model, corpus, n_iter, n_jobs=1, n_merges=1, thin=10, max_samples=0,
+        alignments=None, samples=None, start=0, checkpoint=None, metrics=None, schedule=None):
     n_words = sum(len(e) for f, e in corpus)
-    alignments = [None] * len(corpus)
-    samples = []
-    for it in range(n_iter):
-        logging.info('Iteration %d/%d', it+1, n_iter)
-        for i, (f, e) in enumerate(corpus):
-            if it > 0: model.decrement(f, e, alignments[i])
-            alignments[i] = list(model.increment(f, e))
-        if it % 10 == 0:
-            logging.info('Model: %s', model)
-            ll = model.log_likelihood()
-            ppl = math.exp(-ll / n_words)
-            logging.info('LL=%.0f ppl=%.3f', ll, ppl)
-        if it % 30 == 29:
-            logging.info('Resampling hyperparameters...')
-            acceptance, rejection = model.resample_hyperparemeters(mh_iter)
-            arate = acceptance / float(acceptance + rejection)
-            logging.info('Metropolis-Hastings acceptance rate: %.4f', arate)
-            logging.info('Model: %s', model)
-        if it > n_iter/10 and it % 10 == 0:
+    if alignments is None:
+        alignments = [None] * len(corpus)
+    if samples is None:
+        samples = SampleAccumulator(max_samples)
+    metrics = metrics or Metrics()
+    def sweep(it):
+        if n_jobs > 1:
+            parallel_sweep(model, corpus, alignments, n_jobs, n_merges)
+        else:
+            for i, (f, e) in enumerate(corpus):
+                if alignments[i] is not None: model.decrement(f, e, alignments[i])
+                alignments[i] = list(model.increment(f, e))
+        if model.prune:
+            logging.info('Pruned prior mass per target word: %.2e', model.dropped_mass / n_words)
+            metrics.set(pruned_mass=model.dropped_mass / n_words)
+            model.dropped_mass = 0.
+    def estimate(iteration):
+        it = iteration - 1
+        if it > n_iter/10 and it % thin == 0:
             logging.info('Estimating sample')
-            samples.append(model.map_estimate())
+            samples.add(model)
+    hooks = [('estimate', estimate)]
+    if checkpoint:
+        hooks.append(('checkpoint', lambda iteration: checkpoint(iteration, alignments, samples)))
+    Sampler(model, sweep, n_words, schedule, metrics, hooks).run(n_iter, start)
+    if not len(samples): # stopped before the first estimate
+        samples.add(model)
+
+    logging.info('Combining samples: %s', samples)
+    return samples.ensemble()
+
+def source_buckets(corpus, n_source, boundaries):
+    """ frequency bucket of each source word of the corpus (NULL included) """
+    counts = numpy.bincount(corpus.source.tokens, minlength=n_source)
+    buckets = frequency_buckets(counts, boundaries)
+    logging.info('Source words per prior bucket: %s', ' '.join(str(n) for _, n in
+        sorted(Counter(buckets).iteritems())))
+    return buckets
+
+def positive(value):
+    try:
+        n = int(value)
+    except ValueError:
+        n = 0
+    if n < 1:
+        raise argparse.ArgumentTypeError('expected a positive integer: ' + value)
+    return n
+
+def tied_priors(value):
+    """ --tie-priors: 'shared' or bucket boundaries b1,b2,... """
+    if value == 'shared': return []
+    try:
+        return [int(b) for b in value.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected shared or b1,b2,...: ' + value)
+
+def make_model(source_vocabulary, target_vocabulary, charlm=None, pyp=False, prune=0,
+        n_jobs=1, buckets=None):
+    if charlm:
+        logging.info('Preloading character language model')
+        if charlm == 'pu':
+            char_lm = PoissonUniformCharLM(target_vocabulary)
+        else:
+            char_lm = CharLM(charlm, target_vocabulary, n_jobs)
+        if pyp:
+            t_base = PYP(char_lm, PYPPrior(1.0, 1.0, 1.0, 1.0, 0.1, 1.0))
+        else:
+            t_base = char_lm
+    else:
+        t_base = Uniform(len(target_vocabulary))
+    return AlignmentModel(len(source_vocabulary), t_base, prune, buckets)
+
+def sample_chain(corpus, source_vocabulary, target_vocabulary, args, charlm, output,
+        checkpoint_path=None, metrics_path=None, report=None, stopped=None):
+    """ sample a model (one chain) and return its sample ensemble """
+    buckets = (source_buckets(corpus, len(source_vocabulary), args.tie_priors)
+            if args.tie_priors is not None else None)
+    model = make_model(source_vocabulary, target_vocabulary, charlm, args.pyp, args.prune,
+            args.jobs, buckets)
+    samples = SampleAccumulator(args.samples)
+
+    start, alignments = 0, None
+    if args.resume:
+        logging.info('Resuming from checkpoint %s', checkpoint_path)
+        start, state = checkpoint.load(checkpoint_path)
+        model.set_checkpoint(state)
+        samples.set_checkpoint(state)
+        alignments = checkpoint.unflatten(state['alignments.lengths'], state['alignments'])
 
-    logging.info('Combining %d samples', len(samples))
-    align = AlignmentModel.combine(samples)
-    for i, (f, e) in enumerate(corpus):
-        alignments[i] = list(align(f, e))
-    return alignments
+    def get_state(alignments, samples):
+        state = model.get_checkpoint()
+        state.update(samples.get_checkpoint())
+        state['alignments.lengths'], state['alignments'] = checkpoint.flatten(alignments)
+        return state
+    checkpointer = (checkpoint.Checkpointer(checkpoint_path, args.checkpoint_every,
+        get_state) if checkpoint_path else None)
+
+    logging.info('Training alignment model')
+    if report:
+        metrics = chains.ChainMetrics(report, metrics_path, profile_iter=args.profile_iter)
+    else:
+        metrics = Metrics(metrics_path, profile_iter=args.profile_iter)
+    schedule = sampler.schedule(args)
+    schedule.stop = stopped
+    ensemble = run_sampler(model, corpus, args.iter, args.jobs, args.merges,
+            args.thin, args.samples, alignments, samples, start, checkpointer, metrics,
+            schedule)
+    metrics.close()
+
+    if output:
+        model.source_vocabulary = source_vocabulary
+        model.target_vocabulary = target_vocabulary
+        container.save(output, model)
+    return ensemble
+
+def train(corpus, source_vocabulary, target_vocabulary, args, charlm, output, ensemble_output,
+        checkpoint_path=None, metrics_path=None):
+    """ train a model in one direction and return the alignments of the training corpus """
+    if args.chains > 1:
+        logging.info('Sampling %d chains', args.chains)
+        suffixed = lambda path, chain: (path + '.chain{0}'.format(chain) if path else None)
+        def run_chain(chain, report, stopped):
+            return sample_chain(corpus, source_vocabulary, target_vocabulary, args, charlm,
+                    suffixed(output, chain), suffixed(checkpoint_path, chain),
+                    suffixed(metrics_path, chain), report, stopped)
+        ensemble = merge_ensembles(chains.run_chains(args.chains, run_chain, args.rhat))
+        logging.info('Merged ensemble: %s', ensemble)
+    else:
+        ensemble = sample_chain(corpus, source_vocabulary, target_vocabulary, args, charlm,
+                output, checkpoint_path, metrics_path)
+
+    if ensemble_output:
+        with open(ensemble_output, 'w') as f:
+            ensemble.source_vocabulary = source_vocabulary
+            ensemble.target_vocabulary = target_vocabulary
+            cPickle.dump(ensemble, f, protocol=-1)
+
+    logging.info('Aligning training corpus')
+    return align_corpus(ensemble, corpus, args.jobs, args.prune)
+
+def train_process(queue, *args):
+    queue.put(train(*args))
+
+def direction_result(name, queue, process):
+    """ result of a training process, unless it fails """
+    while True:
+        try:
+            return queue.get(timeout=1)
+        except Empty:
+            if process.exitcode not in (None, 0):
+                raise RuntimeError('Training of the {0} direction has failed'.format(name))
+
+def train_bidirectional(args):
+    """ train both directions concurrently on a bitext read once,
+    and return the symmetrized links of each sentence pair """
+    f_vocabulary, e_vocabulary = Vocabulary(), Vocabulary()
+    f_vocabulary[NULL]
+    e_vocabulary[NULL]
+
+    logging.info('Reading parallel training data')
+    f, e = load_parallel_sides(args.train, f_vocabulary, e_vocabulary)
+    if args.sort_vocab:
+        logging.info('Sorting vocabularies by frequency')
+        f.sort_vocabulary(f_vocabulary[NULL] + 1)
+        e.sort_vocabulary(e_vocabulary[NULL] + 1)
+    forward = ParallelCorpus(f.prepend(f_vocabulary[NULL]), e)
+    backward = ParallelCorpus(e.prepend(e_vocabulary[NULL]), f)
+
+    suffixed = lambda path: (path + '.reverse' if path else None)
+    directions = ((forward, f_vocabulary, e_vocabulary, args, args.charlm,
+                    args.output, args.ensemble, args.checkpoint, args.metrics),
+            (backward, e_vocabulary, f_vocabulary, args, args.reverse_charlm or args.charlm,
+                suffixed(args.output), suffixed(args.ensemble), suffixed(args.checkpoint),
+                suffixed(args.metrics)))
+    queues = [multiprocessing.Queue() for _ in directions]
+    processes = [multiprocessing.Process(target=train_process, args=(queue,)+direction)
+            for queue, direction in zip(queues, directions)]
+    for process in processes:
+        process.start()
+    results = []
+    try:
+        for name, queue, process in zip(('forward', 'reverse'), queues, processes):
+            results.append(direction_result(name, queue, process))
+    finally:
+        for process in processes:
+            if process.is_alive() and len(results) < len(processes):
+                process.terminate()
+            process.join()
+    fe, ef = results
+
+    logging.info('Symmetrizing alignments (%s)', args.bidirectional)
+    symmetrize = heuristics[args.bidirectional]
+    return [symmetrize(links(a_fe), links(a_ef, reverse=True)) for a_fe, a_ef in izip(fe, ef)]
 
 def main():
     logging.basicConfig(level=logging.INFO, format='%(message)s')
 
     parser = argparse.ArgumentParser(description='Train alignment model')
-    parser.add_argument('--train', help='training corpus', required=True)
+    parser.add_argument('--train', help='training corpus (text or binary)', required=True)
     parser.add_argument('--iter', help='number of iterations', type=int, required=True)
     parser.add_argument('--charlm', help='character language model')
     parser.add_argument('--pyp', help='G_w^0 is PYP(CharLM)', action='store_true')
-    parser.add_argument('--output', help='model output path')
+    parser.add_argument('--sort-vocab', help='renumber word ids by decreasing frequency',
+            action='store_true')
+    parser.add_argument('--jobs', help='number of sampling processes', type=int, default=1)
+    parser.add_argument('--merges', help='number of merge steps per iteration (with --jobs)',
+            type=int, default=1)
+    parser.add_argument('--prune', help='only sample NULL and the source positions which '
+            'cover 1 - PRUNE of the diagonal prior mass of each target word', type=float,
+            default=0)
+    parser.add_argument('--tie-priors', help='share the t-table PYP priors: one prior '
+            '(shared) or one per frequency bucket of the source words, with boundaries '
+            'b1,b2,... (default: one prior per source word)', type=tied_priors)
+    parser.add_argument('--output', help='model output path (chains: OUTPUT.chainN)')
+    parser.add_argument('--ensemble', help='sample ensemble output path (for decode)')
+    parser.add_argument('--thin', help='estimate a sample every THIN iterations after burn-in',
+            type=positive, default=10)
+    parser.add_argument('--samples', help='keep the last SAMPLES estimates for a stacked '
+            'ensemble (default: average all estimates into a single translation table '
+            'and alignment prior)', type=int, default=0)
     parser.add_argument('--reverse', help='train model in reverse direction (but output f-e)', 
             action='store_true')
+    parser.add_argument('--bidirectional', help='train both directions concurrently and output '
+            'symmetrized alignments (reverse models: OUTPUT.reverse, ENSEMBLE.reverse)',
+            choices=sorted(heuristics))
+    parser.add_argument('--reverse-charlm', help='character language model of the source '
+            'language, for the reverse direction (default: --charlm)')
+
+    parser.add_argument('--checkpoint', help='sampler checkpoint path '
+            '(reverse direction: CHECKPOINT.reverse)')
+    parser.add_argument('--checkpoint-every', help='write a checkpoint every N iterations',
+            type=int, default=10)
+    parser.add_argument('--resume', help='resume sampling from the checkpoint',
+            action='store_true')
+    sampler.add_arguments(parser)
+    chains.add_arguments(parser)
+    parser.add_argument('--metrics', help='per-iteration metrics output (JSON lines; '
+            'reverse direction: METRICS.reverse)')
+    parser.add_argument('--profile-iter', help='profile iteration N (written to '
+            'METRICS.iterN.prof)', type=int)
 
     args = parser.parse_args()
+    if args.resume and not args.checkpoint:
+        parser.error('--resume requires --checkpoint')
+    if args.reverse and args.bidirectional:
+        parser.error('--reverse cannot be used with --bidirectional')
+
+    if args.bidirectional:
+        for points in train_bidirectional(args):
+            print(' '.join('{0}-{1}'.format(f, e) for f, e in sorted(points)))
+        return
 
     source_vocabulary = Vocabulary()
     source_vocabulary[NULL]
     target_vocabulary = Vocabulary()
 
     logging.info('Reading parallel training data')
-    with open(args.train) as train:
-        training_corpus = read_parallel_corpus(train, source_vocabulary, target_vocabulary,
-                args.reverse)
+    training_corpus = load_parallel_corpus(args.train, source_vocabulary, target_vocabulary,
+            args.reverse)
+    if args.sort_vocab:
+        logging.info('Sorting vocabularies by frequency')
+        training_corpus.source.sort_vocabulary(source_vocabulary[NULL] + 1)
+        training_corpus.target.sort_vocabulary()
 
-    if args.charlm:
-        logging.info('Preloading character language model')
-        if args.charlm == 'pu':
-            char_lm = PoissonUniformCharLM(target_vocabulary)
-        else:
-            char_lm = CharLM(args.charlm, target_vocabulary)
-        if args.pyp:
-            t_base = PYP(char_lm, PYPPrior(1.0, 1.0, 1.0, 1.0, 0.1, 1.0))
-        else:
-            t_base = char_lm
-    else:
-        t_base = Uniform(len(target_vocabulary))
-    model = AlignmentModel(len(source_vocabulary), t_base)
-
-    logging.info('Training alignment model')
-    alignments = run_sampler(model, training_corpus, args.iter)
-
-    if args.output:
-        with open(args.output, 'w') as f:
-            model.source_vocabulary = source_vocabulary
-            model.target_vocabulary = target_vocabulary
-            cPickle.dump(model, f, protocol=-1)
-
-    fmt = ('{e}-{f}' if args.reverse else '{f}-{e}')
-    for a, (f, e) in izip(alignments, training_corpus):
-        #f_sentence = ' '.join(source_vocabulary[w] for w in f[1:])
-        #e_sentence = ' '.join(target_vocabulary[w] for w in e)
-        print(' '.join(fmt.format(f=j-1, e=i) for i, j in enumerate(a) if j > 0))
-        #print(u'{0} ||| {1} ||| {2}'.format(f_sentence, e_sentence, al).encode('utf8'))
+    alignments = train(training_corpus, source_vocabulary, target_vocabulary, args,
+            args.charlm, args.output, args.ensemble, args.checkpoint, args.metrics)
+    print_alignments(alignments, training_corpus, args.reverse)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,37 @@
+""" Compare two benchmark result files (see vpyp.bench.run) """
+import argparse
+import json
+from collections import defaultdict
+
+def read_results(path):
+    """ best tokens/sec and peak RSS of each (benchmark, params) configuration """
+    results = defaultdict(lambda: [0, 0])
+    with open(path) as f:
+        for line in f:
+            result = json.loads(line)
+            key = (result['benchmark'], json.dumps(result['params'], sort_keys=True))
+            best = results[key]
+            best[0] = max(best[0], result['tokens_per_sec'] or 0)
+            best[1] = max(best[1], result['peak_rss_kb'])
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare two benchmark result files')
+    parser.add_argument('baseline', help='baseline results (JSONL)')
+    parser.add_argument('results', help='new results (JSONL)')
+    args = parser.parse_args()
+
+    baseline, results = read_results(args.baseline), read_results(args.results)
+    print('{0:<40} {1:>12} {2:>12} {3:>8} {4:>8}'.format('benchmark', 'tokens/s (old)',
+        'tokens/s (new)', 'speedup', 'memory'))
+    for key in sorted(set(baseline) & set(results)):
+        (old_speed, old_rss), (new_speed, new_rss) = baseline[key], results[key]
+        print('{0:<40} {1:>12.0f} {2:>12.0f} {3:>7.2f}x {4:>7.2f}x'.format(' '.join(key),
+            old_speed, new_speed, new_speed / old_speed if old_speed else float('nan'),
+            new_rss / float(old_rss) if old_rss else float('nan')))
+    for key in sorted(set(baseline) ^ set(results)):
+        print('{0:<40} (only in {1})'.format(' '.join(key),
+            args.baseline if key in baseline else args.results))
+
+if __name__ == '__main__':
+    main()
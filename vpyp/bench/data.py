@@ -0,0 +1,56 @@
+""" Synthetic corpora with reproducible seeds (word ids start after <s> and </s>) """
+import random
+import bisect
+from ..corpus import Vocabulary
+
+class Zipf(object):
+    """ Zipfian distribution over word ids 2..vocab_size+1 """
+    def __init__(self, vocab_size, exponent=1.1):
+        self.cumulative, total = [], 0.
+        for rank in xrange(1, vocab_size + 1):
+            total += rank ** -exponent
+            self.cumulative.append(total)
+
+    def sample(self, rng):
+        return 2 + bisect.bisect(self.cumulative, rng.random() * self.cumulative[-1])
+
+def sentence_length(rng, mean_length):
+    return max(1, int(rng.gauss(mean_length, mean_length / 3.)))
+
+def vocabulary(vocab_size):
+    return Vocabulary(init=(u'w{0}'.format(w) for w in xrange(vocab_size)))
+
+def zipf_corpus(n_sentences, vocab_size, mean_length=20, seed=1):
+    """ sentences of Zipf-distributed words """
+    rng, zipf = random.Random(seed), Zipf(vocab_size)
+    return [[zipf.sample(rng) for _ in xrange(sentence_length(rng, mean_length))]
+            for _ in xrange(n_sentences)]
+
+def topic_corpus(n_docs, n_topics, vocab_size, doc_length=100, seed=1):
+    """ documents mixing a few topics, each a Zipf distribution over a shifted vocabulary """
+    rng, zipf = random.Random(seed), Zipf(vocab_size)
+    shifts = [rng.randrange(vocab_size) for _ in xrange(n_topics)]
+    corpus = []
+    for _ in xrange(n_docs):
+        topics = rng.sample(shifts, min(3, n_topics))
+        corpus.append([2 + (zipf.sample(rng) - 2 + rng.choice(topics)) % vocab_size
+            for _ in xrange(sentence_length(rng, doc_length))])
+    return corpus
+
+def bitext(n_pairs, source_size, target_size, mean_length=20, seed=1):
+    """ (f, e) pairs with NULL (id 2) prepended to f: each e word translates a nearby
+    f word through a random dictionary, or is spurious """
+    rng, zipf = random.Random(seed), Zipf(source_size)
+    translations = [rng.randrange(target_size) for _ in xrange(source_size + 3)]
+    corpus = []
+    for _ in xrange(n_pairs):
+        f = [zipf.sample(rng) + 1 for _ in xrange(sentence_length(rng, mean_length))]
+        e, elen = [], sentence_length(rng, mean_length)
+        for j in xrange(elen):
+            if rng.random() < 0.1: # spurious word
+                e.append(2 + rng.randrange(target_size))
+            else:
+                i = j * len(f) // elen + rng.randint(-2, 2)
+                e.append(2 + translations[f[min(len(f) - 1, max(0, i))]])
+        corpus.append(([2] + f, e))
+    return corpus
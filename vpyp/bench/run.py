@@ -0,0 +1,207 @@
+""" Benchmarks of the sampler hot paths
+Each benchmark runs in a fresh interpreter so that its peak memory can be measured;
+results are written as JSON lines (see vpyp.bench.compare) """
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+from itertools import izip
+from ..corpus import ngrams
+from ..prob import Uniform
+from ..pyp import PYP
+from ..prior import PYPPrior
+from ..ngram.model import PYPLM
+from ..ngram.eval import print_ppl
+from ..ngram.arpa import print_arpa
+from ..lda.model import LPYA
+from ..align.model import AlignmentModel
+import data
+
+def pyp_increment(scale, n_tokens=200000, vocab_size=10000):
+    """ PYP.increment and PYP.decrement of Zipf-distributed dishes """
+    n = int(n_tokens * scale)
+    dishes = [w for sentence in data.zipf_corpus(n // 20, vocab_size) for w in sentence]
+    model = PYP(Uniform(vocab_size + 2), PYPPrior(1.0, 1.0, 1.0, 1.0, 0.8, 1.0))
+    start = time.time()
+    for k in dishes:
+        model.increment(k)
+    for k in dishes:
+        model.decrement(k)
+    return 2 * len(dishes), time.time() - start
+
+def train_lm(order, scale, n_sentences, vocab_size):
+    corpus = data.zipf_corpus(int(n_sentences * scale), vocab_size)
+    model = PYPLM(order, Uniform(vocab_size + 2))
+    for sentence in corpus:
+        for seq in ngrams(sentence, order):
+            model.increment(seq[:-1], seq[-1])
+    return model, corpus
+
+def n_lm_tokens(corpus):
+    return sum(len(sentence) + 1 for sentence in corpus)
+
+def pyplm_sweep(scale, order=3, n_sentences=5000, vocab_size=5000):
+    """ one Gibbs sweep (decrement + increment of every n-gram) of an initialized PYPLM """
+    model, corpus = train_lm(order, scale, n_sentences, vocab_size)
+    start = time.time()
+    for sentence in corpus:
+        for seq in ngrams(sentence, order):
+            model.decrement(seq[:-1], seq[-1])
+            model.increment(seq[:-1], seq[-1])
+    return n_lm_tokens(corpus), time.time() - start
+
+def pyplm_resample(scale, order=3, n_sentences=2000, vocab_size=5000, mh_iter=10):
+    """ Metropolis-Hastings resampling of the PYPLM hyperparameters """
+    model, corpus = train_lm(order, scale, n_sentences, vocab_size)
+    logging.disable(logging.INFO)
+    start = time.time()
+    model.resample_hyperparemeters(mh_iter)
+    return n_lm_tokens(corpus), time.time() - start
+
+def pyplm_log_likelihood(scale, order=3, n_sentences=5000, vocab_size=5000):
+    """ PYPLM.log_likelihood of a trained model """
+    model, corpus = train_lm(order, scale, n_sentences, vocab_size)
+    start = time.time()
+    model.log_likelihood()
+    return n_lm_tokens(corpus), time.time() - start
+
+def pyplm_eval(scale, order=3, n_sentences=5000, vocab_size=5000):
+    """ perplexity of held-out data (vpyp.ngram.eval) """
+    model, _ = train_lm(order, scale, n_sentences, vocab_size)
+    test = data.zipf_corpus(int(n_sentences * scale), vocab_size, seed=2)
+    logging.disable(logging.INFO)
+    start = time.time()
+    print_ppl(model, test)
+    return n_lm_tokens(test), time.time() - start
+
+def pyplm_arpa(scale, order=3, n_sentences=2000, vocab_size=5000):
+    """ ARPA export (vpyp.ngram.arpa) -> n-grams/sec """
+    model, _ = train_lm(order, scale, n_sentences, vocab_size)
+    model.vocabulary = data.vocabulary(vocab_size)
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    try:
+        start = time.time()
+        print_arpa(model, set(xrange(2, vocab_size + 2)))
+        seconds = time.time() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    level, n_ngrams = model, 0
+    while isinstance(level, PYPLM):
+        n_ngrams += sum(len(m.tables) for m in level.models.itervalues())
+        level = level.backoff
+    return n_ngrams, seconds
+
+def lda_sweep(scale, n_topics=20, n_docs=500, vocab_size=5000):
+    """ one Gibbs sweep of an initialized LDA model with PYP topics """
+    corpus = data.topic_corpus(int(n_docs * scale), n_topics, vocab_size)
+    model = LPYA(n_topics, len(corpus), Uniform(vocab_size + 2))
+    assignments = [[model.increment(d, w) for w in document]
+            for d, document in enumerate(corpus)]
+    start = time.time()
+    for d, (document, document_assignments) in enumerate(izip(corpus, assignments)):
+        for i, w in enumerate(document):
+            model.decrement(d, w, document_assignments[i])
+            document_assignments[i] = model.increment(d, w)
+    return sum(map(len, corpus)), time.time() - start
+
+def align_sweep(scale, length=20, n_pairs=2000, vocab_size=2000):
+    """ one Gibbs sweep of an initialized alignment model (target tokens/sec) """
+    corpus = data.bitext(int(n_pairs * scale), vocab_size, vocab_size, length)
+    model = AlignmentModel(vocab_size + 3, PYP(Uniform(vocab_size + 2),
+        PYPPrior(1.0, 1.0, 1.0, 1.0, 0.1, 1.0)))
+    alignments = [list(model.increment(f, e)) for f, e in corpus]
+    start = time.time()
+    for n, (f, e) in enumerate(corpus):
+        model.decrement(f, e, alignments[n])
+        alignments[n] = list(model.increment(f, e))
+    return sum(len(e) for _, e in corpus), time.time() - start
+
+benchmarks = [
+    ('pyp_increment', pyp_increment, [{}]),
+    ('pyplm_sweep', pyplm_sweep, [{'order': order} for order in (2, 3, 4)]),
+    ('pyplm_resample', pyplm_resample, [{}]),
+    ('pyplm_log_likelihood', pyplm_log_likelihood, [{}]),
+    ('pyplm_eval', pyplm_eval, [{}]),
+    ('pyplm_arpa', pyplm_arpa, [{}]),
+    ('lda_sweep', lda_sweep, [{'n_topics': n_topics} for n_topics in (5, 20, 50)]),
+    ('align_sweep', align_sweep, [{'length': length} for length in (10, 30, 60)]),
+]
+
+def run_benchmark(name, params, scale, seed):
+    """ run a benchmark in this process -> result record """
+    random.seed(seed)
+    function = dict((name, function) for name, function, _ in benchmarks)[name]
+    tokens, seconds = function(scale, **params)
+    return {'benchmark': name, 'params': params, 'scale': scale, 'seed': seed,
+            'tokens': tokens, 'seconds': seconds,
+            'tokens_per_sec': tokens / seconds if seconds > 0 else None,
+            'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+def run_subprocess(name, params, scale, seed):
+    """ run a benchmark in a fresh interpreter -> result record """
+    output = subprocess.check_output([sys.executable, '-m', 'vpyp.bench.run',
+        '--single', name, '--params', json.dumps(params),
+        '--scale', str(scale), '--seed', str(seed)])
+    return json.loads(output)
+
+def git_commit():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                    cwd=os.path.dirname(os.path.abspath(__file__)), stderr=devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    parser = argparse.ArgumentParser(description='Benchmark the sampler hot paths')
+    parser.add_argument('--output', help='JSONL results (appended; default: stdout)')
+    parser.add_argument('--only', help='comma-separated benchmark names')
+    parser.add_argument('--scale', help='corpus size multiplier', type=float, default=1.0)
+    parser.add_argument('--seed', help='random seed', type=int, default=1)
+    parser.add_argument('--repeat', help='runs of each benchmark', type=int, default=1)
+    parser.add_argument('--single', help=argparse.SUPPRESS)
+    parser.add_argument('--params', help=argparse.SUPPRESS, default='{}')
+
+    args = parser.parse_args()
+
+    if args.single: # child process
+        print(json.dumps(run_benchmark(args.single, json.loads(args.params),
+            args.scale, args.seed)))
+        return
+
+    only = set(args.only.split(',')) if args.only else None
+    if only and only - set(name for name, _, _ in benchmarks):
+        parser.error('unknown benchmark: ' + ', '.join(only
+            - set(name for name, _, _ in benchmarks)))
+    context = {'commit': git_commit(), 'python': sys.version.split()[0],
+            'implementation': platform.python_implementation(),
+            'date': datetime.datetime.now().isoformat()}
+    output = open(args.output, 'a') if args.output else sys.stdout
+    try:
+        for name, _, configurations in benchmarks:
+            if only and name not in only: continue
+            for params in configurations:
+                for _ in xrange(args.repeat):
+                    result = run_subprocess(name, params, args.scale, args.seed)
+                    result.update(context)
+                    logging.info('%s %s: %.0f tokens/sec, peak RSS %.0f MB', name,
+                            json.dumps(params), result['tokens_per_sec'] or 0,
+                            result['peak_rss_kb'] / 1024.)
+                    output.write(json.dumps(result, sort_keys=True) + '\n')
+                    output.flush()
+    finally:
+        if args.output:
+            output.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+""" Independent sampling chains in separate processes, stopped once their
+log-likelihood and hyperparameter traces have converged (split R-hat) """
+import logging
+import random
+import multiprocessing
+from Queue import Empty
+try:
+    import numpypy
+except ImportError:
+    pass
+import numpy
+from .metrics import Metrics
+
+def split_rhat(traces):
+    """ potential scale reduction of m equal-length traces, each split in two halves """
+    traces = numpy.asarray(traces, dtype=float)
+    n = traces.shape[1] // 2
+    halves = numpy.concatenate((traces[:, :n], traces[:, n:2*n]))
+    W = halves.var(axis=1, ddof=1).mean() # within-chain variance
+    B = n * halves.mean(axis=1).var(ddof=1) # between-chain variance
+    if W == 0:
+        return 1.0 if B == 0 else float('inf')
+    return float(numpy.sqrt(((n - 1.) / n * W + B / n) / W))
+
+class Monitor(object):
+    """ traces of n chains; converged when the split R-hat of every trace, over the
+    second half of the points reported by all chains, is below threshold """
+    def __init__(self, n_chains, threshold=1.1, min_points=4):
+        self.traces = [[] for _ in xrange(n_chains)]
+        self.threshold = threshold
+        self.min_points = min_points
+
+    def add(self, chain, values):
+        self.traces[chain].append(values)
+
+    def rhat(self):
+        n_points = min(len(trace) for trace in self.traces)
+        points = [trace[n_points//2:n_points] for trace in self.traces]
+        return dict((name, split_rhat([[values[name] for values in trace] for trace in points]))
+                for name in points[0][0])
+
+    def converged(self):
+        n_points = min(len(trace) for trace in self.traces)
+        if n_points < 2 * self.min_points: return False
+        rhat = self.rhat()
+        logging.info('Split R-hat: %s', ' '.join('{0}={1:.3f}'.format(name, value)
+            for name, value in sorted(rhat.iteritems())))
+        return max(rhat.itervalues()) < self.threshold
+
+class ChainMetrics(Metrics):
+    """ Metrics which also report the log-likelihood and hyperparameters of the model
+    each time the log-likelihood is evaluated """
+    def __init__(self, report, *args, **kwargs):
+        super(ChainMetrics, self).__init__(*args, **kwargs)
+        self.report = report
+
+    def end(self, model=None):
+        if 'll' in self.record:
+            values = {'ll': self.record['ll']}
+            values.update(model.hyperparameters())
+            self.report(values)
+        super(ChainMetrics, self).end(model)
+
+def chain_process(queue, stop, chain, seed, run_chain):
+    random.seed(seed)
+    try:
+        result = run_chain(chain, lambda values: queue.put(('trace', chain, values)),
+                stop.is_set)
+    except:
+        queue.put(('error', chain, None))
+        raise
+    queue.put(('result', chain, result))
+
+def run_chains(n_chains, run_chain, threshold=1.1, seed=None):
+    """ run_chain(chain, report, stopped) in n_chains processes with distinct seeds
+    report(values): trace values of the chain ({name: value})
+    stopped(): whether the chains have converged
+    -> results of run_chain, in chain order """
+    seed = random.getrandbits(32) if seed is None else seed
+    queue, stop = multiprocessing.Queue(), multiprocessing.Event()
+    monitor = Monitor(n_chains, threshold)
+    processes = [multiprocessing.Process(target=chain_process,
+        args=(queue, stop, chain, seed + chain, run_chain)) for chain in xrange(n_chains)]
+    for process in processes:
+        process.start()
+    results = {}
+    try:
+        while len(results) < n_chains:
+            try:
+                kind, chain, value = queue.get(timeout=1)
+            except Empty:
+                if any(process.exitcode not in (None, 0) for process in processes):
+                    raise RuntimeError('A sampling chain has failed')
+                continue
+            if kind == 'error':
+                raise RuntimeError('Sampling chain {0} has failed'.format(chain))
+            elif kind == 'trace':
+                monitor.add(chain, value)
+                if not stop.is_set() and monitor.converged():
+                    logging.info('Chains have converged: stopping')
+                    stop.set()
+            else:
+                results[chain] = value
+    finally:
+        for process in processes:
+            if process.is_alive() and len(results) < n_chains:
+                process.terminate()
+            process.join()
+    return [results[chain] for chain in xrange(n_chains)]
+
+def add_arguments(parser):
+    """ independent chain options of the train CLIs """
+    parser.add_argument('--chains', help='number of independent chains, run in parallel and '
+            'stopped once converged (traces: log-likelihood evaluations, see --ll-every)',
+            type=int, default=1)
+    parser.add_argument('--rhat', help='split R-hat convergence threshold', type=float,
+            default=1.1)
@@ -1,3 +1,7 @@
+import os
+import hashlib
+import logging
+import multiprocessing
 try:
     import numpypy
 except ImportError:
@@ -10,15 +14,52 @@ try:
 except ImportError:
     pass
 
-class CharLM:
-    def __init__(self, path, vocabulary):
-        self.lm = kenlm.LanguageModel(path)
-        self.vocabulary = vocabulary
-        self.K = len(vocabulary)
+def cache_dir():
+    """ directory of the persistent base probability caches ($VPYP_CACHE) """
+    return os.environ.get('VPYP_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'vpyp'))
+
+def cache_path(lm_path, words):
+    """ cache file of the probabilities of words under the LM stored at lm_path """
+    stat = os.stat(lm_path)
+    key = hashlib.sha1('{0}\t{1}\t{2}\n'.format(os.path.abspath(lm_path),
+        stat.st_size, int(stat.st_mtime)))
+    key.update(u'\n'.join(words).encode('utf8'))
+    return os.path.join(cache_dir(), 'charlm-{0}.npy'.format(key.hexdigest()))
+
+def load_cache(path, K):
+    try:
+        probs = numpy.load(path)
+    except (IOError, ValueError):
+        return None
+    return probs if len(probs) == K else None
+
+def save_cache(path, probs):
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        tmp = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            numpy.save(f, probs)
+        os.rename(tmp, path)
+    except (IOError, OSError) as e:
+        logging.warn('Could not write the character LM cache: %s', e)
+
+_lm = None # language model of the scoring processes
+
+def _load_lm(path):
+    global _lm
+    _lm = kenlm.LanguageModel(path)
+
+def _score_words(words):
+    return [10**_lm.score(' '.join(word)) for word in words]
+
+class BaseCharLM:
+    """ base distribution over the vocabulary with probabilities computed in batch
+    (_get_probs) and lazily for the words added to the vocabulary afterwards """
+    def _init_probs(self, probs):
+        self.K = len(probs)
         self.count = numpy.zeros(self.K)
-        self.probs = numpy.zeros(self.K)
-        for k in xrange(self.K):
-            self.probs[k] = self.get_prob(k)
+        self.probs = probs
 
     def increment(self, k, initialize=False):
         assert (0 <= k < self.K)
@@ -28,51 +69,104 @@ class CharLM:
         assert (0 <= k < self.K)
         self.count[k] -= 1
 
-    def get_prob(self, k):
-        chars = ' '.join(self.vocabulary[k])
-        return 10**self.lm.score(chars)
-
     def prob(self, k):
         assert (k >= 0)
-        if k >= self.K: return self.get_prob(k)
-        return self.probs[k]
+        if k >= len(self.probs): # new word: grow the cache
+            probs = numpy.empty(max(k + 1, 2 * len(self.probs)))
+            probs[:len(self.probs)] = self.probs
+            probs[len(self.probs):] = numpy.nan
+            self.probs = probs
+        p = self.probs[k]
+        if p != p: # not computed yet
+            p = self.probs[k] = self.get_prob(k)
+        return p
+
+    def _restore_count(self, count): # pickled counts (none before they were saved)
+        if count is not None:
+            self.count[:len(count)] = count
+
+    def extend(self, K):
+        """ grow to the K words of an extended vocabulary """
+        for k in xrange(self.K, K):
+            self.prob(k)
+        count = numpy.zeros(K)
+        count[:self.K] = self.count
+        self.K, self.count = K, count
 
     def log_likelihood(self, full=False):
-        return numpy.log(self.probs).dot(self.count)
+        return numpy.log(self.probs[:self.K]).dot(self.count)
 
     def resample_hyperparemeters(self, n_iter):
         return (0, 0)
 
+    def reseat(self, counts): # counts do not depend on the seating
+        pass
+
+class CharLM(BaseCharLM):
+    def __init__(self, path, vocabulary, n_jobs=1):
+        self.lm = kenlm.LanguageModel(path)
+        self.vocabulary = vocabulary
+        words = list(vocabulary)
+        cache = cache_path(path, words)
+        probs = load_cache(cache, len(words))
+        if probs is None:
+            probs = numpy.array(self.get_probs(words, n_jobs))
+            save_cache(cache, probs)
+        self._init_probs(probs)
+
+    def get_probs(self, words, n_jobs=1, chunk_size=10000):
+        if n_jobs == 1:
+            return [10**self.lm.score(' '.join(word)) for word in words]
+        pool = multiprocessing.Pool(n_jobs, _load_lm, (self.lm.path,))
+        try:
+            chunks = pool.imap(_score_words, (words[i:i+chunk_size]
+                for i in xrange(0, len(words), chunk_size)))
+            return [p for chunk in chunks for p in chunk]
+        finally:
+            pool.close()
+            pool.join()
+
+    def get_prob(self, k):
+        chars = ' '.join(self.vocabulary[k])
+        return 10**self.lm.score(chars)
+
     def __getstate__(self):
-        return (self.lm.path, self.vocabulary)
+        return (self.lm.path, self.vocabulary, self.K, self.count)
 
     def __setstate__(self, state):
-        path, self.vocabulary = state
+        count = None
+        if len(state) == 2: # no probability cache
+            (path, self.vocabulary), K = state, 0
+        elif len(state) == 3:
+            path, self.vocabulary, K = state
+        else:
+            path, self.vocabulary, K, count = state
         self.lm = kenlm.LanguageModel(path)
-        self.K = 0
+        probs = load_cache(cache_path(path, list(self.vocabulary)[:K]), K)
+        if probs is None: # computed lazily
+            probs = numpy.empty(K)
+            probs.fill(numpy.nan)
+        self._init_probs(probs)
+        self._restore_count(count)
 
     def __repr__(self):
         return 'CharLM(n={self.lm.order})'.format(self=self)
 
-class PoissonUniformCharLM:
+class PoissonUniformCharLM(BaseCharLM):
     def __init__(self, vocabulary):
         self.vocabulary = vocabulary
-        self.K = len(vocabulary)
-        L = sum(map(len, vocabulary))
-        self.length = L/float(self.K) - 1 # Poisson MLE
+        lengths = numpy.array(map(len, vocabulary))
+        self.length = lengths.sum()/float(len(lengths)) - 1 # Poisson MLE
         self.n_char = len(set(c for w in vocabulary for c in w))
-        self.count = numpy.zeros(self.K)
-        self.probs = numpy.zeros(self.K)
-        for k in xrange(self.K):
-            self.probs[k] = self.get_prob(k)
-
-    def increment(self, k):
-        assert (0 <= k < self.K)
-        self.count[k] += 1
-
-    def decrement(self, k):
-        assert (0 <= k < self.K)
-        self.count[k] -= 1
+        self._init_probs(self.get_probs(lengths))
+
+    def get_probs(self, word_lengths):
+        """ vectorized get_prob for an array of word lengths """
+        lgamma = numpy.array([math.lgamma(n) if n > 0 else 0.0
+            for n in xrange(word_lengths.max() + 1 if len(word_lengths) else 1)])
+        return numpy.exp((word_lengths - 1) * math.log(self.length) # length^w
+                - lgamma[word_lengths] - self.length # exp(-length) / w!
+                - self.length * math.log(self.n_char)) # (1/nc)^w
 
     def get_prob(self, k):
         word_length = len(self.vocabulary[k]) # ~ 1 + Poisson(length)
@@ -80,23 +174,13 @@ class PoissonUniformCharLM:
                 - math.lgamma(word_length) - self.length # exp(-length) / w!
                 - self.length * math.log(self.n_char)) # (1/nc)^w
 
-    def prob(self, k):
-        assert (k >= 0)
-        if k >= self.K: return self.get_prob(k)
-        return self.probs[k]
-
-    def log_likelihood(self, full=False):
-        return numpy.log(self.probs).dot(self.count)
-
-    def resample_hyperparemeters(self, n_iter):
-        return (0, 0)
-
     def __getstate__(self):
-        return (self.length, self.n_char, self.vocabulary)
+        return (self.length, self.n_char, self.vocabulary, self.count)
 
     def __setstate__(self, state):
-        self.length, self.n_char, self.vocabulary = state
-        self.K = 0
+        self.length, self.n_char, self.vocabulary = state[:3]
+        self._init_probs(self.get_probs(numpy.array(map(len, self.vocabulary))))
+        self._restore_count(state[3] if len(state) > 3 else None)
 
     def __repr__(self):
         return ('PoissonUniformCharLM(length={self.length}, '
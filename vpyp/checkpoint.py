@@ -0,0 +1,131 @@
+""" Compact sampler checkpoints: seating arrangements, counts and hyperparameters
+as flat arrays in a .npz file, with the random state and the iteration number """
+import os
+import random
+from array import array
+from itertools import izip
+try:
+    import numpypy
+except ImportError:
+    pass
+import numpy
+from .pyp import CRP
+
+def as_array(values, dtype=numpy.int64):
+    return numpy.array(values, dtype=dtype) if len(values) else numpy.zeros(0, dtype=dtype)
+
+def flatten(sequences, dtype=numpy.int32):
+    """ list of sequences -> (lengths, concatenated values); None counts as empty """
+    lengths, values = array('l'), array('l')
+    for sequence in sequences:
+        if sequence is None:
+            lengths.append(-1)
+        else:
+            lengths.append(len(sequence))
+            values.extend(sequence)
+    return as_array(lengths), as_array(values, dtype)
+
+def unflatten(lengths, values):
+    sequences, values, start = [], values.tolist(), 0
+    for n in lengths.tolist():
+        if n < 0:
+            sequences.append(None)
+        else:
+            sequences.append(values[start:start+n])
+            start += n
+    return sequences
+
+def seating_state(restaurants, prefix=''):
+    """ tables of a list of CRPs: #dishes of each restaurant, dishes, #tables of each
+    dish and table sizes """
+    n_dishes, dishes, n_tables, sizes = array('l'), array('l'), array('l'), array('l')
+    for restaurant in restaurants:
+        n_dishes.append(len(restaurant.tables))
+        for k, tables in restaurant.tables.iteritems():
+            dishes.append(k)
+            n_tables.append(len(tables))
+            sizes.extend(tables)
+    return {prefix+'n_dishes': as_array(n_dishes), prefix+'dishes': as_array(dishes),
+            prefix+'n_tables': as_array(n_tables), prefix+'sizes': as_array(sizes)}
+
+def set_seating(restaurants, state, prefix=''):
+    dishes = state[prefix+'dishes'].tolist()
+    n_tables = state[prefix+'n_tables'].tolist()
+    sizes = state[prefix+'sizes'].tolist()
+    d = t = 0
+    for restaurant, n in izip(restaurants, state[prefix+'n_dishes'].tolist()):
+        restaurant.tables, restaurant.ncustomers = {}, {}
+        restaurant.ntables = restaurant.total_customers = 0
+        for k, m in izip(dishes[d:d+n], n_tables[d:d+n]):
+            tables = sizes[t:t+m]
+            restaurant.tables[k] = tables
+            restaurant.ncustomers[k] = sum(tables)
+            restaurant.ntables += m
+            restaurant.total_customers += restaurant.ncustomers[k]
+            t += m
+        d += n
+
+def prior_state(priors):
+    return numpy.array([prior.parameters for prior in priors], dtype=float)
+
+def set_priors(priors, parameters):
+    for prior, params in izip(priors, parameters.tolist()):
+        prior.parameters = tuple(params)
+
+counters = ('count', 'N', 'positive', 'total')
+
+def distribution_state(distribution, prefix):
+    """ state of a base distribution: seating and hyperparameters of a PYP (and of
+    its base, recursively) or the counts of the other distributions """
+    if isinstance(distribution, CRP):
+        state = seating_state([distribution], prefix)
+        state[prefix+'prior'] = prior_state([distribution.prior])
+        state.update(distribution_state(distribution.base, prefix+'base.'))
+        return state
+    return dict((prefix+name, numpy.asarray(getattr(distribution, name)))
+            for name in counters if hasattr(distribution, name))
+
+def set_distribution_state(distribution, state, prefix):
+    if isinstance(distribution, CRP):
+        set_seating([distribution], state, prefix)
+        set_priors([distribution.prior], state[prefix+'prior'])
+        set_distribution_state(distribution.base, state, prefix+'base.')
+        return
+    for name in counters:
+        if hasattr(distribution, name):
+            value = state[prefix+name]
+            if isinstance(getattr(distribution, name), numpy.ndarray):
+                setattr(distribution, name, value.copy())
+            else:
+                setattr(distribution, name, type(getattr(distribution, name))(value))
+
+def save(path, iteration, state):
+    """ write a checkpoint atomically (the previous one is kept until it is replaced) """
+    version, internal, gauss = random.getstate()
+    tmp = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(tmp, 'wb') as f:
+        numpy.savez(f, iteration=iteration, rng_version=version,
+                rng_state=numpy.array(internal, dtype=numpy.int64),
+                rng_gauss=(numpy.nan if gauss is None else gauss), **state)
+    os.rename(tmp, path)
+
+def load(path):
+    """ read a checkpoint and restore the random state -> (iteration, state) """
+    data = numpy.load(path)
+    state = dict((name, data[name]) for name in data.files)
+    data.close()
+    gauss = float(state.pop('rng_gauss'))
+    random.setstate((int(state.pop('rng_version')), tuple(state.pop('rng_state').tolist()),
+        None if gauss != gauss else gauss))
+    return int(state.pop('iteration')), state
+
+class Checkpointer(object):
+    """ write the state returned by get_state(*args) every n iterations """
+    def __init__(self, path, every, get_state):
+        self.path = path
+        self.every = every
+        self.get_state = get_state
+
+    def __call__(self, iteration, *args):
+        if iteration % self.every == 0:
+            save(self.path, iteration, self.get_state(*args))
@@ -0,0 +1,94 @@
+""" Chunked model files: the sections of a model (shared bases and priors, blocks of
+topics or t-table entries...) are serialized separately and listed in an index, so that
+tools can load only the sections they need. Objects of other sections are referenced by
+(section, position) and loaded on demand; plain pickles are read as well. """
+import os
+import struct
+import cPickle
+from cStringIO import StringIO
+
+MAGIC = 'VPYPCNT1'
+FOOTER = struct.Struct('<Q') # offset of the index
+
+def save(path, model, sections=None):
+    """ write model with its sections [(name, [objects])] (default: model.sections())
+    atomically; objects of a section are referenced from the others by position """
+    if sections is None:
+        sections = model.sections() if hasattr(model, 'sections') else []
+    references = {} # id(object) -> (section, position)
+    for name, objects in sections:
+        for i, obj in enumerate(objects):
+            references[id(obj)] = (name, i)
+    index = {}
+    tmp = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC)
+        for name, obj in sections + [('model', model)]:
+            own = set(map(id, obj)) if name != 'model' else set()
+            def persistent_id(o):
+                if id(o) in own: return None
+                return references.get(id(o))
+            offset = f.tell()
+            pickler = cPickle.Pickler(f, protocol=-1)
+            pickler.persistent_id = persistent_id
+            pickler.dump(obj)
+            index[name] = (offset, f.tell() - offset)
+        offset = f.tell()
+        cPickle.dump(index, f, protocol=-1)
+        f.write(FOOTER.pack(offset))
+    os.rename(tmp, path)
+
+class Container(object):
+    """ sections of a model file, unpickled when first accessed """
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.file.seek(-FOOTER.size, os.SEEK_END)
+        offset, = FOOTER.unpack(self.file.read(FOOTER.size))
+        self.file.seek(offset)
+        self.index = cPickle.load(self.file)
+        self.loaded = {}
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __getitem__(self, name):
+        """ objects of a section ('model': the whole model) """
+        if name not in self.loaded:
+            offset, size = self.index[name]
+            self.file.seek(offset)
+            unpickler = cPickle.Unpickler(StringIO(self.file.read(size)))
+            unpickler.persistent_load = self.reference # may load other sections
+            self.loaded[name] = unpickler.load()
+        return self.loaded[name]
+
+    def reference(self, reference):
+        name, i = reference
+        return self[name][i]
+
+    def get(self, name, i):
+        return self[name][i]
+
+    def model(self):
+        return self['model']
+
+    def close(self):
+        self.file.close()
+
+def is_container(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+def open_model(path):
+    """ Container of a chunked model file, None for a plain pickle """
+    return Container(path) if is_container(path) else None
+
+def load(path):
+    """ whole model, from a chunked model file or a plain pickle """
+    if is_container(path):
+        container = Container(path)
+        try:
+            return container.model()
+        finally:
+            container.close()
+    with open(path, 'rb') as f:
+        return cPickle.load(f)
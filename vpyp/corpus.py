@@ -1,5 +1,14 @@
-from collections import deque
+import gzip
+import bz2
+import struct
+from array import array
+from collections import deque, Counter
 from itertools import chain, repeat
+try:
+    import numpypy
+except ImportError:
+    pass
+import numpy
 
 START, STOP = 0, 1
 
@@ -62,9 +71,186 @@ class Corpus:
     def __len__(self):
         return len(self.segments)
 
+class FlatCorpus:
+    """ segments stored as one flat array of token ids plus an offsets array """
+    def __init__(self, tokens, offsets, vocabulary):
+        self.tokens = tokens
+        self.offsets = offsets
+        self.vocabulary = vocabulary
+
+    def __getitem__(self, i):
+        return self.tokens[self.offsets[i]:self.offsets[i+1]].tolist()
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def n_tokens(self):
+        return len(self.tokens)
+
+    def remap(self, vocabulary):
+        """ express the corpus with the ids of another vocabulary """
+        mapping = numpy.array([vocabulary[word] for word in self.vocabulary], dtype=numpy.int32)
+        if (mapping == numpy.arange(len(mapping))).all():
+            return FlatCorpus(self.tokens, self.offsets, vocabulary)
+        return FlatCorpus(mapping[self.tokens], self.offsets, vocabulary)
+
+    def sort_vocabulary(self, n_reserved=2):
+        """ renumber ids by decreasing frequency (in place, including the vocabulary)
+        the first n_reserved ids (<s>, </s>, NULL...) are kept unchanged """
+        counts = numpy.bincount(self.tokens, minlength=len(self.vocabulary))
+        order = numpy.concatenate((numpy.arange(n_reserved),
+            n_reserved + numpy.argsort(-counts[n_reserved:], kind='mergesort')))
+        rank = numpy.empty(len(order), dtype=numpy.int32)
+        rank[order] = numpy.arange(len(order))
+        self.vocabulary.update(Vocabulary(start_stop=False,
+            init=[self.vocabulary[int(k)] for k in order]))
+        self.tokens = rank[self.tokens]
+
+    def concatenate(self, other):
+        """ segments of this corpus followed by those of other (same vocabulary) """
+        return FlatCorpus(numpy.concatenate((self.tokens, other.tokens)),
+                numpy.concatenate((self.offsets, other.offsets[1:] + self.offsets[-1])),
+                self.vocabulary)
+
+    def prepend(self, k):
+        """ add token k at the beginning of every segment """
+        tokens = numpy.insert(self.tokens, self.offsets[:-1], k)
+        offsets = self.offsets + numpy.arange(len(self.offsets))
+        return FlatCorpus(tokens, offsets, self.vocabulary)
+
+class ParallelCorpus:
+    def __init__(self, source, target):
+        assert len(source) == len(target)
+        self.source = source
+        self.target = target
+
+    def __getitem__(self, i):
+        return (self.source[i], self.target[i])
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def __len__(self):
+        return len(self.source)
+
+def flat_corpus(tokens, offsets, vocabulary):
+    """ build a FlatCorpus from array('i') tokens and array('l') offsets """
+    return FlatCorpus(numpy.frombuffer(tokens, dtype=numpy.int32),
+            numpy.frombuffer(offsets, dtype=numpy.int64), vocabulary)
+
+def read_flat_corpus(stream, vocabulary):
+    tokens, offsets = array('i'), array('l', [0])
+    for seg in stream:
+        tokens.extend(vocabulary[word] for word in seg.decode('utf8').split())
+        offsets.append(len(tokens))
+    return flat_corpus(tokens, offsets, vocabulary)
+
+def read_flat_parallel_corpus(stream, source_vocabulary, target_vocabulary):
+    """ read a "f ||| e" bitext as a (source, target) pair of FlatCorpus """
+    vocabularies = (source_vocabulary, target_vocabulary)
+    sides = [(array('i'), array('l', [0])) for _ in vocabularies]
+    for line in stream:
+        f, e = line.decode('utf8').split(' ||| ')
+        for (tokens, offsets), vocabulary, seg in zip(sides, vocabularies, (f, e)):
+            tokens.extend(vocabulary[word] for word in seg.split())
+            offsets.append(len(tokens))
+    return tuple(flat_corpus(tokens, offsets, vocabulary)
+            for (tokens, offsets), vocabulary in zip(sides, vocabularies))
+
+# Binary corpus format:
+# MAGIC, number of sides, then for each side:
+# (vocabulary size in bytes, number of segments, number of tokens),
+# vocabulary (utf8, one word per line), offsets (int64), tokens (int32)
+# every block is padded to 8 bytes so that arrays can be memory-mapped
+
+MAGIC = 'VPYPCRP1'
+
+def _padding(n):
+    return -n % 8
+
+def write_flat(path, corpora):
+    with open(path, 'wb') as out:
+        out.write(MAGIC)
+        out.write(struct.pack('<Q', len(corpora)))
+        for corpus in corpora:
+            vocabulary = u'\n'.join(corpus.vocabulary).encode('utf8')
+            out.write(struct.pack('<QQQ', len(vocabulary), len(corpus), corpus.n_tokens))
+            out.write(vocabulary + '\0' * _padding(len(vocabulary)))
+            out.write(numpy.asarray(corpus.offsets, dtype=numpy.int64).tostring())
+            out.write(numpy.asarray(corpus.tokens, dtype=numpy.int32).tostring())
+            out.write('\0' * _padding(4 * corpus.n_tokens))
+
+def read_flat(path, mmap=True):
+    corpora = []
+    with open(path, 'rb') as stream:
+        assert stream.read(len(MAGIC)) == MAGIC
+        n_sides, = struct.unpack('<Q', stream.read(8))
+        for _ in xrange(n_sides):
+            vocab_size, n_segments, n_tokens = struct.unpack('<QQQ', stream.read(24))
+            words = stream.read(vocab_size).decode('utf8').split(u'\n') if vocab_size else []
+            vocabulary = Vocabulary(start_stop=False, init=words)
+            stream.seek(_padding(vocab_size), 1)
+            arrays = []
+            for dtype, size in ((numpy.int64, n_segments + 1), (numpy.int32, n_tokens)):
+                if mmap:
+                    arrays.append(numpy.memmap(path, dtype=dtype, mode='r',
+                        offset=stream.tell(), shape=(size,)))
+                    stream.seek(arrays[-1].nbytes, 1)
+                else:
+                    arrays.append(numpy.fromfile(stream, dtype=dtype, count=size))
+            stream.seek(_padding(4 * n_tokens), 1)
+            offsets, tokens = arrays
+            corpora.append(FlatCorpus(tokens, offsets, vocabulary))
+    return corpora
+
+def is_flat(path):
+    with open(path, 'rb') as stream:
+        return stream.read(len(MAGIC)) == MAGIC
+
+def open_corpus(path):
+    """ open a text corpus, transparently decompressing gzip/bz2 files """
+    if path.endswith('.gz'):
+        return gzip.open(path)
+    if path.endswith('.bz2'):
+        return bz2.BZ2File(path)
+    return open(path)
+
+def load_corpus(path, vocabulary):
+    """ read a text or binary corpus with the ids of the given vocabulary """
+    if is_flat(path):
+        corpus, = read_flat(path)
+        return corpus.remap(vocabulary)
+    with open_corpus(path) as stream:
+        return read_flat_corpus(stream, vocabulary)
+
 def ngrams(sentence, order):
     ngram = deque(maxlen=order)
     for w in chain(repeat(START, order-1), sentence, (STOP,)):
         ngram.append(w)
         if len(ngram) == order:
             yield tuple(ngram)
+
+def ngram_counts(corpus, order):
+    counts = Counter()
+    for sentence in corpus:
+        counts.update(ngrams(sentence, order))
+    return counts
+
+def read_ngram_counts(stream, vocabulary, order):
+    """ read "w_1 .. w_n<TAB>count" lines (SRILM/KenLM counts) into {ngram: count}
+    n-grams shorter than the order are only kept when they start with <s> """
+    counts = Counter()
+    for line in stream:
+        ngram, count = line.decode('utf8').rsplit(None, 1)
+        ngram = tuple(vocabulary[word] for word in ngram.split())
+        if len(ngram) < order:
+            if ngram[0] != START or ngram == (START,): continue
+            ngram = (START,)*(order-len(ngram)) + ngram
+        counts[ngram] += int(count)
+    return counts
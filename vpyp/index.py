@@ -0,0 +1,120 @@
+import argparse
+import logging
+import os
+import multiprocessing
+from array import array
+try:
+    import numpypy
+except ImportError:
+    pass
+import numpy
+from .corpus import (Vocabulary, FlatCorpus, open_corpus, read_flat_corpus,
+        read_flat_parallel_corpus, write_flat)
+
+def byte_ranges(path, n_chunks):
+    """ split a file into n_chunks byte ranges (start, end) """
+    size = os.path.getsize(path)
+    bounds = [size * i // n_chunks for i in xrange(n_chunks + 1)]
+    return [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if start < end]
+
+def read_lines(path, start, end):
+    """ lines whose first byte is in [start, end[ """
+    with open(path, 'rb') as stream:
+        if start > 0: # skip the end of the line owned by the previous range
+            stream.seek(start - 1)
+            pos = start - 1 + len(stream.readline())
+        else:
+            pos = 0
+        while pos < end:
+            line = stream.readline()
+            if not line: break
+            pos += len(line)
+            yield line
+
+def tokenize_range(args):
+    """ tokenize a byte range with local vocabularies (first-seen order) """
+    path, start, end, n_sides = args
+    vocabularies = [Vocabulary(start_stop=False) for _ in xrange(n_sides)]
+    sides = [(array('i'), array('l')) for _ in xrange(n_sides)]
+    for line in read_lines(path, start, end):
+        line = line.decode('utf8')
+        segs = line.split(' ||| ') if n_sides > 1 else (line,)
+        if len(segs) != n_sides:
+            raise ValueError('Expected {0} sides: {1}'.format(n_sides, line.encode('utf8')))
+        for (tokens, lengths), vocabulary, seg in zip(sides, vocabularies, segs):
+            words = seg.split()
+            tokens.extend(vocabulary[word] for word in words)
+            lengths.append(len(words))
+    return [(vocabulary.id2word, tokens, lengths)
+            for vocabulary, (tokens, lengths) in zip(vocabularies, sides)]
+
+def merge_chunks(chunks, vocabulary):
+    """ merge tokenized chunks (in file order) into one FlatCorpus
+    ids are identical to those of a serial read with the same vocabulary """
+    all_tokens, all_lengths = [], []
+    for words, tokens, lengths in chunks:
+        mapping = numpy.array([vocabulary[word] for word in words], dtype=numpy.int32)
+        all_tokens.append(mapping[numpy.frombuffer(tokens, dtype=numpy.int32)]
+                if len(tokens) else numpy.zeros(0, dtype=numpy.int32))
+        all_lengths.append(numpy.frombuffer(lengths, dtype=numpy.int64)
+                if len(lengths) else numpy.zeros(0, dtype=numpy.int64))
+    offsets = numpy.zeros(sum(map(len, all_lengths)) + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.concatenate(all_lengths), out=offsets[1:])
+    return FlatCorpus(numpy.concatenate(all_tokens), offsets, vocabulary)
+
+def parallel_read(path, vocabularies, n_jobs, chunks_per_job=4):
+    """ tokenize an uncompressed file in n_jobs worker processes
+    returns one FlatCorpus per side (one side per vocabulary) """
+    ranges = byte_ranges(path, n_jobs * chunks_per_job)
+    pool = multiprocessing.Pool(n_jobs)
+    try:
+        results = pool.map(tokenize_range,
+                [(path, start, end, len(vocabularies)) for start, end in ranges])
+    finally:
+        pool.close()
+        pool.join()
+    return [merge_chunks([result[n] for result in results], vocabulary)
+            for n, vocabulary in enumerate(vocabularies)]
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    parser = argparse.ArgumentParser(description='Convert a text corpus to the binary format')
+    parser.add_argument('--input', help='text corpus (optionally .gz/.bz2)', required=True)
+    parser.add_argument('--output', help='binary corpus output path', required=True)
+    parser.add_argument('--parallel', help='input is a "f ||| e" bitext', action='store_true')
+    parser.add_argument('--jobs', help='number of tokenization processes', type=int, default=1)
+    parser.add_argument('--sort-vocab', help='renumber word ids by decreasing frequency',
+            action='store_true')
+
+    args = parser.parse_args()
+
+    vocabularies = [Vocabulary() for _ in xrange(2 if args.parallel else 1)]
+    compressed = args.input.endswith(('.gz', '.bz2'))
+    if args.jobs > 1 and not compressed:
+        logging.info('Reading corpus with %d processes', args.jobs)
+        corpora = parallel_read(args.input, vocabularies, args.jobs)
+    else:
+        if args.jobs > 1:
+            logging.info('Compressed input: reading corpus with a single process')
+        else:
+            logging.info('Reading corpus')
+        with open_corpus(args.input) as stream:
+            if args.parallel:
+                corpora = read_flat_parallel_corpus(stream, *vocabularies)
+            else:
+                corpora = [read_flat_corpus(stream, *vocabularies)]
+
+    if args.sort_vocab:
+        logging.info('Sorting vocabulary by frequency')
+        for corpus in corpora:
+            corpus.sort_vocabulary()
+
+    for corpus in corpora:
+        logging.info('Segments: %d\tTokens: %d\tVocabulary: %d',
+                len(corpus), corpus.n_tokens, len(corpus.vocabulary))
+    logging.info('Writing binary corpus')
+    write_flat(args.output, corpora)
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,18 @@
 import logging
+from itertools import izip
+try:
+    import numpypy
+except ImportError:
+    pass
+import numpy
 from ..prob import mult_sample, DirichletMultinomial
 from ..prior import GammaPrior, PYPPrior, stuple
 from ..pyp import PYP
+from ..checkpoint import (seating_state, set_seating, prior_state, set_priors,
+        distribution_state, set_distribution_state)
+
+def topic_section(k):
+    return 'topic_word.{0}'.format(k)
 
 class TopicModel(object):
     def __init__(self, n_topics):
@@ -23,6 +34,30 @@ class TopicModel(object):
     def prob(self, doc, word):
         return sum(self.topic_prob(doc, word, k) for k in xrange(self.n_topics))
 
+    def hyperparameters(self):
+        return {'alpha': self.alpha.x}
+
+    def stats(self):
+        return {'documents': len(self.document_topic), 'topics': self.n_topics}
+
+    def sections(self):
+        """ sections of a chunked model file (vpyp.container): one per topic """
+        sections = [('alpha', [self.alpha]), ('document_topic', self.document_topic)]
+        if hasattr(self, 'vocabulary'):
+            sections.append(('vocabulary', [self.vocabulary]))
+        return sections + [(topic_section(k), [topic])
+                for k, topic in enumerate(self.topic_word)]
+
+    def document_state(self):
+        return {'document_topic': numpy.array([d.count for d in self.document_topic]),
+                'alpha': prior_state([self.alpha])}
+
+    def set_document_state(self, state):
+        for d, count in izip(self.document_topic, state['document_topic']):
+            d.count = count.copy()
+            d.N = int(count.sum())
+        set_priors([self.alpha], state['alpha'])
+
     def map_estimate(self, n_words):
         for topic in self.topic_word:
             yield [topic.prob(word) for word in range(n_words)]
@@ -48,6 +83,27 @@ class LDA(TopicModel):
         a2, r2 = self.beta.resample(n_iter)
         return (a1+a2, r1+r2)
 
+    def sections(self):
+        return [('beta', [self.beta])] + super(LDA, self).sections()
+
+    def hyperparameters(self):
+        params = super(LDA, self).hyperparameters()
+        params['beta'] = self.beta.x
+        return params
+
+    def get_checkpoint(self):
+        state = self.document_state()
+        state['topic_word'] = numpy.array([t.count for t in self.topic_word])
+        state['beta'] = prior_state([self.beta])
+        return state
+
+    def set_checkpoint(self, state):
+        self.set_document_state(state)
+        for t, count in izip(self.topic_word, state['topic_word']):
+            t.count = count.copy()
+            t.N = int(count.sum())
+        set_priors([self.beta], state['beta'])
+
     def __repr__(self):
         return ('LDA(#topics={self.n_topics} '
                 '| alpha={self.alpha}, beta={self.beta})').format(self=self)
@@ -78,6 +134,38 @@ class LPYA(TopicModel):
             ar += topic.resample_hyperparemeters(n_iter) # d_w, T_w
         return ar
 
+    def resample_base(self): # the customers of the base are the tables of the topics
+        if isinstance(self.topic_base, PYP):
+            self.topic_base.resample_seating()
+            self.topic_base.resample_base()
+
+    def sections(self):
+        return [('topic_base', [self.topic_base])] + super(LPYA, self).sections()
+
+    def hyperparameters(self): # topic PYPs: mean over the (exchangeable) topics
+        params = super(LPYA, self).hyperparameters()
+        params['d'] = sum(t.d for t in self.topic_word) / self.n_topics
+        params['theta'] = sum(t.theta for t in self.topic_word) / self.n_topics
+        return params
+
+    def stats(self):
+        stats = super(LPYA, self).stats()
+        stats['tables'] = sum(t.ntables for t in self.topic_word)
+        return stats
+
+    def get_checkpoint(self):
+        state = self.document_state()
+        state.update(seating_state(self.topic_word, 'topic_word.'))
+        state['topic_word.prior'] = prior_state([t.prior for t in self.topic_word])
+        state.update(distribution_state(self.topic_base, 'topic_base.'))
+        return state
+
+    def set_checkpoint(self, state):
+        self.set_document_state(state)
+        set_seating(self.topic_word, state, 'topic_word.')
+        set_priors([t.prior for t in self.topic_word], state['topic_word.prior'])
+        set_distribution_state(self.topic_base, state, 'topic_base.')
+
     def __repr__(self):
         return ('LPYA(#topics={self.n_topics} '
                 '| alpha={self.alpha}, beta=PYP(base={self.topic_base}))').format(self=self)
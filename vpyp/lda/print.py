@@ -1,23 +1,34 @@
 import argparse
 import logging
-import cPickle
 import heapq
+from .. import container
+from model import topic_section
 
 def main():
     logging.basicConfig(level=logging.INFO, format='%(message)s')
 
     parser = argparse.ArgumentParser(description='Print LDA model')
     parser.add_argument('model', help='trained model')
+    parser.add_argument('--topics', help='comma-separated topics to print (default: all)')
     args = parser.parse_args()
 
-    with open(args.model) as m:
-        model = cPickle.load(m)
+    model_file = container.open_model(args.model)
+    if args.topics and model_file: # load only the printed topics
+        vocabulary = model_file.get('vocabulary', 0)
+        topics = [(k, model_file.get(topic_section(k), 0))
+                for k in map(int, args.topics.split(','))]
+    else:
+        model = model_file.model() if model_file else container.load(args.model)
+        vocabulary = model.vocabulary
+        topics = list(enumerate(model.topic_word))
+        if args.topics:
+            topics = [topics[k] for k in map(int, args.topics.split(','))]
     
-    for i, topic in enumerate(model.topic_word):
+    for i, topic in topics:
         print('Topic {0}'.format(i))
-        word_prob = ((topic.prob(w), w) for w in xrange(len(model.vocabulary)))
+        word_prob = ((topic.prob(w), w) for w in xrange(len(vocabulary)))
         for prob, w in heapq.nlargest(10, word_prob):
-            print(u'{0} {1}'.format(model.vocabulary[w], prob).encode('utf8'))
+            print(u'{0} {1}'.format(vocabulary[w], prob).encode('utf8'))
         print('---------')
 
 if __name__ == '__main__':
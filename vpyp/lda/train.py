@@ -1,70 +1,129 @@
 import argparse
 import logging
-import math
-import cPickle
-from ..corpus import Vocabulary, read_corpus
+from ..corpus import Vocabulary, load_corpus
 from ..prob import Uniform
+from .. import checkpoint, container
+from ..metrics import Metrics
+from .. import sampler, chains
+from ..sampler import Sampler
 from model import LDA, LPYA
 
-mh_iter = 100 # number of Metropolis-Hastings sampling iterations
-
-def run_sampler(model, corpus, n_iter, cb=None):
-    assignments = [[None]*len(document) for document in corpus]
+def run_sampler(model, corpus, n_iter, cb=None, assignments=None, start=0, checkpoint=None,
+        metrics=None, schedule=None):
+    if assignments is None:
+        assignments = [[None]*len(document) for document in corpus]
     n_words = sum(len(document) for document in corpus)
-    for it in range(n_iter):
-        logging.info('Iteration %d/%d', it+1, n_iter)
+    def sweep(it):
         for d, document in enumerate(corpus):
             document_assignments = assignments[d]
             for i, word in enumerate(document):
-                if it > 0: model.decrement(d, word, document_assignments[i])
+                if document_assignments[i] is not None:
+                    model.decrement(d, word, document_assignments[i])
                 document_assignments[i] = model.increment(d, word)
-        if it % 10 == 0:
-            logging.info('Model: %s', model)
-            ll = model.log_likelihood()
-            ppl = math.exp(-ll / n_words)
-            logging.info('LL=%.0f ppl=%.3f', ll, ppl)
-        if it % 30 == 29:
-            logging.info('Resampling hyperparameters...')
-            acceptance, rejection = model.resample_hyperparemeters(mh_iter)
-            arate = acceptance / float(acceptance + rejection)
-            logging.info('Metropolis-Hastings acceptance rate: %.4f', arate)
-            logging.info('Model: %s', model)
-            ll = model.log_likelihood()
-            ppl = math.exp(-ll / n_words)
-            logging.info('LL=%.0f ppl=%.3f', ll, ppl)
-        if cb: cb(it)
+    hooks = []
+    if cb: hooks.append(('callback', lambda iteration: cb(iteration - 1)))
+    if checkpoint:
+        hooks.append(('checkpoint', lambda iteration: checkpoint(iteration, assignments)))
+    return Sampler(model, sweep, n_words, schedule, metrics, hooks).run(n_iter, start)
+
+def train(args, vocabulary, training_corpus, topic_base=None, suffix='', report=None,
+        stopped=None):
+    """ sample a model (one chain; suffix: of the checkpoint and metrics paths) """
+    if args.pyp:
+        model = LPYA(args.topics, len(training_corpus),
+                topic_base or Uniform(len(vocabulary)))
+    else:
+        model = LDA(args.topics, len(training_corpus), len(vocabulary))
+
+    suffixed = lambda path: (path + suffix if path else None)
+    start, assignments = 0, None
+    if args.resume:
+        logging.info('Resuming from checkpoint %s', suffixed(args.checkpoint))
+        start, state = checkpoint.load(suffixed(args.checkpoint))
+        model.set_checkpoint(state)
+        assignments = checkpoint.unflatten(state['assignments.lengths'],
+                state['assignments'])
+
+    def get_state(assignments):
+        state = model.get_checkpoint()
+        state['assignments.lengths'], state['assignments'] = checkpoint.flatten(assignments)
+        return state
+    checkpointer = (checkpoint.Checkpointer(suffixed(args.checkpoint), args.checkpoint_every,
+        get_state) if args.checkpoint else None)
+
+    logging.info('Training model with %d topics', args.topics)
+    if report:
+        metrics = chains.ChainMetrics(report, suffixed(args.metrics),
+                profile_iter=args.profile_iter)
+    else:
+        metrics = Metrics(args.metrics, profile_iter=args.profile_iter)
+    schedule = sampler.schedule(args)
+    schedule.stop = stopped
+    run_sampler(model, training_corpus, args.iter, assignments=assignments, start=start,
+            checkpoint=checkpointer, metrics=metrics, schedule=schedule)
+    metrics.close()
+    return model
 
 def main():
     logging.basicConfig(level=logging.INFO, format='%(message)s')
 
     parser = argparse.ArgumentParser(description='Train LDA model')
-    parser.add_argument('--train', help='training corpus', required=True)
+    parser.add_argument('--train', help='training corpus (text or binary)', required=True)
     parser.add_argument('--topics', help='number of topics', type=int, required=True)
     parser.add_argument('--iter', help='number of iterations', type=int, required=True)
     parser.add_argument('--pyp', help='use pyp priors', action='store_true')
-    parser.add_argument('--output', help='model output path')
+    parser.add_argument('--charlm', help='character LM base of the topic-word PYPs (with --pyp)')
+    parser.add_argument('--jobs', help='number of processes scoring the vocabulary with '
+            'the character LM', type=int, default=1)
+    parser.add_argument('--sort-vocab', help='renumber word ids by decreasing frequency',
+            action='store_true')
+    parser.add_argument('--output', help='model output path (chains: best chain)')
+    parser.add_argument('--checkpoint', help='sampler checkpoint path')
+    parser.add_argument('--checkpoint-every', help='write a checkpoint every N iterations',
+            type=int, default=10)
+    parser.add_argument('--resume', help='resume sampling from the checkpoint',
+            action='store_true')
+    sampler.add_arguments(parser)
+    chains.add_arguments(parser)
+    parser.add_argument('--metrics', help='per-iteration metrics output (JSON lines)')
+    parser.add_argument('--profile-iter', help='profile iteration N (written to '
+            'METRICS.iterN.prof)', type=int)
 
     args = parser.parse_args()
+    if args.resume and not args.checkpoint:
+        parser.error('--resume requires --checkpoint')
 
     vocabulary = Vocabulary()
 
     logging.info('Reading training corpus')
-    with open(args.train) as train:
-        training_corpus = read_corpus(train, vocabulary)
+    training_corpus = load_corpus(args.train, vocabulary)
+    if args.sort_vocab:
+        logging.info('Sorting vocabulary by frequency')
+        training_corpus.sort_vocabulary()
 
-    if args.pyp:
-        topic_base = Uniform(len(vocabulary))
-        model = LPYA(args.topics, len(training_corpus), topic_base)
+    if args.pyp and args.charlm:
+        from ..charlm import CharLM
+        logging.info('Preloading character language model')
+        topic_base = CharLM(args.charlm, vocabulary, args.jobs)
     else:
-        model = LDA(args.topics, len(training_corpus), len(vocabulary))
+        topic_base = None
 
-    logging.info('Training model with %d topics', args.topics)
-    run_sampler(model, training_corpus, args.iter)
+    if args.chains > 1:
+        logging.info('Sampling %d chains', args.chains)
+        def run_chain(chain, report, stopped):
+            model = train(args, vocabulary, training_corpus, topic_base,
+                    '.chain{0}'.format(chain), report, stopped)
+            return model.log_likelihood(), model
+        results = chains.run_chains(args.chains, run_chain, args.rhat)
+        for chain, (ll, _) in enumerate(results):
+            logging.info('Chain %d: LL=%.0f', chain, ll)
+        _, model = max(results) # topics cannot be matched across chains: keep the best one
+    else:
+        model = train(args, vocabulary, training_corpus, topic_base)
 
     if args.output:
         model.vocabulary = vocabulary
-        with open(args.output, 'w') as f:
-            cPickle.dump(model, f, protocol=-1)
+        container.save(args.output, model)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,77 @@
+""" Per-iteration sampler instrumentation: phase timings, throughput, model sizes and
+memory usage written as JSON lines, and optional profiling of one iteration """
+import json
+import time
+import logging
+import resource
+import cProfile
+import pstats
+from StringIO import StringIO
+from contextlib import contextmanager
+
+def rss_mb():
+    """ current resident set size (peak size where /proc is not available) """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() / 1048576.
+    except IOError:
+        return peak_rss_mb()
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+class Metrics(object):
+    """ Metrics(path, n_tokens, profile_iter): the timings of each iteration are kept
+    in self.record; they are written to path (if any) together with model.stats() """
+    def __init__(self, path=None, n_tokens=0, profile_iter=None, profile_path=None):
+        self.output = open(path, 'a') if path else None
+        self.n_tokens = n_tokens
+        self.profile_iter = profile_iter
+        self.profile_path = profile_path or '{0}.iter{1}.prof'.format(path or 'vpyp',
+                profile_iter)
+        self.profiler = None
+        self.record = {}
+
+    def start(self, iteration):
+        self.record = {'iteration': iteration, 'start': time.time()}
+        if iteration == self.profile_iter:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            key = 'time_' + name
+            self.record[key] = self.record.get(key, 0) + time.time() - start
+
+    def set(self, **values):
+        self.record.update(values)
+
+    def end(self, model=None):
+        record = self.record
+        if self.profiler:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile_path)
+            summary = StringIO()
+            pstats.Stats(self.profiler, stream=summary).sort_stats('cumulative').print_stats(20)
+            logging.info('Profile of iteration %d (%s):\n%s', record['iteration'],
+                    self.profile_path, summary.getvalue())
+            self.profiler = None
+        record['time_total'] = time.time() - record.pop('start')
+        if record.get('time_sweep'):
+            record['tokens_per_sec'] = self.n_tokens / record['time_sweep']
+        if self.output:
+            if model is not None and hasattr(model, 'stats'):
+                record.update(model.stats())
+            record['rss_mb'] = rss_mb()
+            record['peak_rss_mb'] = peak_rss_mb()
+            self.output.write(json.dumps(record, sort_keys=True) + '\n')
+            self.output.flush()
+
+    def close(self):
+        if self.output:
+            self.output.close()
+            self.output = None
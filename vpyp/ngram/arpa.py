@@ -2,8 +2,8 @@ import argparse
 import logging
 import math
 import sys
-import cPickle
 from ..corpus import START, STOP
+from .. import container
 
 def print_arpa(model, vocabulary):
     vocabulary |= {START, STOP}
@@ -63,6 +63,27 @@ def print_arpa(model, vocabulary):
         yield '\\end\\'
     sys.stdout.writelines(l.encode('utf8')+'\n' for l in lines())
 
+def print_backoff_arpa(lm, out=sys.stdout):
+    """ ARPA file of an explicit backoff model (e.g. vpyp.ngram.prune) """
+    def log10(p):
+        return math.log10(p) if p > 0 else -99
+
+    def lines():
+        yield '\\data\\'
+        for n in range(lm.order):
+            yield 'ngram {0}={1}'.format(n+1, len(lm.probs[n]))
+        yield ''
+        for n in range(lm.order):
+            yield '\\{0}-grams:'.format(n+1)
+            for ngram, p in sorted(lm.probs[n].iteritems()):
+                bow = lm.backoffs.get(ngram) if n < lm.order - 1 else None
+                if ngram == (START,): p = 0 # never predicted
+                yield u'{0}\t{1}{2}'.format(log10(p), ' '.join(lm.vocabulary[w] for w in ngram),
+                        '' if bow is None else '\t'+str(math.log10(bow)))
+            yield ''
+        yield '\\end\\'
+    out.writelines(l.encode('utf8')+'\n' for l in lines())
+
 def main():
     logging.basicConfig(level=logging.INFO, format='%(message)s')
 
@@ -73,8 +94,7 @@ def main():
     args = parser.parse_args()
 
     logging.info('Loading model')
-    with open(args.model) as model_file:
-        model = cPickle.load(model_file)
+    model = container.load(args.model)
 
     if args.vocab:
         logging.info('Reading vocabulary')
@@ -85,7 +105,11 @@ def main():
         vocabulary = set(xrange(2, len(model.vocabulary)))
     logging.info('Vocabulary size: %d', len(vocabulary))
 
-    print_arpa(model, vocabulary)
+    if hasattr(model, 'chains'): # AveragedLM: no restaurants, list the seated n-grams
+        from prune import backoff_lm
+        print_backoff_arpa(backoff_lm(model, vocabulary))
+    else:
+        print_arpa(model, vocabulary)
 
 if __name__ == '__main__':
     main()
@@ -1,8 +1,8 @@
 import argparse
 import logging
 import math
-import cPickle
-from ..corpus import read_corpus, ngrams
+from ..corpus import load_corpus, ngrams
+from .. import container
 
 def print_ppl(model, corpus):
     n_sentences = len(corpus)
@@ -24,18 +24,16 @@ def main():
     logging.basicConfig(level=logging.INFO, format='%(message)s')
 
     parser = argparse.ArgumentParser(description='Evaluate n-gram model')
-    parser.add_argument('--test', help='evaluation corpus', required=True)
+    parser.add_argument('--test', help='evaluation corpus (text or binary)', required=True)
     parser.add_argument('--model', help='trained model', required=True)
 
     args = parser.parse_args()
 
     logging.info('Loading model')
-    with open(args.model) as model_file:
-        model = cPickle.load(model_file)
+    model = container.load(args.model)
 
     logging.info('Reading evaluation corpus')
-    with open(args.test) as test:
-        test_corpus = read_corpus(test, model.vocabulary)
+    test_corpus = load_corpus(args.test, model.vocabulary)
 
     logging.info('Computing perplexity')
     print_ppl(model, test_corpus)
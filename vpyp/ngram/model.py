@@ -1,45 +1,198 @@
 import logging
+from array import array
+from itertools import izip
+from collections import defaultdict
 from ..pyp import PYP
 from ..prior import PYPPrior
+from ..corpus import START
+from ..checkpoint import (as_array, seating_state, set_seating, prior_state, set_priors,
+        distribution_state, set_distribution_state)
 
 class BackoffBase:
+    """ base of a context restaurant in models pickled before the context trie """
     def __init__(self, backoff, ctx):
         self.backoff = backoff
         self.ctx = ctx
 
-    def increment(self, k, initialize=False):
-        return self.backoff.increment(self.ctx, k)
+class ContextTrie(object):
+    """ contexts as integer nodes of a suffix trie, in parallel arrays: the parent of
+    a context is its backoff context (without its first word), and the restaurant of
+    a context has the restaurant of its parent as base """
+    def __init__(self, root):
+        self.parent = array('i', [-1])
+        self.word = array('i', [-1])
+        self.children = {} # (node, word) -> node
+        self.restaurants = [root] # of the empty context
+        self.priors = [root.prior] # of the restaurants at each depth
+        self.nodes = [[0]] # at each depth
 
-    def decrement(self, k):
-        return self.backoff.decrement(self.ctx, k)
+    def add_level(self, prior):
+        self.priors.append(prior)
+        self.nodes.append([])
 
-    def prob(self, k):
-        return self.backoff.prob(self.ctx, k)
+    def find(self, ctx):
+        """ node of the context, None if it has not been seen """
+        node = 0
+        for w in reversed(ctx):
+            node = self.children.get((node, w))
+            if node is None: return None
+        return node
+
+    def longest_suffix(self, ctx):
+        """ node of the longest seen suffix of the context """
+        node = 0
+        for w in reversed(ctx):
+            child = self.children.get((node, w))
+            if child is None: break
+            node = child
+        return node
+
+    def add(self, ctx, restaurant=None):
+        """ node of the context, created with its backoff contexts if needed """
+        node = 0
+        for depth, w in enumerate(reversed(ctx), 1):
+            child = self.children.get((node, w))
+            if child is None:
+                child = len(self.parent)
+                self.children[node, w] = child
+                self.parent.append(node)
+                self.word.append(w)
+                if restaurant is None or depth < len(ctx):
+                    self.restaurants.append(PYP(self.restaurants[node], self.priors[depth]))
+                else:
+                    restaurant.base = self.restaurants[node]
+                    self.restaurants.append(restaurant)
+                self.nodes[depth].append(child)
+            node = child
+        return node
+
+    def path(self, node):
+        """ nodes from the context to the empty context """
+        path = [node]
+        while node > 0:
+            node = self.parent[node]
+            path.append(node)
+        return path
+
+    def context(self, node):
+        ctx = []
+        while node > 0:
+            ctx.append(self.word[node])
+            node = self.parent[node]
+        return tuple(ctx)
+
+class Contexts(object):
+    """ {context: restaurant} view of the trie nodes of one depth """
+    def __init__(self, trie, depth):
+        self.trie = trie
+        self.depth = depth
+
+    def __len__(self):
+        return len(self.trie.nodes[self.depth])
+
+    def __contains__(self, ctx):
+        return len(ctx) == self.depth and self.trie.find(ctx) is not None
+
+    def get(self, ctx, default=None):
+        if len(ctx) != self.depth: return default
+        node = self.trie.find(ctx)
+        return default if node is None else self.trie.restaurants[node]
+
+    def __getitem__(self, ctx):
+        m = self.get(ctx)
+        if m is None: raise KeyError(ctx)
+        return m
+
+    def __iter__(self):
+        return self.iterkeys()
+
+    def iterkeys(self):
+        return (self.trie.context(node) for node in self.trie.nodes[self.depth])
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def itervalues(self):
+        return (self.trie.restaurants[node] for node in self.trie.nodes[self.depth])
+
+    def iteritems(self):
+        return ((self.trie.context(node), self.trie.restaurants[node])
+                for node in self.trie.nodes[self.depth])
 
 class PYPLM:
+    """ the contexts of all the levels are nodes of a shared ContextTrie;
+    models: {context: restaurant} view of the contexts of this level """
     def __init__(self, order, initial_base):
         self.prior = PYPPrior(1.0, 1.0, 1.0, 1.0, 0.8, 1.0) # d, theta = 0.8, 1
         self.order = order
         self.backoff = initial_base if order == 1 else PYPLM(order-1, initial_base)
-        self.models = {}
+        if order == 1:
+            self.trie = ContextTrie(PYP(initial_base, self.prior))
+        else:
+            self.trie = self.backoff.trie
+            self.trie.add_level(self.prior)
+        self.models = Contexts(self.trie, order-1)
 
     def __getitem__(self, ctx):
         """ create a new PYP if the context has not been seen """
-        if ctx not in self.models:
-            base = (self.backoff if self.order == 1 else BackoffBase(self.backoff, ctx[1:]))
-            return PYP(base, self.prior)
-        return self.models[ctx]
+        node = self.trie.find(ctx)
+        if node is None:
+            return PYP(self.trie.restaurants[self.trie.longest_suffix(ctx[1:])], self.prior)
+        return self.trie.restaurants[node]
 
     def increment(self, ctx, w):
-        if ctx not in self.models:
-            self.models[ctx] = self[ctx]
-        self.models[ctx].increment(w)
+        """ seat w in the restaurants of the context and of its backoffs, computing the
+        base probabilities once, bottom-up, below the first restaurant which has w """
+        restaurants = self.trie.restaurants
+        path = self.trie.path(self.trie.add(ctx))
+        seen = len(path)
+        for i, node in enumerate(path):
+            if w in restaurants[node].tables:
+                seen = i
+                break
+        p_base = [None] * len(path) # only needed to sample among existing tables
+        if seen < len(path):
+            p_base[-1] = restaurants[0].base.prob(w)
+            for i in xrange(len(path) - 2, seen - 1, -1):
+                p_base[i] = restaurants[path[i+1]]._prob(w, p_base[i+1])
+        for node, p in izip(path, p_base):
+            if not restaurants[node]._seat(w, p): return
+        restaurants[0].base.increment(w)
+
+    def initialize(self, counts, tables='kn'):
+        """ seat aggregated n-gram counts {ngram: count} without sampling
+        tables='kn': one table per type; tables='sample': sampled table counts
+        table counts are propagated as customers of the lower order """
+        backoff_counts = defaultdict(int)
+        for ngram, count in counts.iteritems():
+            m = self.trie.restaurants[self.trie.add(ngram[:-1])]
+            w = ngram[-1]
+            if tables == 'kn':
+                sizes = [count]
+            else:
+                sizes = m._sample_table_sizes(w, count)
+            m._seat_tables(w, sizes)
+            backoff_counts[ngram[1:] if self.order > 1 else w] += len(sizes)
+        if self.order == 1:
+            for w, count in backoff_counts.iteritems():
+                for _ in xrange(count):
+                    self.backoff.increment(w)
+        else:
+            self.backoff.initialize(backoff_counts, tables)
+
+    def extend_vocabulary(self, K):
+        """ grow the initial base to a vocabulary of K words """
+        base = self.trie.restaurants[0].base
+        while isinstance(base, PYP):
+            base = base.base
+        base.extend(K)
 
     def decrement(self, ctx, w):
-        self.models[ctx].decrement(w)
+        self.trie.restaurants[self.trie.find(ctx)].decrement(w)
 
     def prob(self, ctx, w):
-        return self[ctx].prob(w)
+        """ an unseen context has the probabilities of its longest seen suffix """
+        return self.trie.restaurants[self.trie.longest_suffix(ctx)].prob(w)
 
     def log_likelihood(self, full=False):
         return (sum(m.log_likelihood() for m in self.models.itervalues())
@@ -52,6 +205,123 @@ class PYPLM:
         a2, r2 = self.backoff.resample_hyperparemeters(n_iter)
         return (a1+a2, r1+r2)
 
+    def resample_base(self):
+        """ resample the seating of the backoff restaurants, whose customers are the
+        tables of the higher-order contexts (down to the initial base) """
+        restaurants = self.trie.restaurants
+        for depth in xrange(self.order-2, -1, -1):
+            for node in self.trie.nodes[depth]:
+                restaurants[node].resample_seating()
+        restaurants[0].resample_base()
+
+    def hyperparameters(self):
+        params, level = {}, self
+        while isinstance(level, PYPLM):
+            params['d_{0}'.format(level.order)] = level.prior.discount
+            params['theta_{0}'.format(level.order)] = level.prior.strength
+            level = level.backoff
+        if isinstance(level, PYP):
+            params['d_0'], params['theta_0'] = level.d, level.theta
+        return params
+
+    def stats(self):
+        """ number of contexts and tables of each level """
+        stats, level = {}, self
+        while isinstance(level, PYPLM):
+            stats['contexts_{0}'.format(level.order)] = len(level.models)
+            stats['tables_{0}'.format(level.order)] = sum(m.ntables
+                    for m in level.models.itervalues())
+            level = level.backoff
+        return stats
+
+    def get_checkpoint(self):
+        """ contexts, seating and hyperparameters of each level, and base state """
+        state, level = {}, self
+        while isinstance(level, PYPLM):
+            prefix = 'level{0}.'.format(level.order)
+            contexts = level.models.keys()
+            state[prefix+'contexts'] = as_array(contexts).reshape((len(contexts),
+                level.order-1))
+            state.update(seating_state(list(level.models.itervalues()), prefix))
+            state[prefix+'prior'] = prior_state([level.prior])
+            level = level.backoff
+        state.update(distribution_state(level, 'base.'))
+        return state
+
+    def set_checkpoint(self, state):
+        level = self
+        while isinstance(level, PYPLM):
+            prefix = 'level{0}.'.format(level.order)
+            nodes = [level.trie.add(tuple(ctx)) for ctx in state[prefix+'contexts'].tolist()]
+            set_seating([level.trie.restaurants[node] for node in nodes], state, prefix)
+            set_priors([level.prior], state[prefix+'prior'])
+            level = level.backoff
+        set_distribution_state(level, state, 'base.')
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if isinstance(self.models, dict): # pickled before the context trie
+            models = self.models
+            if self.order == 1:
+                root = models.get(()) or PYP(self.backoff, self.prior)
+                root.base = self.backoff
+                self.trie = ContextTrie(root)
+            else:
+                self.trie = self.backoff.trie
+                self.trie.add_level(self.prior)
+                for ctx, m in models.iteritems():
+                    self.trie.add(ctx, m)
+            self.models = Contexts(self.trie, self.order-1)
+
     def __repr__(self):
         return ('PYPLM(order={self.order}, #ctx={C}, prior={self.prior}, '
                 'backoff={self.backoff})').format(self=self, C=len(self.models))
+
+class AveragedLM(object):
+    """ predictive probabilities averaged over models (e.g. independent chains) """
+    def __init__(self, chains):
+        self.chains = chains
+        self.order = chains[0].order
+
+    def prob(self, ctx, w):
+        return sum(model.prob(ctx, w) for model in self.chains) / len(self.chains)
+
+    def __repr__(self):
+        return 'AveragedLM(#chains={0}, order={1})'.format(len(self.chains), self.order)
+
+class BackoffLM(object):
+    """ explicit backoff model (ARPA semantics): probabilities of the listed n-grams,
+    backoff weights of their contexts, and a single <s> at the start of histories """
+    def __init__(self, order, vocabulary):
+        self.order = order
+        self.vocabulary = vocabulary
+        self.probs = [{} for _ in xrange(order)] # n-gram -> probability, by length - 1
+        self.backoffs = {} # context -> weight
+
+    @staticmethod
+    def history(ctx):
+        while len(ctx) > 1 and ctx[0] == START and ctx[1] == START:
+            ctx = ctx[1:]
+        return ctx
+
+    def prob(self, ctx, w):
+        ctx, weight = self.history(ctx[max(0, len(ctx)-self.order+1):]), 1.
+        for i in xrange(len(ctx) + 1): # longest listed n-gram
+            h = ctx[i:]
+            p = self.probs[len(h)].get(h + (w,))
+            if p is not None: return weight * p
+            weight *= self.backoffs.get(h, 1.)
+        return 0
+
+    def copy(self):
+        lm = BackoffLM(self.order, self.vocabulary)
+        lm.probs = [dict(probs) for probs in self.probs]
+        lm.backoffs = dict(self.backoffs)
+        return lm
+
+    def __len__(self):
+        return sum(len(probs) for probs in self.probs)
+
+    def __repr__(self):
+        return 'BackoffLM(order={0}, #ngrams={1})'.format(self.order,
+                '+'.join(str(len(probs)) for probs in self.probs))
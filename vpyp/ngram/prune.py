@@ -0,0 +1,180 @@
+""" Relative entropy pruning (Stolcke, 1998) of a trained n-gram model, converted to an
+explicit backoff model which can be exported as ARPA or used by vpyp.ngram.eval """
+import argparse
+import logging
+import math
+import cPickle
+from collections import defaultdict
+from ..corpus import START, STOP
+from .. import container
+from model import BackoffLM
+from arpa import print_backoff_arpa
+
+def seated_ngrams(model, vocabulary):
+    """ (context, word) of the words seated in each context of a PYPLM, the contexts
+    starting with <s> being extended to full length """
+    levels, level = [], model
+    for _ in xrange(model.order):
+        levels.insert(0, level)
+        level = level.backoff
+    for w in vocabulary:
+        yield (), w
+    for n in xrange(1, model.order):
+        for ctx, m in levels[n].models.iteritems():
+            if any(c not in vocabulary for c in ctx): continue
+            if sum(c == START for c in ctx) > 1: continue # <s> <s>+ *
+            if ctx[0] == START: # extend to full context
+                m = levels[-1][(START,)*(model.order-n-1)+ctx]
+            for w in m.tables.iterkeys():
+                if w in vocabulary:
+                    yield ctx, w
+
+def backoff_lm(model, vocabulary):
+    """ listed n-grams of a PYPLM (as in vpyp.ngram.arpa): the words seated in each
+    context, with their predictive probabilities, and the backoff weights which
+    normalize the distribution of each context over the vocabulary (<s> included: its
+    unigram probability is kept so that the listed distributions sum to 1);
+    for an AveragedLM, the n-grams seated in any chain with their averaged probabilities """
+    vocabulary = vocabulary | {START, STOP}
+    lm = BackoffLM(model.order, model.vocabulary)
+    for chain in getattr(model, 'chains', [model]):
+        for ctx, w in seated_ngrams(chain, vocabulary):
+            if ctx + (w,) in lm.probs[len(ctx)]: continue
+            full_ctx = (START,)*(model.order-len(ctx)-1)+ctx if ctx[:1] == (START,) else ctx
+            lm.probs[len(ctx)][ctx+(w,)] = model.prob(full_ctx, w)
+    renormalize(lm)
+    return lm
+
+def history_prob(lm, h):
+    """ marginal probability of a history, <s> having probability 1 """
+    p = 1.
+    for i, w in enumerate(h):
+        if w != START:
+            p *= lm.prob(h[:i], w)
+    return p
+
+def contexts(lm, n):
+    """ {context: listed words} of the n-grams of order n+1 """
+    words = defaultdict(list)
+    for ngram in lm.probs[n]:
+        words[ngram[:-1]].append(ngram[-1])
+    return words
+
+def normalizers(lm, h, words):
+    """ probability mass left by the listed words in h and in its backoff context """
+    return (1 - sum(lm.probs[len(h)][h+(w,)] for w in words),
+            1 - sum(lm.prob(h[1:], w) for w in words))
+
+def renormalize(lm, n=1):
+    """ backoff weights of the contexts of length n and more, from the shortest (their
+    backoff distributions must be normalized first) """
+    for k in xrange(max(n, 1), lm.order):
+        words = contexts(lm, k)
+        for h in [h for h in lm.backoffs if len(h) == k and h not in words]:
+            del lm.backoffs[h]
+        for h, listed in words.iteritems():
+            num, den = normalizers(lm, h, listed)
+            if den > 0:
+                lm.backoffs[h] = num / den
+            else: # no mass left to back off to
+                lm.backoffs.pop(h, None)
+
+def scores(lm, n, protect=True):
+    """ relative perplexity increase caused by removing each n-gram of order n+1
+    protect: skip the n-grams extended by a higher order n-gram, which are kept """
+    extended = (set(ngram[:-1] for ngram in lm.probs[n+1]) if protect and n + 1 < lm.order
+            else ())
+    for h, words in contexts(lm, n).iteritems():
+        num, den = normalizers(lm, h, words)
+        if num <= 0 or den <= 0: continue
+        alpha, p_h = num / den, history_prob(lm, h)
+        for w in words:
+            if h + (w,) in extended: continue
+            p, q = lm.probs[n][h+(w,)], lm.prob(h[1:], w)
+            pruned_alpha = (num + p) / (den + q)
+            entropy = -p_h * (p * (math.log(pruned_alpha * q) - math.log(p))
+                    + num * (math.log(pruned_alpha) - math.log(alpha)))
+            yield h + (w,), math.expm1(entropy)
+
+def prune(lm, threshold):
+    """ remove, from the highest order down, the n-grams whose removal increases perplexity
+    by less than threshold (relative), and renormalize the backoff weights of their contexts
+    and of the longer contexts which back off to them """
+    for n in xrange(lm.order - 1, 0, -1):
+        pruned = [ngram for ngram, score in scores(lm, n) if score < threshold]
+        for ngram in pruned:
+            del lm.probs[n][ngram]
+        renormalize(lm, n)
+        logging.info('Order %d: pruned %d n-grams, %d left', n+1, len(pruned),
+                len(lm.probs[n]))
+
+def prune_to_size(lm, size):
+    """ prune with the lowest threshold which leaves at most size n-grams, found by
+    bisection over the scores of the n-grams (removing n-grams makes others prunable) """
+    all_scores = sorted(score for n in xrange(1, lm.order)
+            for _, score in scores(lm, n, protect=False))
+    def pruned(i):
+        pruned_lm = lm.copy()
+        prune(pruned_lm, all_scores[i] if i < len(all_scores) else float('inf'))
+        return pruned_lm
+    lo, hi = min(max(0, len(lm) - size), len(all_scores)), len(all_scores)
+    best = None # pruned with all_scores[hi]
+    while lo < hi:
+        mid = (lo + hi) // 2
+        logging.info('Threshold: %g', all_scores[mid])
+        candidate = pruned(mid)
+        if len(candidate) <= size:
+            hi, best = mid, candidate
+        else:
+            lo = mid + 1
+    return best if best is not None else pruned(hi)
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    parser = argparse.ArgumentParser(description='Prune an n-gram model by relative entropy')
+    parser.add_argument('--model', help='trained model', required=True)
+    parser.add_argument('--vocab', help='test corpus vocabulary (default: training vocabulary)')
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--threshold', help='maximum relative increase of perplexity caused '
+            'by removing an n-gram', type=float)
+    target.add_argument('--size', help='target number of n-grams', type=int)
+    parser.add_argument('--arpa', help='ARPA output path')
+    parser.add_argument('--output', help='pruned model output path (usable by ngram.eval)')
+
+    args = parser.parse_args()
+    if not (args.arpa or args.output):
+        parser.error('no output: use --arpa and/or --output')
+
+    logging.info('Loading model')
+    model = container.load(args.model)
+
+    if args.vocab:
+        logging.info('Reading vocabulary')
+        with open(args.vocab) as vocab:
+            vocabulary = set(model.vocabulary[w.strip().decode('utf8')] for w in vocab)
+    else:
+        logging.info('Using training corpus vocabulary')
+        vocabulary = set(xrange(2, len(model.vocabulary)))
+
+    logging.info('Listing n-grams')
+    lm = backoff_lm(model, vocabulary)
+    logging.info('Model: %s', lm)
+
+    if args.size is not None:
+        lm = prune_to_size(lm, args.size)
+    else:
+        prune(lm, args.threshold)
+    logging.info('Pruned model: %s', lm)
+
+    if args.arpa:
+        logging.info('Writing ARPA model')
+        with open(args.arpa, 'w') as arpa:
+            print_backoff_arpa(lm, arpa)
+    if args.output:
+        logging.info('Saving model')
+        with open(args.output, 'w') as output:
+            cPickle.dump(lm, output, protocol=-1)
+
+if __name__ == '__main__':
+    main()
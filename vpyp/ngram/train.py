@@ -1,74 +1,181 @@
 import argparse
 import logging
-import math
+import random
 import cPickle
-from ..corpus import Vocabulary, read_corpus, ngrams
+from ..corpus import (Vocabulary, load_corpus, open_corpus, ngrams, ngram_counts,
+        read_ngram_counts)
 from ..prob import Uniform
 from ..pyp import PYP
 from ..prior import PYPPrior
-from model import PYPLM
+from .. import checkpoint, container
+from ..metrics import Metrics
+from .. import sampler, chains
+from ..sampler import Sampler
+from model import PYPLM, AveragedLM
 
-mh_iter = 100 # number of Metropolis-Hastings sampling iterations
-
-def run_sampler(model, corpus, n_iter):
-    n_sentences = len(corpus)
-    n_words = sum(len(sentence) for sentence in corpus)
-    for it in range(n_iter):
-        logging.info('Iteration %d/%d', it+1, n_iter)
+def run_sampler(model, corpus, n_iter, initialized=False, start=0, checkpoint=None,
+        metrics=None, schedule=None, seated=(), seated_fraction=0, n_seated=0):
+    """ seated: sentences already seated in the model (e.g. by the training of a continued
+    model), a random seated_fraction of which is resampled after the corpus in each sweep
+    n_seated: number of tokens seated in the model besides the corpus """
+    n_tokens = sum(len(sentence) + 1 for sentence in corpus) + n_seated
+    def sweep(it):
         for sentence in corpus:
             for seq in ngrams(sentence, model.order):
-                if it > 0: model.decrement(seq[:-1], seq[-1])
+                if it > 0 or initialized: model.decrement(seq[:-1], seq[-1])
                 model.increment(seq[:-1], seq[-1])
-        if it % 10 == 0:
-            logging.info('Model: %s', model)
-            ll = model.log_likelihood()
-            ppl = math.exp(-ll / (n_words + n_sentences))
-            logging.info('LL=%.0f ppl=%.3f', ll, ppl)
-        if it % 30 == 29:
-            logging.info('Resampling hyperparameters...')
-            acceptance, rejection = model.resample_hyperparemeters(mh_iter)
-            arate = acceptance / float(acceptance + rejection)
-            logging.info('Metropolis-Hastings acceptance rate: %.4f', arate)
-            logging.info('Model: %s', model)
-            ll = model.log_likelihood()
-            ppl = math.exp(-ll / (n_words + n_sentences))
-            logging.info('LL=%.0f ppl=%.3f', ll, ppl)
+        if seated_fraction:
+            for i in random.sample(xrange(len(seated)), int(seated_fraction * len(seated))):
+                for seq in ngrams(seated[i], model.order):
+                    model.decrement(seq[:-1], seq[-1])
+                    model.increment(seq[:-1], seq[-1])
+    hooks = [('checkpoint', checkpoint)] if checkpoint else []
+    return Sampler(model, sweep, n_tokens, schedule, metrics, hooks).run(n_iter, start)
+
+def train(args, vocabulary, training_corpus, char_lm=None, counts=None, suffix='',
+        report=None, stopped=None, model=None, old_corpus=None):
+    """ sample a model (one chain; suffix: of the checkpoint and metrics paths)
+    model: trained model to continue, with the sentences old_corpus seated (if saved) """
+    n_seated = 0
+    if model is not None:
+        n_seated = sum(m.total_customers for m in model.models.itervalues())
+    elif char_lm is None:
+        model = PYPLM(args.order, Uniform(len(vocabulary)))
+    elif args.pyp:
+        model = PYPLM(args.order, PYP(char_lm, PYPPrior(1.0, 1.0, 1.0, 1.0, 0.8, 1.0)))
+    else:
+        model = PYPLM(args.order, char_lm)
+
+    suffixed = lambda path: (path + suffix if path else None)
+    start = 0
+    if args.resume:
+        logging.info('Resuming from checkpoint %s', suffixed(args.checkpoint))
+        start, state = checkpoint.load(suffixed(args.checkpoint))
+        model.set_checkpoint(state)
+    elif counts is not None:
+        logging.info('Initializing model from %d n-gram types', len(counts))
+        model.initialize(counts, args.init)
+
+    logging.info('Training model of order %d', model.order)
+    checkpointer = (checkpoint.Checkpointer(suffixed(args.checkpoint), args.checkpoint_every,
+        model.get_checkpoint) if args.checkpoint else None)
+    if report:
+        metrics = chains.ChainMetrics(report, suffixed(args.metrics),
+                profile_iter=args.profile_iter)
+    else:
+        metrics = Metrics(args.metrics, profile_iter=args.profile_iter)
+    schedule = sampler.schedule(args)
+    schedule.stop = stopped
+    run_sampler(model, training_corpus, args.iter, bool(args.init) or args.resume, start,
+            checkpointer, metrics, schedule, old_corpus or (),
+            args.old_fraction if old_corpus else 0, n_seated)
+    metrics.close()
+    return model
 
 def main():
     logging.basicConfig(level=logging.INFO, format='%(message)s')
 
     parser = argparse.ArgumentParser(description='Train n-gram model')
-    parser.add_argument('--train', help='training corpus', required=True)
-    parser.add_argument('--order', help='order of the model', type=int, required=True)
+    parser.add_argument('--train', help='training corpus (text or binary)', required=True)
+    parser.add_argument('--order', help='order of the model', type=int)
     parser.add_argument('--iter', help='number of iterations', type=int, required=True)
     parser.add_argument('--pyp', help='backoff to PYP(CharLM)', action='store_true')
     parser.add_argument('--charlm', help='use a character LM as a base distribution')
-    parser.add_argument('--output', help='model output path')
+    parser.add_argument('--jobs', help='number of processes scoring the vocabulary with '
+            'the character LM', type=int, default=1)
+    parser.add_argument('--init', help='seat n-gram counts directly before sampling',
+            choices=('kn', 'sample'))
+    parser.add_argument('--counts', help='n-gram counts of the training corpus '
+            '(default: counted in one pass)')
+    parser.add_argument('--sort-vocab', help='renumber word ids by decreasing frequency',
+            action='store_true')
+    parser.add_argument('--model', help='continue the training of this model on the '
+            'training corpus (vocabulary and base extended to its new words)')
+    parser.add_argument('--old-fraction', help='fraction of the saved training corpus of '
+            'the continued model resampled in each iteration', type=float, default=0)
+    parser.add_argument('--keep-corpus', help='save the training corpus with the model '
+            '(continued model: old and new corpus) for --old-fraction', action='store_true')
+    parser.add_argument('--output', help='model output path (chains: averaged model)')
+    parser.add_argument('--checkpoint', help='sampler checkpoint path')
+    parser.add_argument('--checkpoint-every', help='write a checkpoint every N iterations',
+            type=int, default=10)
+    parser.add_argument('--resume', help='resume sampling from the checkpoint',
+            action='store_true')
+    sampler.add_arguments(parser)
+    chains.add_arguments(parser)
+    parser.add_argument('--metrics', help='per-iteration metrics output (JSON lines)')
+    parser.add_argument('--profile-iter', help='profile iteration N (written to '
+            'METRICS.iterN.prof)', type=int)
 
     args = parser.parse_args()
+    if args.resume and not args.checkpoint:
+        parser.error('--resume requires --checkpoint')
+    if args.model:
+        if args.charlm or args.pyp or args.sort_vocab:
+            parser.error('--charlm, --pyp and --sort-vocab cannot be used with --model')
+    elif args.order is None:
+        parser.error('--order is required to train a new model')
+    elif args.old_fraction:
+        parser.error('--old-fraction requires --model')
+    if not 0 <= args.old_fraction <= 1:
+        parser.error('--old-fraction must be between 0 and 1')
 
-    vocabulary = Vocabulary()
+    model, old_corpus = None, None
+    if args.model:
+        logging.info('Loading model %s', args.model)
+        model = container.load(args.model)
+        if not isinstance(model, PYPLM):
+            parser.error('--model: {0} cannot be continued'.format(type(model).__name__))
+        if args.order not in (None, model.order):
+            parser.error('--order: the model is of order {0}'.format(model.order))
+        args.order = model.order
+        vocabulary = model.vocabulary
+        old_corpus = getattr(model, 'training_corpus', None)
+        if args.old_fraction and old_corpus is None:
+            parser.error('--old-fraction: the training corpus was not saved with the model')
+    else:
+        vocabulary = Vocabulary()
 
     logging.info('Reading training corpus')
-    with open(args.train) as train:
-        training_corpus = read_corpus(train, vocabulary)
+    training_corpus = load_corpus(args.train, vocabulary)
+    if args.sort_vocab:
+        logging.info('Sorting vocabulary by frequency')
+        training_corpus.sort_vocabulary()
+    if model is not None:
+        logging.info('Vocabulary size: %d', len(vocabulary))
+        model.extend_vocabulary(len(vocabulary))
 
     if args.charlm:
         from ..charlm import CharLM
-        char_lm = CharLM(args.charlm, vocabulary)
-        if args.pyp:
-            base = PYP(char_lm, PYPPrior(1.0, 1.0, 1.0, 1.0, 0.8, 1.0))
-        else:
-            base = char_lm
+        char_lm = CharLM(args.charlm, vocabulary, args.jobs)
     else:
-        base = Uniform(len(vocabulary))
-    model = PYPLM(args.order, base)
+        char_lm = None
 
-    logging.info('Training model of order %d', args.order)
-    run_sampler(model, training_corpus, args.iter)
+    counts = None
+    if args.init and not args.resume:
+        if args.counts:
+            logging.info('Reading n-gram counts')
+            with open_corpus(args.counts) as counts_file:
+                counts = read_ngram_counts(counts_file, vocabulary, args.order)
+        else:
+            logging.info('Counting n-grams')
+            counts = ngram_counts(training_corpus, args.order)
+
+    if args.chains > 1:
+        logging.info('Sampling %d chains', args.chains)
+        def run_chain(chain, report, stopped):
+            return train(args, vocabulary, training_corpus, char_lm, counts,
+                    '.chain{0}'.format(chain), report, stopped, model, old_corpus)
+        model = AveragedLM(chains.run_chains(args.chains, run_chain, args.rhat))
+    else:
+        model = train(args, vocabulary, training_corpus, char_lm, counts, model=model,
+                old_corpus=old_corpus)
 
     if args.output:
         model.vocabulary = vocabulary
+        if args.keep_corpus or old_corpus is not None:
+            model.training_corpus = (old_corpus.concatenate(training_corpus)
+                    if old_corpus is not None else training_corpus)
         with open(args.output, 'w') as f:
             cPickle.dump(model, f, protocol=-1)
 
@@ -1,5 +1,6 @@
 import math
 import random
+from .pyp import PooledSeating
 
 # Probability density functions
 
@@ -17,8 +18,18 @@ class SampledPrior(object):
     def __init__(self):
         self.tied_distributions = []
 
-    def tie(self, distribution):
-        self.tied_distributions.append(distribution)
+    def tie(self, distribution): # also called by distributions being unpickled
+        self.__dict__.setdefault('tied_distributions', []).append(distribution)
+
+    def __getstate__(self): # the distributions tie themselves again when unpickled
+        state = self.__dict__.copy()
+        del state['tied_distributions']
+        return state
+
+    def __setstate__(self, state):
+        state.pop('tied_distributions', None) # pickled by older versions
+        self.__dict__.setdefault('tied_distributions', [])
+        self.__dict__.update(state)
 
     def full_log_likelihood(self):
         return sum(d.log_likelihood() for d in self.tied_distributions) + self.log_likelihood()
@@ -145,6 +156,25 @@ class PYPPrior(SampledPrior):
                 'strength + discount ~ Gamma({self.y_prior.shape}, {self.y_prior.scale}) | '
                 'nties={nties})').format(self=self, nties=len(self.tied_distributions))
 
+class TiedPYPPrior(PYPPrior):
+    """PYPPrior shared by many PYPs (e.g. the t-table rows of a frequency bucket):
+    their seating is pooled once per resampling, so that the cost of a Metropolis-Hastings
+    step does not depend on the number of tied PYPs"""
+    def resample(self, n_iter):
+        self.pooled = PooledSeating(self.tied_distributions)
+        try:
+            return super(TiedPYPPrior, self).resample(n_iter)
+        finally:
+            del self.pooled
+
+    def full_log_likelihood(self):
+        if 'pooled' not in self.__dict__:
+            return super(TiedPYPPrior, self).full_log_likelihood()
+        return self.pooled.log_likelihood(self.discount, self.strength) + self.log_likelihood()
+
+    def __repr__(self):
+        return 'Tied' + super(TiedPYPPrior, self).__repr__()
+
 import operator
 
 class stuple(tuple):
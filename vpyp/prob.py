@@ -63,11 +63,16 @@ class DirichletMultinomial(object):
     def resample_hyperparemeters(self, n_iter):
         return self.prior.resample(n_iter)
 
+    def reseat(self, counts): # counts do not depend on the seating
+        pass
+
     def __getstate__(self):
         return (self.K, self.prior, self.count.tolist(), self.N)
 
     def __setstate__(self, state):
-        self.K, self.prior, self.count, self.N = state
+        self.K, self.prior, count, self.N = state
+        self.count = numpy.array(count, dtype=float)
+        self.prior.tie(self)
 
     def __repr__(self):
         return 'Multinomial(K={self.K}, N={self.N}) ~ Dir({self.alpha})'.format(self=self)
@@ -114,6 +119,7 @@ class SparseDirichletMultinomial(DirichletMultinomial):
 
     def __setstate__(self, state):
         self.K, self.prior, self.count, self.N = state
+        self.prior.tie(self)
 
 class BetaBernouilli(object):
     def __init__(self, alpha, beta):
@@ -168,12 +174,18 @@ class Uniform(object):
         if k >= self.K: return 0
         return 1./self.K
 
+    def extend(self, K): # the vocabulary has grown to K words
+        self.K = K
+
     def log_likelihood(self, full=False):
         return - self.count * math.log(self.K)
 
     def resample_hyperparemeters(self, n_iter):
         return (0, 0)
 
+    def reseat(self, counts):
+        pass
+
     def __repr__(self):
         return 'Uniform(K={self.K}, count={self.count})'.format(self=self)
 
@@ -1,5 +1,6 @@
 import math
 import random
+from collections import Counter
 
 class CRP(object):
     def __init__(self):
@@ -26,6 +27,33 @@ class CRP(object):
             tables[i] += 1
         return (i == -1)
 
+    def _seat_tables(self, k, sizes): # open new tables for dish k in one step
+        if not k in self.tables:
+            self.tables[k] = []
+            self.ncustomers[k] = 0
+        self.tables[k].extend(sizes)
+        n = sum(sizes)
+        self.ncustomers[k] += n
+        self.total_customers += n
+        self.ntables += len(sizes)
+
+    def _set_tables(self, k, sizes): # replace the tables of dish k -> change in their number
+        old = self.tables.pop(k, [])
+        self.total_customers += sum(sizes) - self.ncustomers.pop(k, 0)
+        self.ntables += len(sizes) - len(old)
+        if sizes:
+            self.tables[k] = list(sizes)
+            self.ncustomers[k] = sum(sizes)
+        return len(sizes) - len(old)
+
+    def _unseat_dish(self, k): # remove all the customers of dish k -> number of tables
+        ntables = len(self.tables[k])
+        self.ntables -= ntables
+        self.total_customers -= self.ncustomers[k]
+        del self.tables[k]
+        del self.ncustomers[k]
+        return ntables
+
     def _unseat_from(self, k, i):
         self.ncustomers[k] -= 1
         self.total_customers -= 1
@@ -59,16 +87,35 @@ class PYP(CRP):
     def theta(self):
         return self.prior.strength
 
-    def _sample_table(self, k):
+    def _sample_table(self, k, p_base=None):
         if k not in self.tables: return -1
-        p_new = (self.theta + self.d * self.ntables) * self.base.prob(k)
-        norm = p_new + self.ncustomers[k] - self.d * len(self.tables[k])
+        if p_base is None: p_base = self.base.prob(k)
+        d = self.d
+        p_new = (self.theta + d * self.ntables) * p_base
+        norm = p_new + self.ncustomers[k] - d * len(self.tables[k])
         x = random.random() * norm
         for i, c in enumerate(self.tables[k]):
-            if x < c - self.d: return i
-            x -= c - self.d
+            if x < c - d: return i
+            x -= c - d
         return -1
 
+    def _sample_table_sizes(self, k, n): # seating of n customers with unseen dish k
+        p_base = self.base.prob(k)
+        d, ntables = self.d, self.ntables
+        sizes = []
+        for m in xrange(n):
+            p_new = (self.theta + d * ntables) * p_base
+            x = random.random() * (p_new + m - d * len(sizes))
+            for i, c in enumerate(sizes):
+                if x < c - d:
+                    sizes[i] += 1
+                    break
+                x -= c - d
+            else: # new table
+                sizes.append(1)
+                ntables += 1
+        return sizes
+
     def _customer_table(self, k, n): # find table index of nth customer with dish k
         tables = self.tables[k]
         for i, c in enumerate(tables):
@@ -88,9 +135,15 @@ class PYP(CRP):
         if self._unseat_from(k, i):
             self.base.decrement(k)
     
+    def _seat(self, k, p_base=None): # -> whether a new table was opened
+        return self._seat_to(k, self._sample_table(k, p_base))
+
     def prob(self, k): # total prob for dish k
+        return self._prob(k, self.base.prob(k))
+
+    def _prob(self, k, p_base): # given the base probability of dish k
         # new table
-        w = (self.theta + self.d * self.ntables) * self.base.prob(k)
+        w = (self.theta + self.d * self.ntables) * p_base
         # existing tables
         if k in self.tables:
             w += self.ncustomers[k] - self.d * len(self.tables[k])
@@ -115,29 +168,116 @@ class PYP(CRP):
     def resample_hyperparemeters(self, n_iter):
         return self.prior.resample(n_iter)
 
-    def resample_base(self):
-        for k, tables in self.tables.iteritems():
-            for n in xrange(len(tables)):
+    def reseat(self, counts):
+        """ resample the seating of counts[k] customers of each dish k (e.g. the tables
+        of a restaurant with this base), removed and re-seated one dish at a time """
+        for k, n in counts.iteritems():
+            if n == self.ncustomers[k]:
+                closed = self._unseat_dish(k)
+            else:
+                closed = 0
+                for _ in xrange(n):
+                    i = self._customer_table(k, random.randrange(0, self.ncustomers[k]))
+                    closed += self._unseat_from(k, i)
+            for _ in xrange(closed):
                 self.base.decrement(k)
-                self.base.increment(k)
-        try:
+            p_base = None # only needed once k has tables again
+            for _ in xrange(n):
+                if p_base is None and k in self.tables:
+                    p_base = self.base.prob(k)
+                if self._seat(k, p_base):
+                    self.base.increment(k)
+                    p_base = None
+
+    def resample_seating(self):
+        """ resample the seating of all the customers """
+        self.reseat(dict(self.ncustomers))
+
+    def resample_base(self, nested=True):
+        """ resample the seating of the tables of this restaurant in the base,
+        and (nested) the seating of the base in its own base """
+        counts = dict((k, len(tables)) for k, tables in self.tables.iteritems())
+        if hasattr(self.base, 'reseat'):
+            self.base.reseat(counts)
+        else: # one table at a time
+            for k, n in counts.iteritems():
+                for _ in xrange(n):
+                    self.base.decrement(k)
+                    self.base.increment(k)
+        if nested and hasattr(self.base, 'resample_base'):
             self.base.resample_base()
-        except AttributeError:
-            pass
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.prior.tie(self)
 
     def __repr__(self):
         return ('PYP(d={self.d}, theta={self.theta}, '
                 '#customers={self.total_customers}, #tables={self.ntables}, '
                 '#dishes={V}, Base={self.base})').format(self=self, V=len(self.tables))
 
+def merge_tables(start, finals):
+    """ table sizes of a dish whose tables start were changed into each of finals by
+    independent samplers: the tables opened and closed and the customers seated and
+    removed by each one are added up; tables changed by several samplers are reconciled
+    by resizing the largest ones (closed if they have lost all their customers, kept if
+    they have gained some) """
+    if len(finals) == 1: return list(finals[0])
+    before = Counter(start)
+    sizes = Counter(before)
+    n_tables, n_customers = len(start), sum(start)
+    for final in finals:
+        after = Counter(final)
+        sizes.subtract(before - after)
+        sizes.update(after - before)
+        n_tables += len(final) - len(start)
+        n_customers += sum(final) - sum(start)
+    n_tables = min(max(n_tables, 1), n_customers)
+    merged = sorted(sizes.elements(), reverse=True)[:n_tables]
+    merged += [1] * (n_tables - len(merged))
+    excess = sum(merged) - n_customers
+    for i, c in enumerate(merged):
+        if excess <= 0: break
+        removed = min(excess, c - 1)
+        merged[i] -= removed
+        excess -= removed
+    if excess < 0:
+        merged[0] -= excess
+    return merged
+
+class PooledSeating(object):
+    """ seating statistics of PYP restaurants sharing their hyperparameters, from which
+    the sum of their log-likelihoods is computed in time independent of their number """
+    def __init__(self, restaurants):
+        self.sizes = Counter() # table size -> number of tables
+        self.restaurants = Counter() # (customers, tables) -> number of restaurants
+        for r in restaurants:
+            if r.total_customers == 0: continue # log-likelihood 0
+            self.restaurants[r.total_customers, r.ntables] += 1
+            for tables in r.tables.itervalues():
+                self.sizes.update(tables)
+
+    def log_likelihood(self, d, theta):
+        """ sum of PYP.log_likelihood() over the restaurants """
+        if d == 0:
+            ll = sum(m * (math.lgamma(theta) - math.lgamma(theta + n) + t * math.log(theta))
+                    for (n, t), m in self.restaurants.iteritems())
+            return ll + sum(m * math.lgamma(c) for c, m in self.sizes.iteritems())
+        ll = sum(m * (math.lgamma(theta) - math.lgamma(theta + n)
+                    + math.lgamma(theta / d + t) - math.lgamma(theta / d)
+                    + t * (math.log(d) - math.lgamma(1 - d)))
+                for (n, t), m in self.restaurants.iteritems())
+        return ll + sum(m * math.lgamma(c - d) for c, m in self.sizes.iteritems())
+
 class DP(PYP):
     @property
     def alpha(self):
         return self.prior.x
 
-    def _sample_table(self, k):
+    def _sample_table(self, k, p_base=None):
         if k not in self.tables: return -1
-        p_new = self.alpha * self.base.prob(k)
+        if p_base is None: p_base = self.base.prob(k)
+        p_new = self.alpha * p_base
         norm = p_new + self.ncustomers[k]
         x = random.random() * norm
         for i, c in enumerate(self.tables[k]):
@@ -145,8 +285,8 @@ class DP(PYP):
             x -= c
         return -1
     
-    def prob(self, k): # total prob for dish k
-        w = self.alpha * self.base.prob(k) + self.ncustomers.get(k, 0)
+    def _prob(self, k, p_base):
+        w = self.alpha * p_base + self.ncustomers.get(k, 0)
         return w / (self.alpha + self.total_customers)
 
     def log_likelihood(self, full=False):
@@ -0,0 +1,128 @@
+""" Gibbs sampling driver shared by the trainers: models plug in a sweep function,
+and a Schedule decides when to spend time on diagnostics and hyperparameters """
+import logging
+import math
+import time
+from .metrics import Metrics
+
+class Schedule(object):
+    """Schedule(ll_every, resample_every, mh_iter, time_budget, base_every)
+    ll_every: evaluate the log-likelihood every ll_every iterations; 0: adaptively,
+        so that evaluation takes at most ll_fraction of the sweep time
+    resample_every: resample hyperparameters every resample_every iterations (0: never)
+    mh_iter: number of Metropolis-Hastings iterations per resampling
+    time_budget: stop before an iteration which would end after time_budget seconds
+    base_every: resample the seating of the restaurants in their bases every
+        base_every iterations (0: never)
+    stop: function telling whether to stop sampling (e.g. when chains have converged)"""
+    def __init__(self, ll_every=10, resample_every=30, mh_iter=100, time_budget=None,
+            base_every=0, ll_fraction=0.1, stop=None):
+        self.ll_every = ll_every
+        self.resample_every = resample_every
+        self.mh_iter = mh_iter
+        self.time_budget = time_budget
+        self.base_every = base_every
+        self.ll_fraction = ll_fraction
+        self.stop = stop
+        self.ll_time = None # cost of the last evaluation
+        self.sweep_time = 0 # sweep time since the last evaluation
+
+    def evaluate(self, it, sweep_time):
+        """ whether to evaluate the log-likelihood after iteration it (from 0) """
+        if self.ll_every:
+            return it % self.ll_every == 0
+        self.sweep_time += sweep_time
+        return self.ll_time is None or self.sweep_time * self.ll_fraction >= self.ll_time
+
+    def evaluated(self, ll_time):
+        self.ll_time, self.sweep_time = ll_time, 0
+
+    def resample(self, it):
+        return self.resample_every > 0 and it % self.resample_every == self.resample_every - 1
+
+    def resample_base(self, it):
+        return self.base_every > 0 and it % self.base_every == self.base_every - 1
+
+    def out_of_time(self, elapsed, iteration_time):
+        return self.time_budget is not None and elapsed + iteration_time > self.time_budget
+
+def interval(value):
+    return 0 if value == 'auto' else int(value)
+
+def add_arguments(parser):
+    """ sampling schedule options of the train CLIs """
+    parser.add_argument('--ll-every', help='evaluate the log-likelihood every N iterations '
+            '(auto: at most 10%% of the sampling time)', type=interval, default=10)
+    parser.add_argument('--resample-every', help='resample hyperparameters every N '
+            'iterations (0: never)', type=int, default=30)
+    parser.add_argument('--mh-iter', help='Metropolis-Hastings iterations per resampling',
+            type=int, default=100)
+    parser.add_argument('--time-budget', help='stop sampling after SECONDS', type=float)
+    parser.add_argument('--resample-base-every', help='resample the seating of the PYP '
+            'tables in their base every N iterations (0: never)', type=int, default=0)
+
+def schedule(args):
+    return Schedule(args.ll_every, args.resample_every, args.mh_iter, args.time_budget,
+            args.resample_base_every)
+
+class Sampler(object):
+    """Sampler(model, sweep, n_tokens, schedule, metrics, hooks)
+    sweep(it): one Gibbs pass over the corpus at iteration it (from 0)
+    n_tokens: normalization of the perplexity
+    hooks: [(name, hook)] called with the number of completed iterations"""
+    def __init__(self, model, sweep, n_tokens, schedule=None, metrics=None, hooks=()):
+        self.model = model
+        self.sweep = sweep
+        self.n_tokens = n_tokens
+        self.schedule = schedule or Schedule()
+        self.metrics = metrics or Metrics()
+        self.hooks = list(hooks)
+        self.ll = None
+
+    def log_likelihood(self):
+        start = time.time()
+        with self.metrics.phase('log_likelihood'):
+            self.ll = self.model.log_likelihood()
+        self.schedule.evaluated(time.time() - start)
+        ppl = math.exp(-self.ll / self.n_tokens)
+        logging.info('LL=%.0f ppl=%.3f', self.ll, ppl)
+        self.metrics.set(ll=self.ll, ppl=ppl)
+
+    def run(self, n_iter, start=0):
+        """ iterations start..n_iter-1 -> number of completed iterations """
+        self.metrics.n_tokens = self.n_tokens
+        started, iteration_time = time.time(), 0
+        for it in range(start, n_iter):
+            if self.schedule.stop and self.schedule.stop():
+                logging.info('Sampling stopped after %d iterations', it)
+                return it
+            if self.schedule.out_of_time(time.time() - started, iteration_time):
+                logging.info('Time budget exhausted after %d iterations', it)
+                return it
+            iteration_start = time.time()
+            logging.info('Iteration %d/%d', it+1, n_iter)
+            self.metrics.start(it + 1)
+            with self.metrics.phase('sweep'):
+                self.sweep(it)
+            if self.schedule.resample_base(it) and hasattr(self.model, 'resample_base'):
+                logging.info('Resampling base seating...')
+                with self.metrics.phase('resample_base'):
+                    self.model.resample_base()
+            if self.schedule.evaluate(it, time.time() - iteration_start):
+                logging.info('Model: %s', self.model)
+                self.log_likelihood()
+            if self.schedule.resample(it):
+                logging.info('Resampling hyperparameters...')
+                with self.metrics.phase('resample'):
+                    acceptance, rejection = self.model.resample_hyperparemeters(
+                            self.schedule.mh_iter)
+                arate = acceptance / float(max(acceptance + rejection, 1))
+                logging.info('Metropolis-Hastings acceptance rate: %.4f', arate)
+                logging.info('Model: %s', self.model)
+                self.metrics.set(acceptance_rate=arate)
+            for name, hook in self.hooks:
+                with self.metrics.phase(name):
+                    hook(it + 1)
+            self.metrics.end(self.model)
+            iteration_time = time.time() - iteration_start
+        return n_iter
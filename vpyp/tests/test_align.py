@@ -0,0 +1,250 @@
+import math
+import random
+import cPickle as pickle
+from collections import Counter
+try:
+    import numpypy
+except ImportError:
+    pass
+import numpy
+from nose.tools import eq_
+from ..prob import mult_sample, Uniform, BetaBernouilli
+from ..pyp import PYP, PooledSeating, merge_tables
+from ..prior import PYPPrior, GammaPrior
+from ..align.model import (AlignmentModel, AlignmentDistribution, SampleAccumulator,
+        alignment_matrix, diagonal_matrix, candidate_positions, merge_ensembles,
+        frequency_buckets)
+from ..align.train import run_sampler
+from ..metrics import Metrics
+from ..sampler import Schedule
+from ..align.symmetrize import (links, intersection, grow_diag, grow_diag_final,
+        grow_diag_final_and)
+
+corpus = [([0, 1, 2], [0, 1]), ([0, 2, 3, 1], [2, 1, 3]), ([0, 3], [3, 3, 0]),
+        ([0, 1, 1, 2, 3], [1, 0, 2, 2])]
+
+def naive_increment(model, f, e):
+    a_prob = alignment_matrix(model.a_table.prob(len(f)-1, len(e)), model.p_null)
+    for j, ej in enumerate(e):
+        i = mult_sample((i, model.t_table[fi].prob(ej) * a_prob[i, j])
+                for i, fi in enumerate(f))
+        model.null.increment(i==0)
+        model.a_table.increment(len(f)-1, len(e), i, j)
+        model.t_table[f[i]].increment(ej)
+        yield i
+
+def make_model():
+    return AlignmentModel(4, PYP(Uniform(4), PYPPrior(1.0, 1.0, 1.0, 1.0, 0.1, 1.0)))
+
+def run(model, increment):
+    random.seed(1234)
+    alignments = [None] * len(corpus)
+    for it in range(20):
+        for n, (f, e) in enumerate(corpus):
+            if it > 0: model.decrement(f, e, alignments[n])
+            alignments[n] = list(increment(model, f, e))
+    return alignments
+
+def test_increment():
+    eq_(run(make_model(), AlignmentModel.increment), run(make_model(), naive_increment))
+
+def test_tied_priors():
+    eq_(frequency_buckets([9, 1, 0, 2, 5], [2, 5]), [2, 0, 0, 1, 2])
+    model = AlignmentModel(4, PYP(Uniform(4), PYPPrior(1.0, 1.0, 1.0, 1.0, 0.1, 1.0)),
+            buckets=[1, 0, 0, 0])
+    eq_(len(model.t_priors()), 2)
+    run(model, AlignmentModel.increment)
+    rare = model.t_table[1:]
+    rare[0].prior.parameters = (0.3, 2.3)
+    expected = sum(t_word.log_likelihood() for t_word in rare)
+    pooled = PooledSeating(rare).log_likelihood(rare[0].d, rare[0].theta)
+    assert expected < 0 and abs(pooled - expected) < 1e-9
+    model.resample_hyperparemeters(10)
+    assert model.t_table[1].prior is model.t_table[3].prior is not model.t_table[0].prior
+
+def test_pruning():
+    f, e = [0] + [1, 2, 3] * 10, [0, 1, 2] * 5
+    mask, positions, dropped, (rows, cols, prior, _) = candidate_positions(len(f)-1, len(e),
+            4.0, 0.05)
+    diag = diagonal_matrix(len(f)-1, len(e), 4.0)
+    assert mask[0].all() and numpy.allclose(dropped, (diag * ~mask[1:]).sum(axis=0))
+    assert 0 < mask.sum() < mask.size
+    eq_(mask.sum(), len(rows))
+    assert mask[rows, cols].all() and (prior == numpy.where(rows, diag[rows-1, cols], 0)).all()
+    for j, candidates in enumerate(positions):
+        eq_(candidates.tolist(), numpy.flatnonzero(mask[:, j]).tolist())
+    model = make_model()
+    model.prune = 0.05
+    random.seed(1234)
+    for _ in range(20):
+        a = list(model.increment(f, e))
+        assert all(mask[i, j] for j, i in enumerate(a))
+        model.decrement(f, e, a)
+    assert 0 < model.dropped_mass < 20 * dropped.sum()
+
+def test_parallel_sweep():
+    random.seed(5)
+    bitext = [([0] + [random.randrange(1, 4) for _ in xrange(20)],
+        [random.randrange(4) for _ in xrange(18)]) for _ in xrange(8)]
+    model = make_model()
+    model.prune = 0.05
+    model.null = BetaBernouilli(1000.0, 1000.0) # p(NULL) ~ 0.5
+    alignments, metrics = [None] * len(bitext), Metrics()
+    run_sampler(model, bitext, 3, n_jobs=2, n_merges=2, alignments=alignments,
+            metrics=metrics, schedule=Schedule(ll_every=100, resample_every=0))
+    links = Counter((f[i], ej) for (f, e), a in zip(bitext, alignments) for ej, i in zip(e, a))
+    for fi, t_word in enumerate(model.t_table):
+        eq_(t_word.ncustomers, dict((ej, n) for (fj, ej), n in links.iteritems() if fj == fi))
+    tables = Counter()
+    for t_word in model.t_table:
+        tables.update(dict((ej, len(sizes)) for ej, sizes in t_word.tables.iteritems()))
+    eq_(model.t_base.ncustomers, dict(tables))
+    eq_(model.t_base.base.count, model.t_base.ntables)
+    eq_(model.null.total, sum(len(a) for a in alignments))
+    eq_(model.null.positive, sum(a.count(0) for a in alignments))
+    for (f, e), a in zip(bitext, alignments):
+        model.a_table.add(len(f)-1, len(e), a, -1)
+    assert all((counts == 0).all() for counts in model.a_table.assignments.itervalues())
+    dropped = sum(model.a_table.candidates(len(f)-1, len(e), model.prune)[2].sum()
+            for f, e in bitext) / sum(len(e) for f, e in bitext)
+    assert 0.45 * dropped < metrics.record['pruned_mass'] < 0.55 * dropped # all the shards
+
+def test_merge_tables():
+    eq_(merge_tables([3, 1], [[3, 2]]), [3, 2]) # one sampler: its seating
+    eq_(sorted(merge_tables([3, 1], [[3, 1, 1], [4]])), [1, 4]) # opened, closed
+    eq_(merge_tables([5], [[6], [4]]), [5]) # same table changed twice
+    eq_(merge_tables([2], [[1], [1]]), []) # emptied by both
+    eq_(merge_tables([1], [[], [2]]), [1]) # closed by one, joined by the other
+
+def test_pruning_long_sentence():
+    flen, elen, threshold = 100, 80, 0.05
+    mask, positions, dropped, _ = candidate_positions(flen, elen, 4.0, threshold)
+    diag = diagonal_matrix(flen, elen, 4.0)
+    assert (dropped <= threshold + 1e-12).all() and mask.sum() < mask.size
+    for j, candidates in enumerate(positions):
+        window = candidates[1:] - 1 # NULL excluded
+        assert len(window) > 1 and (numpy.diff(window) == 1).all() # contiguous window
+        kept = diag[window, j]
+        assert 1 - kept.sum() + kept.min() > threshold # smallest window
+
+def test_old_pickle():
+    model = make_model()
+    run(model, AlignmentModel.increment)
+    ll = model.log_likelihood()
+    links = dict(((flen, elen), [(i, j) for i, j in zip(*numpy.nonzero(counts))
+            for _ in xrange(counts[i, j])])
+        for (flen, elen), counts in model.a_table.assignments.iteritems())
+    scale_prior = GammaPrior(1.0, 1.0, model.a_table.scale)
+    a_table = AlignmentDistribution(GammaPrior(1.0, 1.0, 1.0))
+    a_table.__setstate__({'scale_prior': scale_prior, 'assignments': links}) # older version
+    eq_(scale_prior.tied_distributions, [a_table])
+    state = model.__dict__.copy()
+    del state['prune'], state['dropped_mass']
+    state['a_table'] = a_table
+    model = AlignmentModel.__new__(AlignmentModel)
+    model.__setstate__(state)
+    assert abs(model.log_likelihood() - ll) < 1e-9
+    eq_(len(list(model.increment(*corpus[0]))), len(corpus[0][1]))
+
+def test_prior_cache():
+    model = make_model()
+    prior = model.a_table.scale_prior
+    for flen, elen in ((1, 1), (3, 5), (7, 2)):
+        diag = numpy.array([[math.exp(-prior.x * abs(j/float(elen)-i/float(flen)))
+            for j in xrange(elen)] for i in xrange(flen)])
+        assert numpy.allclose(model.a_table.prob(flen, elen), diag / diag.sum(axis=0))
+    matrix = model.a_table.prob(3, 5)
+    assert model.a_table.prob(3, 5) is matrix
+    prior.x = 2.0 # proposal
+    assert model.a_table.prob(3, 5) is not matrix
+    prior.x = 4.0 # rejection
+    assert model.a_table.prob(3, 5) is matrix
+
+def test_alignment_counts():
+    model = make_model()
+    alignments = run(model, AlignmentModel.increment)
+    ll = 0
+    for (f, e), a in zip(corpus, alignments):
+        a_prob = model.a_table.prob(len(f)-1, len(e))
+        ll += sum(math.log(a_prob[i-1, j]) for j, i in enumerate(a) if i > 0)
+    assert abs(model.a_table.log_likelihood() - ll) < 1e-9
+    for (f, e), a in zip(corpus, alignments):
+        model.decrement(f, e, a)
+    eq_(model.a_table.log_likelihood(), 0)
+    eq_(sum(counts.sum() for counts in model.a_table.assignments.itervalues()), 0)
+
+def naive_align(samples, f, e):
+    a_probs = [alignment_matrix(diagonal_matrix(len(f)-1, len(e), scale), p_null)
+            for p_null, scale, _ in samples]
+    for j, ej in enumerate(e):
+        _, i = max((sum(t_table[fi].get(ej, 0) * a_prob[i, j]
+                        for (_, _, t_table), a_prob in zip(samples, a_probs)), i)
+                for i, fi in enumerate(f))
+        yield i
+
+def test_ensemble():
+    model = make_model()
+    samples = []
+    for _ in range(3):
+        run(model, AlignmentModel.increment)
+        samples.append(model.map_estimate())
+        model = make_model()
+    ensemble = pickle.loads(pickle.dumps(AlignmentModel.combine(samples), -1))
+    for f, e in corpus + [([0, 3, 1], [4, 1])]: # with an unknown target word
+        eq_(ensemble.align(f, e), list(naive_align(samples, f, e)))
+    assert not ensemble.t_probs([0, 7], [1])[:, 1].any() # unknown source word
+
+def test_averaged_ensemble():
+    model, samples = make_model(), []
+    for _ in range(3):
+        run(model, AlignmentModel.increment)
+        samples.append(model.map_estimate())
+    ensemble = pickle.loads(pickle.dumps(AlignmentModel.combine(samples, True), -1))
+    eq_(len(ensemble.caches), 1) # a single alignment prior, whatever the number of samples
+    for f, e in corpus:
+        a_prob = numpy.mean([alignment_matrix(diagonal_matrix(len(f)-1, len(e), scale), p_null)
+            for p_null, scale, _ in samples], axis=0)
+        scores = ensemble.t_probs(f, e)[0] * a_prob
+        eq_(ensemble.align(f, e), (len(f) - 1 - scores[::-1].argmax(axis=0)).tolist())
+        masks = [candidate_positions(len(f)-1, len(e), scale, 0.05)[0]
+                for _, scale, _ in samples]
+        scores[~reduce(numpy.logical_or, masks)] = -1
+        eq_(ensemble.align(f, e, 0.05), (len(f) - 1 - scores[::-1].argmax(axis=0)).tolist())
+
+def test_symmetrize():
+    fe = links([1, 2, 0, 4]) # e_j -> f_{a_j - 1}
+    ef = links([1, 0, 0, 4], reverse=True) # f_i -> e_{a_i - 1}
+    eq_(fe, set([(0, 0), (1, 1), (3, 3)]))
+    eq_(ef, set([(0, 0), (3, 3)]))
+    eq_(intersection(fe, ef), set([(0, 0), (3, 3)]))
+    eq_(grow_diag(fe, ef), set([(0, 0), (1, 1), (3, 3)]))
+    eq_(grow_diag_final_and(set([(0, 0), (2, 0)]), set([(0, 0)])), set([(0, 0)]))
+    eq_(grow_diag_final(set([(0, 0), (2, 0)]), set([(0, 0)])), set([(0, 0), (2, 0)]))
+
+def test_accumulator():
+    model = make_model()
+    samples, averaged, stacked = [], SampleAccumulator(), SampleAccumulator(2)
+    for _ in range(3):
+        run(model, AlignmentModel.increment)
+        samples.append(model.map_estimate())
+        averaged.add(model)
+        stacked.add(model)
+    for ensemble, reference in ((averaged.ensemble(), AlignmentModel.combine(samples, True)),
+            (stacked.ensemble(), AlignmentModel.combine(samples[1:]))):
+        eq_(ensemble.priors, reference.priors)
+        for f, e in corpus:
+            assert numpy.allclose(ensemble.t_probs(f, e), reference.t_probs(f, e))
+
+def test_merge_ensembles():
+    model, samples = make_model(), []
+    for _ in range(3):
+        run(model, AlignmentModel.increment)
+        samples.append(model.map_estimate())
+    stacked = merge_ensembles([AlignmentModel.combine(samples[:1]),
+        AlignmentModel.combine(samples[1:])])
+    expected = AlignmentModel.combine(samples)
+    assert numpy.allclose(stacked.probs, expected.probs)
+    averaged = merge_ensembles([AlignmentModel.combine(samples[:1], average=True),
+        AlignmentModel.combine(samples[1:], average=True)])
+    assert numpy.allclose(averaged.probs, AlignmentModel.combine(samples, average=True).probs)
+    eq_(averaged.priors, expected.priors)
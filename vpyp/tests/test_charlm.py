@@ -0,0 +1,38 @@
+import os
+import shutil
+import tempfile
+import cPickle as pickle
+try:
+    import numpypy
+except ImportError:
+    pass
+import numpy
+from nose.tools import eq_
+from ..corpus import Vocabulary
+from ..charlm import PoissonUniformCharLM, cache_path, load_cache, save_cache
+
+def test_poisson_uniform():
+    vocabulary = Vocabulary(init=[u'a', u'bb', u'cde', u'abcd'])
+    char_lm = PoissonUniformCharLM(vocabulary)
+    eq_(char_lm.K, len(vocabulary))
+    assert numpy.allclose(char_lm.probs, [char_lm.get_prob(k) for k in xrange(char_lm.K)])
+    char_lm = pickle.loads(pickle.dumps(char_lm, -1))
+    k = char_lm.vocabulary[u'ecbda'] # new word
+    assert abs(char_lm.prob(k) - char_lm.get_prob(k)) < 1e-12
+    eq_(char_lm.K, k)
+
+def test_cache():
+    directory = tempfile.mkdtemp()
+    os.environ['VPYP_CACHE'] = os.path.join(directory, 'cache')
+    try:
+        lm_path = os.path.join(directory, 'lm.arpa')
+        open(lm_path, 'w').close()
+        path = cache_path(lm_path, [u'a', u'b'])
+        assert path != cache_path(lm_path, [u'a', u'c'])
+        eq_(load_cache(path, 2), None)
+        save_cache(path, numpy.array([0.1, 0.2]))
+        assert numpy.allclose(load_cache(path, 2), [0.1, 0.2])
+        eq_(load_cache(path, 3), None)
+    finally:
+        del os.environ['VPYP_CACHE']
+        shutil.rmtree(directory)
@@ -0,0 +1,110 @@
+import os
+import random
+import tempfile
+try:
+    import numpypy
+except ImportError:
+    pass
+import numpy
+from nose.tools import eq_
+from .. import checkpoint, container
+from ..prob import Uniform
+from ..pyp import PYP
+from ..prior import PYPPrior
+from ..ngram.model import PYPLM
+from ..ngram.train import run_sampler as run_ngram
+from ..lda.model import LPYA, topic_section
+from ..lda.train import run_sampler as run_lda
+from ..align.model import AlignmentModel, SampleAccumulator, t_table_section
+from ..align.train import run_sampler as run_align
+
+corpus = [[2, 3, 4], [2, 3, 5, 4], [3, 4], [2, 5, 5, 3]]
+bitext = [([0, 1, 2], [0, 1]), ([0, 2, 3, 1], [2, 1, 3]), ([0, 3], [3, 3, 0])]
+
+def check_resume(make_model, run, n_iter, get_state, set_state):
+    """ a run resumed from a checkpoint ends in the same state as the full run
+    (and with the same arrays, if run returns any) """
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        random.seed(42)
+        model = make_model()
+        expected_arrays = run(model, n_iter, checkpoint.Checkpointer(path, 3, get_state(model)))
+        expected = model.log_likelihood()
+        model = make_model()
+        start, state = checkpoint.load(path)
+        eq_(start, n_iter - n_iter % 3)
+        arrays = run(model, n_iter, None, start, set_state(model, state))
+        assert abs(model.log_likelihood() - expected) < 1e-9
+        for array, expected_array in zip(arrays or (), expected_arrays or ()):
+            eq_(array.shape, expected_array.shape)
+            assert numpy.allclose(array, expected_array)
+    finally:
+        os.remove(path)
+
+def test_ngram():
+    make_model = lambda: PYPLM(3, PYP(Uniform(6), PYPPrior(1.0, 1.0, 1.0, 1.0, 0.8, 1.0)))
+    def run(model, n_iter, checkpointer, start=0, _=None):
+        run_ngram(model, corpus, n_iter, start > 0, start, checkpointer)
+    def set_state(model, state):
+        model.set_checkpoint(state)
+    check_resume(make_model, run, 31, lambda model: model.get_checkpoint, set_state)
+
+def test_lda():
+    make_model = lambda: LPYA(2, len(corpus), Uniform(6))
+    def run(model, n_iter, checkpointer, start=0, assignments=None):
+        run_lda(model, corpus, n_iter, None, assignments, start, checkpointer)
+    def get_state(model):
+        def state(assignments):
+            state = model.get_checkpoint()
+            state['lengths'], state['assignments'] = checkpoint.flatten(assignments)
+            return state
+        return state
+    def set_state(model, state):
+        model.set_checkpoint(state)
+        return checkpoint.unflatten(state['lengths'], state['assignments'])
+    check_resume(make_model, run, 31, get_state, set_state)
+
+def test_align():
+    make_model = lambda: AlignmentModel(4, PYP(Uniform(4), PYPPrior(1.0, 1.0, 1.0, 1.0, 0.1, 1.0)))
+    def run(model, n_iter, checkpointer, start=0, restored=(None, None)):
+        alignments, samples = restored
+        samples = samples or SampleAccumulator()
+        run_align(model, bitext, n_iter, thin=2, alignments=alignments, samples=samples,
+                start=start, checkpoint=checkpointer)
+        return samples.keys, samples.sums, numpy.array(samples.priors)
+    def get_state(model):
+        def state(alignments, samples):
+            state = model.get_checkpoint()
+            state.update(samples.get_checkpoint())
+            state['lengths'], state['alignments'] = checkpoint.flatten(alignments)
+            return state
+        return state
+    def set_state(model, state):
+        model.set_checkpoint(state)
+        samples = SampleAccumulator()
+        samples.set_checkpoint(state)
+        return checkpoint.unflatten(state['lengths'], state['alignments']), samples
+    check_resume(make_model, run, 32, get_state, set_state)
+
+def check_container(model, part, expected):
+    """ a section loaded alone matches the saved model, which is restored whole """
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        container.save(path, model)
+        eq_(container.open_model(path).get(*part).tables, expected.tables)
+        loaded = container.load(path)
+        assert abs(loaded.log_likelihood() - model.log_likelihood()) < 1e-9
+        eq_(loaded.hyperparameters(), model.hyperparameters())
+    finally:
+        os.remove(path)
+
+def test_container():
+    random.seed(42)
+    model = LPYA(2, len(corpus), Uniform(6))
+    run_lda(model, corpus, 5)
+    check_container(model, (topic_section(1), 0), model.topic_word[1])
+    model = AlignmentModel(4, PYP(Uniform(4), PYPPrior(1.0, 1.0, 1.0, 1.0, 0.1, 1.0)))
+    run_align(model, bitext, 5)
+    check_container(model, t_table_section(3), model.t_table[3])
@@ -0,0 +1,56 @@
+import os
+import tempfile
+from StringIO import StringIO
+from nose.tools import eq_
+from ..corpus import (Vocabulary, read_corpus, read_flat_corpus, read_flat_parallel_corpus,
+        write_flat, read_flat, load_corpus)
+from ..index import byte_ranges, tokenize_range, merge_chunks
+
+text = u'a b c\n\nc a d e\nb\n'.encode('utf8')
+bitext = u'a b ||| x\nb ||| y z\n'.encode('utf8')
+
+def test_flat_corpus():
+    segments = read_corpus(StringIO(text), Vocabulary())
+    corpus = read_flat_corpus(StringIO(text), Vocabulary())
+    eq_(list(corpus), segments)
+    eq_(corpus.n_tokens, 8)
+    eq_(corpus.prepend(9)[1], [9])
+
+def test_binary_format():
+    source, target = read_flat_parallel_corpus(StringIO(bitext), Vocabulary(), Vocabulary())
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        write_flat(path, [source, target])
+        for mmap in (True, False):
+            f, e = read_flat(path, mmap)
+            eq_(list(f), list(source))
+            eq_(list(e), list(target))
+            eq_(list(e.vocabulary), list(target.vocabulary))
+        vocabulary = Vocabulary(init=[u'z', u'y'])
+        write_flat(path, [target])
+        eq_(list(load_corpus(path, vocabulary)), [[4], [3, 2]])
+    finally:
+        os.remove(path)
+
+def test_chunked_read():
+    fd, path = tempfile.mkstemp()
+    with os.fdopen(fd, 'w') as f:
+        f.write(text)
+    try:
+        serial = read_flat_corpus(StringIO(text), Vocabulary())
+        for n_chunks in (1, 2, 3, 7, 20):
+            chunks = [tokenize_range((path, start, end, 1))[0]
+                    for start, end in byte_ranges(path, n_chunks)]
+            corpus = merge_chunks(chunks, Vocabulary())
+            eq_(list(corpus), list(serial))
+            eq_(list(corpus.vocabulary), list(serial.vocabulary))
+    finally:
+        os.remove(path)
+
+def test_sort_vocabulary():
+    corpus = read_flat_corpus(StringIO(text), Vocabulary())
+    words = [[corpus.vocabulary[w] for w in segment] for segment in corpus]
+    corpus.sort_vocabulary()
+    eq_(corpus.vocabulary.id2word[:4], ['<s>', '</s>', u'a', u'b'])
+    eq_([[corpus.vocabulary[w] for w in segment] for segment in corpus], words)
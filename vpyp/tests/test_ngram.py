@@ -0,0 +1,166 @@
+import random
+import cPickle as pickle
+from itertools import product
+from nose.tools import eq_
+try:
+    import numpypy
+except ImportError:
+    pass
+import numpy
+from ..corpus import START, Vocabulary, ngrams, ngram_counts
+from ..prob import Uniform
+from ..charlm import PoissonUniformCharLM
+from ..pyp import PYP
+from ..prior import PYPPrior
+from ..ngram.model import PYPLM, AveragedLM
+from ..ngram.prune import backoff_lm, prune, prune_to_size
+from ..ngram.train import run_sampler
+
+corpus = [[2, 3, 4], [2, 3, 5, 4], [3, 4], [2, 5, 5, 3]]
+
+def check_seating(model, n_tokens):
+    level = model
+    while isinstance(level, PYPLM):
+        eq_(sum(m.total_customers for m in level.models.itervalues()), n_tokens)
+        n_tokens = sum(m.ntables for m in level.models.itervalues())
+        level = level.backoff
+    eq_(numpy.sum(level.count), n_tokens)
+
+def test_initialize():
+    n_tokens = sum(len(sentence) + 1 for sentence in corpus)
+    for tables in ('kn', 'sample'):
+        random.seed(42)
+        model = PYPLM(3, Uniform(6))
+        model.initialize(ngram_counts(corpus, 3), tables)
+        check_seating(model, n_tokens)
+        for sentence in corpus: # customers can be resampled
+            for seq in ngrams(sentence, 3):
+                model.decrement(seq[:-1], seq[-1])
+                model.increment(seq[:-1], seq[-1])
+        check_seating(model, n_tokens)
+
+def test_contexts():
+    model = PYPLM(3, Uniform(6))
+    for sentence in corpus:
+        for seq in ngrams(sentence, 3):
+            model.increment(seq[:-1], seq[-1])
+    contexts = set(seq[:-1] for sentence in corpus for seq in ngrams(sentence, 3))
+    eq_(set(model.models.keys()), contexts)
+    eq_(set(model.backoff.models.keys()), set(ctx[1:] for ctx in contexts))
+    for ctx, m in model.models.iteritems():
+        assert m.base is model.backoff.models[ctx[1:]]
+    # unseen contexts back off to their longest seen suffix
+    eq_(model.prob((4, 4), 3), model.backoff.prob((4,), 3))
+    eq_(model.prob((4, 5), 3), model.backoff.prob((5,), 3))
+
+class CountingUniform(Uniform):
+    calls = 0
+    def prob(self, k):
+        self.calls += 1
+        return super(CountingUniform, self).prob(k)
+
+def test_increment():
+    random.seed(1)
+    base = CountingUniform(6)
+    model, n_tokens = PYPLM(4, base), 0
+    for _ in xrange(5):
+        for sentence in corpus:
+            for seq in ngrams(sentence, 4):
+                model.increment(seq[:-1], seq[-1])
+                n_tokens += 1
+    check_seating(model, n_tokens)
+    assert base.calls <= n_tokens # at most one base evaluation per token
+
+def test_continue():
+    random.seed(3)
+    vocabulary = Vocabulary(init=[u'a', u'bb', u'cde', u'abcd'])
+    model = PYPLM(3, PoissonUniformCharLM(vocabulary))
+    model.vocabulary = vocabulary
+    run_sampler(model, corpus, 3)
+    ll = model.log_likelihood()
+    model = pickle.loads(pickle.dumps(model, -1)) # saved and continued
+    assert abs(model.log_likelihood() - ll) < 1e-9
+    check_seating(model, sum(len(sentence) + 1 for sentence in corpus))
+    new_corpus = [[6, 2, 7], [7, 3, 4, 6]] # new words
+    model.vocabulary[u'fg'], model.vocabulary[u'hij']
+    model.extend_vocabulary(len(model.vocabulary))
+    run_sampler(model, new_corpus, 5, seated=corpus, seated_fraction=0.5)
+    check_seating(model, sum(len(sentence) + 1 for sentence in corpus + new_corpus))
+    assert model.prob((2, 3), 7) > 0 and model.log_likelihood() < 0
+
+def test_resample_base():
+    random.seed(2)
+    n_tokens = sum(len(sentence) + 1 for sentence in corpus)
+    model = PYPLM(3, Uniform(6))
+    model.initialize(ngram_counts(corpus, 3), 'sample')
+    for _ in xrange(3):
+        model.resample_base()
+        check_seating(model, n_tokens)
+    base = PYP(Uniform(6), PYPPrior(1.0, 1.0, 1.0, 1.0, 0.5, 1.0))
+    model = PYPLM(2, base)
+    model.initialize(ngram_counts(corpus, 2), 'sample')
+    model.resample_base()
+    eq_(base.total_customers, model.backoff.models[()].ntables)
+    eq_(base.base.count, base.ntables)
+
+def trained_lm(order, seed=3):
+    random.seed(seed)
+    model = PYPLM(order, Uniform(6))
+    model.vocabulary = Vocabulary(init=['a', 'b', 'c', 'd'])
+    for _ in xrange(3):
+        for sentence in corpus:
+            for seq in ngrams(sentence, order):
+                model.increment(seq[:-1], seq[-1])
+    return model
+
+def histories(order):
+    """ contexts of the test vocabulary, <s> only at their start """
+    for ctx in product(range(0, 6), repeat=order-1):
+        if START not in ctx[ctx.count(START):]:
+            yield ctx
+
+def check_normalized(lm, expected):
+    for ctx in histories(lm.order):
+        assert abs(sum(lm.prob(ctx, w) for w in xrange(0, 6)) - expected(ctx)) < 1e-12
+
+def test_backoff_lm():
+    model = trained_lm(3)
+    lm = backoff_lm(model, set(xrange(2, 6)))
+    for ctx in histories(3):
+        for w in xrange(1, 6):
+            if START not in ctx or lm.history(ctx) + (w,) in lm.probs[len(lm.history(ctx))]:
+                assert abs(lm.prob(ctx, w) - model.prob(ctx, w)) < 1e-12
+    check_normalized(lm, lambda ctx: sum(model.prob(ctx, w) for w in xrange(0, 6)))
+
+def test_averaged_backoff_lm():
+    chains = [trained_lm(3, seed) for seed in (3, 4)]
+    model = AveragedLM(chains)
+    model.vocabulary = chains[0].vocabulary
+    lm = backoff_lm(model, set(xrange(2, 6)))
+    listed = [backoff_lm(chain, set(xrange(2, 6))).probs for chain in chains]
+    for n in xrange(3):
+        eq_(set(lm.probs[n]), set(listed[0][n]) | set(listed[1][n]))
+        for ngram, p in lm.probs[n].iteritems():
+            ctx = ngram[:-1]
+            if ctx[:1] == (START,): ctx = (START,)*(2-n)+ctx
+            assert abs(p - model.prob(ctx, ngram[-1])) < 1e-12
+    check_normalized(lm, lambda ctx: 1)
+
+def test_prune():
+    model = trained_lm(3)
+    lm = backoff_lm(model, set(xrange(2, 6)))
+    unpruned = lm.copy()
+    prune(lm, float('-inf'))
+    eq_(lm.probs, unpruned.probs)
+    for size in (15, 10):
+        pruned = prune_to_size(unpruned, size)
+        assert len(pruned) <= size
+        for n in (1, 2): # contexts of the remaining n-grams are kept
+            for ngram in pruned.probs[n]:
+                assert ngram[:-1] in pruned.probs[n-1]
+    for order, threshold in ((3, 1e-3), (4, 1e-2)):
+        unpruned = backoff_lm(trained_lm(order), set(xrange(2, 6)))
+        lm = unpruned.copy()
+        prune(lm, threshold)
+        assert len(lm) < len(unpruned)
+        check_normalized(lm, lambda ctx: sum(unpruned.prob(ctx, w) for w in xrange(0, 6)))
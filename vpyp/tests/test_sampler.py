@@ -0,0 +1,58 @@
+import time
+import random
+from nose.tools import eq_
+from ..sampler import Schedule, Sampler
+from ..chains import split_rhat, run_chains
+
+class Model(object):
+    def __init__(self):
+        self.evaluations = self.resamplings = 0
+
+    def log_likelihood(self):
+        self.evaluations += 1
+        return -1.0
+
+    def resample_hyperparemeters(self, n_iter):
+        self.resamplings += 1
+        return (n_iter, 0)
+
+def test_schedule():
+    schedule = Schedule(ll_every=10, resample_every=30)
+    eq_([it for it in range(60) if schedule.evaluate(it, 1.0)], [0, 10, 20, 30, 40, 50])
+    eq_([it for it in range(60) if schedule.resample(it)], [29, 59])
+    eq_([it for it in range(6) if Schedule(base_every=2).resample_base(it)], [1, 3, 5])
+    schedule = Schedule(ll_every=0, ll_fraction=0.5) # adaptive
+    assert schedule.evaluate(0, 1.0)
+    schedule.evaluated(2.0) # evaluation costs 2 sweeps: wait for 4 sweeps
+    eq_([schedule.evaluate(it, 1.0) for it in range(1, 5)], [False, False, False, True])
+
+def test_sampler():
+    model, iterations = Model(), []
+    sampler = Sampler(model, lambda it: None, 10, Schedule(ll_every=2, resample_every=3),
+            hooks=[('hook', iterations.append)])
+    eq_(sampler.run(6, start=1), 6)
+    eq_(iterations, [2, 3, 4, 5, 6])
+    eq_((model.evaluations, model.resamplings), (2, 2))
+    # the second iteration would end after the budget
+    sampler = Sampler(Model(), lambda it: time.sleep(0.02), 10, Schedule(time_budget=0.03))
+    eq_(sampler.run(6), 1)
+
+def test_split_rhat():
+    random.seed(1)
+    mixed = [[random.gauss(0, 1) for _ in xrange(200)] for _ in xrange(4)]
+    assert split_rhat(mixed) < 1.05
+    assert split_rhat([trace[:100] + [x + 5 for x in trace[100:]] for trace in mixed]) > 1.5
+    assert split_rhat([[x + 3 * c for x in trace] for c, trace in enumerate(mixed)]) > 1.5
+
+def run_chain(chain, report, stopped):
+    rng = random.Random(chain)
+    for it in xrange(1000):
+        if stopped(): return it
+        report({'x': rng.gauss(0, 1)})
+        time.sleep(0.001)
+    return it
+
+def test_chains():
+    iterations = run_chains(3, run_chain)
+    eq_(len(iterations), 3)
+    assert all(it < 999 for it in iterations)